@@ -4,6 +4,7 @@ from django import forms
 from django.contrib.auth.models import User
 from django.contrib.auth.admin import UserAdmin
 # Register your models here.
+admin.site.register(models.ElectionSettings)
 admin.site.register(models.Position)
 admin.site.register(models.Candidate)
 admin.site.register(models.Vote)
@@ -0,0 +1,158 @@
+# main/admission.py
+"""
+Admission control ("virtual waiting room") for the ballot.
+
+Only VOTE_ADMISSION_CAPACITY voters may hold an open ballot at once.
+Everyone else gets a ticket and waits on a light polling page until a
+slot frees up, in the order they arrived. Slots and tickets live in the
+shared store so the cap holds across all gunicorn workers.
+
+A slot is released when the voter leaves the ballot (the vote view
+redirects after a successful submission, an "already voted" check or an
+error) or when its lease runs out. Tickets that stop polling are dropped
+so voters who closed the tab do not hold up the queue.
+"""
+import time
+from collections import namedtuple
+from functools import wraps
+
+from django.conf import settings
+from django.http import HttpResponseRedirect
+from django.shortcuts import redirect
+
+from . import elections, shared_store
+
+Admission = namedtuple('Admission', ['admitted', 'position', 'eta_seconds'])
+
+# How quickly the average time-on-ballot follows recent voters
+_HOLD_SMOOTHING = 0.2
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def is_enabled():
+    return _setting('VOTE_ADMISSION_ENABLED', True)
+
+
+def capacity():
+    return _setting('VOTE_ADMISSION_CAPACITY', 50)
+
+
+def _ensure_tables(conn):
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS admission_slot ('
+        ' user_id INTEGER PRIMARY KEY,'
+        ' admitted_at REAL NOT NULL,'
+        ' expires_at REAL NOT NULL)'
+    )
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS admission_ticket ('
+        ' ticket INTEGER PRIMARY KEY AUTOINCREMENT,'
+        ' user_id INTEGER NOT NULL UNIQUE,'
+        ' last_seen REAL NOT NULL)'
+    )
+
+
+def _average_hold():
+    return shared_store.get('admission:avg_hold', _setting('VOTE_ADMISSION_DEFAULT_HOLD', 90))
+
+
+def _eta(position):
+    """Rough wait estimate: voters ahead of you, served `capacity` at a time"""
+    return int(round(position * _average_hold() / max(capacity(), 1)))
+
+
+def try_admit(user_id):
+    """
+    Admit the user if they already hold a slot or one is free for them.
+
+    Otherwise the user keeps (or is given) a place in the queue, and the
+    returned Admission carries their 1-based position and an ETA.
+    """
+    now = time.time()
+    slot_ttl = _setting('VOTE_ADMISSION_SLOT_TTL', 600)
+    ticket_ttl = _setting('VOTE_ADMISSION_TICKET_TTL', 30)
+
+    with shared_store.transaction() as conn:
+        _ensure_tables(conn)
+        conn.execute('DELETE FROM admission_slot WHERE expires_at < ?', (now,))
+        conn.execute('DELETE FROM admission_ticket WHERE last_seen < ?', (now - ticket_ttl,))
+
+        held = conn.execute(
+            'UPDATE admission_slot SET expires_at = ? WHERE user_id = ?',
+            (now + slot_ttl, user_id),
+        ).rowcount
+        if held:
+            return Admission(True, 0, 0)
+
+        in_use = conn.execute('SELECT COUNT(*) FROM admission_slot').fetchone()[0]
+        free = capacity() - in_use
+
+        row = conn.execute('SELECT ticket FROM admission_ticket WHERE user_id = ?', (user_id,)).fetchone()
+        if row:
+            ahead = conn.execute(
+                'SELECT COUNT(*) FROM admission_ticket WHERE ticket < ?', (row[0],)
+            ).fetchone()[0]
+        else:
+            ahead = conn.execute('SELECT COUNT(*) FROM admission_ticket').fetchone()[0]
+
+        # Free slots go to the head of the queue first, so a newcomer only
+        # walks straight in when nobody is waiting ahead of them.
+        if ahead < free:
+            conn.execute('DELETE FROM admission_ticket WHERE user_id = ?', (user_id,))
+            conn.execute(
+                'INSERT INTO admission_slot (user_id, admitted_at, expires_at) VALUES (?, ?, ?)',
+                (user_id, now, now + slot_ttl),
+            )
+            return Admission(True, 0, 0)
+
+        if row:
+            conn.execute('UPDATE admission_ticket SET last_seen = ? WHERE user_id = ?', (now, user_id))
+        else:
+            conn.execute('INSERT INTO admission_ticket (user_id, last_seen) VALUES (?, ?)', (user_id, now))
+
+    position = ahead + 1
+    return Admission(False, position, _eta(position))
+
+
+def release(user_id):
+    """Give the user's slot back and fold their time on the ballot into the ETA average"""
+    now = time.time()
+    with shared_store.transaction() as conn:
+        _ensure_tables(conn)
+        row = conn.execute('SELECT admitted_at FROM admission_slot WHERE user_id = ?', (user_id,)).fetchone()
+        if not row:
+            return
+        conn.execute('DELETE FROM admission_slot WHERE user_id = ?', (user_id,))
+        held_for = now - row[0]
+        average = _average_hold()
+        shared_store.set('admission:avg_hold', average + _HOLD_SMOOTHING * (held_for - average))
+
+
+def admission_required(view_func):
+    """
+    Gate a view behind the waiting room.
+
+    Voters without a slot are sent to the waiting room. Any redirect from
+    the wrapped view means the voter is done with the ballot, so the slot
+    is released straight away for the next person in line.
+    """
+    @wraps(view_func)
+    def _wrapped(request, *args, **kwargs):
+        if not is_enabled():
+            return view_func(request, *args, **kwargs)
+
+        admission = try_admit(request.user.id)
+        if not admission.admitted:
+            # The waiting room sends the voter back without the query string
+            elections.remember(request)
+            return redirect('vote_waiting_room')
+
+        response = view_func(request, *args, **kwargs)
+        if isinstance(response, HttpResponseRedirect):
+            release(request.user.id)
+        return response
+
+    return _wrapped
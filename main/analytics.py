@@ -0,0 +1,191 @@
+# main/analytics.py
+"""
+Vectorized ballot analytics with NumPy.
+
+load_votes() reads every vote in one query into integer columns (voter,
+position, candidate, answer code, UNIX timestamp). The functions below
+work on those columns with array operations instead of a query or a
+Python loop per candidate:
+
+- tally(): votes per (position, candidate, vote_type, choice), the same
+  Counter tallies.vote_counts() returns;
+- abstention(): per position, how many voters skipped it;
+- turnout_curve(): cumulative ballots over time;
+- co_selection(): how voters' answers on one position line up with
+  their answers on another.
+
+`manage.py bench_tally` compares this with the ORM counting.
+"""
+from collections import Counter
+from dataclasses import dataclass
+from functools import cached_property
+
+import numpy as np
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from . import ballot_shards, elections
+from .models import Position, Vote
+
+# Answer codes for the `answer` column; -1 is anything else
+ANSWERS = (
+    (Vote.MULTIPLE_CANDIDATES, 'selected'),
+    (Vote.SINGLE_CANDIDATE, 'yes'),
+    (Vote.SINGLE_CANDIDATE, 'no'),
+)
+
+_DTYPE = np.dtype([
+    ('voter', np.int64),
+    ('position', np.int64),
+    ('candidate', np.int64),
+    ('answer', np.int8),
+    ('timestamp', np.int64),
+])
+
+
+@dataclass
+class VoteColumns:
+    """One array per column, all of the same length (one entry per vote)"""
+    voter: np.ndarray
+    position: np.ndarray
+    candidate: np.ndarray
+    answer: np.ndarray
+    timestamp: np.ndarray  # seconds since the epoch, UTC
+
+    def __len__(self):
+        return len(self.voter)
+
+    @cached_property
+    def voters(self):
+        """(distinct voter ids, index of each vote's voter in them)"""
+        return np.unique(self.voter, return_inverse=True)
+
+
+def _select(table, placeholder, where=''):
+    # Both stores are SQLite; answers are coded and timestamps converted
+    # in the query so no per-row Python work is needed
+    cases = ' '.join(
+        f'WHEN vote_type = {placeholder} AND choice = {placeholder} THEN {code}' for code in range(len(ANSWERS))
+    )
+    percent = '%%' if placeholder == '%s' else '%'  # escaped for Django's cursor
+    sql = (f"SELECT voter_id, position_id, candidate_id, CASE {cases} ELSE -1 END,"
+           f" CAST(strftime('{percent}s', timestamp) AS INTEGER) FROM {table}{where}")
+    params = [value for answer in ANSWERS for value in answer]
+    return sql, params
+
+
+def load_votes(using=None, election=None):
+    """
+    Every stored vote as a VoteColumns, in one query (one per shard with
+    BALLOT_SHARDS). `election` (an instance or id) limits it to that
+    election's votes; `using` reads main_vote from another database alias.
+    """
+    store = ballot_shards.get_store() if using is None else None
+    if store is not None:
+        where = ''
+        if election is not None:
+            # Shards have no election column; its positions stand for it
+            position_ids = [int(pk) for pk in Position.objects.filter(election=election).values_list('id', flat=True)]
+            where = f" WHERE position_id IN ({','.join(map(str, position_ids)) or 'NULL'})"
+        sql, params = _select('vote', '?', where)
+        rows = np.concatenate([
+            np.fromiter(shard_rows, dtype=_DTYPE, count=len(shard_rows))
+            for shard_rows in store.gather(sql, params)
+        ] or [np.empty(0, dtype=_DTYPE)])
+    else:
+        connection = connections[using or DEFAULT_DB_ALIAS]
+        where = ' WHERE election_id = %s' if election is not None else ''
+        sql, params = _select(connection.ops.quote_name(Vote._meta.db_table), '%s', where)
+        if election is not None:
+            params.append(elections.election_id(election))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = np.fromiter(cursor, dtype=_DTYPE)
+    return VoteColumns(*(rows[name] for name in _DTYPE.names))
+
+
+def tally(columns):
+    """Counter of (position_id, candidate_id, vote_type, choice) -> votes"""
+    known = columns.answer >= 0
+    # A candidate stands for one position, so (candidate, answer) is the key
+    keys = columns.candidate[known] * len(ANSWERS) + columns.answer[known]
+    unique, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    positions = columns.position[known][first]
+    return Counter({
+        (int(position), int(key // len(ANSWERS)), *ANSWERS[key % len(ANSWERS)]): int(n)
+        for position, key, n in zip(positions, unique, counts)
+    })
+
+
+def abstention(columns, electorate=None):
+    """
+    dict of position_id -> {'voted', 'skipped', 'rate'}. `skipped` counts
+    voters who cast a ballot but left the position blank. With
+    `electorate` (the number of eligible voters) it counts everyone who
+    didn't vote for the position, and `rate` is relative to it.
+    """
+    ballots = len(columns.voters[0])
+    base = ballots if electorate is None else electorate
+    positions, voted = np.unique(columns.position, return_counts=True)  # one vote per voter and position
+    skipped = base - voted
+    rates = skipped / base if base else np.zeros(len(voted))
+    return {
+        int(position): {'voted': int(v), 'skipped': int(s), 'rate': float(r)}
+        for position, v, s, r in zip(positions, voted, skipped, rates)
+    }
+
+
+def ballot_times(columns):
+    """Sorted UNIX time of each voter's ballot (their earliest vote)"""
+    if not len(columns):
+        return np.empty(0, dtype=np.int64)
+    order = np.lexsort((columns.timestamp, columns.voter))
+    voters = columns.voter[order]
+    first = np.flatnonzero(np.r_[True, voters[1:] != voters[:-1]])
+    return np.sort(columns.timestamp[order][first])
+
+
+def turnout_curve(columns, bucket_seconds=300):
+    """
+    (bucket start times as datetime64[s], cumulative ballots at the end
+    of each bucket), from the first ballot to the last.
+    """
+    times = ballot_times(columns)
+    if not len(times):
+        return np.empty(0, dtype='datetime64[s]'), np.empty(0, dtype=np.int64)
+    start = times[0] - times[0] % bucket_seconds
+    per_bucket = np.bincount((times - start) // bucket_seconds)
+    starts = start + bucket_seconds * np.arange(len(per_bucket))
+    return starts.astype('datetime64[s]'), np.cumsum(per_bucket)
+
+
+def _options(columns, mask):
+    """Dense option codes for the votes in `mask`, and the (candidate_id, choice) each code stands for"""
+    keys = columns.candidate[mask] * len(ANSWERS) + columns.answer[mask]
+    unique, codes = np.unique(keys, return_inverse=True)
+    labels = [(int(key // len(ANSWERS)), ANSWERS[key % len(ANSWERS)][1]) for key in unique]
+    return codes, labels
+
+
+def co_selection(columns, position_a, position_b):
+    """
+    How answers on two positions combine: (row labels, column labels,
+    matrix), where matrix[i, j] is the number of voters who gave answer
+    i on position_a and answer j on position_b. Labels are
+    (candidate_id, choice) pairs.
+    """
+    in_a = (columns.position == position_a) & (columns.answer >= 0)
+    in_b = (columns.position == position_b) & (columns.answer >= 0)
+    codes_a, labels_a = _options(columns, in_a)
+    codes_b, labels_b = _options(columns, in_b)
+
+    # Line the two positions' answers up by voter
+    voters, voter_index = columns.voters
+    answer_a = np.full(len(voters), -1)
+    answer_b = np.full(len(voters), -1)
+    answer_a[voter_index[in_a]] = codes_a
+    answer_b[voter_index[in_b]] = codes_b
+    both = (answer_a >= 0) & (answer_b >= 0)
+
+    cells = np.bincount(answer_a[both] * len(labels_b) + answer_b[both],
+                        minlength=len(labels_a) * len(labels_b))
+    return labels_a, labels_b, cells.reshape(len(labels_a), len(labels_b))
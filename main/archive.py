@@ -0,0 +1,161 @@
+# main/archive.py
+"""
+Archiving a closed election and clearing its rows from the live tables.
+
+export() writes everything about one election into one compressed NumPy
+archive (.npz, readable without pickle):
+- the ballots as columns, the same ones main/analytics.py works on
+  (votes_voter, votes_position, votes_candidate, votes_answer,
+  votes_timestamp), with `answers` naming the answer codes;
+- the tally (tally_position, tally_candidate, tally_answer, tally_votes);
+- positions, candidates, turnout buckets and the election's audit tree
+  leaves;
+- `meta`: JSON with the ElectionSettings, counts and the audit root.
+
+load() reads the ballot columns back as a VoteColumns, so the analytics
+work on an archived election exactly as on a live one.
+
+clear() deletes the election's votes, turnout buckets, candidates and
+positions with one DELETE per table, inside one transaction. Deleting
+through the ORM would load every row to cascade and send signals one by
+one. Users stay: they are the voter roll. The audit tree stays too: it
+covers every election, and its roots have been published. The
+election's leaves are only unlinked from it (election = NULL), the way
+a deleted election leaves them, so verify_audit no longer expects
+their votes in the live tables.
+"""
+import json
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import analytics, ballot_shards, merkle, tallies
+from .models import AuditLeaf, Candidate, Position, TurnoutBucket, Vote
+from .versions import bump_ballot_version, bump_results_version
+
+FORMAT_VERSION = 2
+
+# Children before parents, so no foreign key ever points at a deleted row.
+# Each DELETE is limited to the election by the WHERE clause given here.
+_CLEARED_MODELS = (
+    (Vote, "election_id = %s"),
+    (TurnoutBucket, "election_id = %s"),
+    (Candidate, "candidate_position_id IN (SELECT id FROM {position} WHERE election_id = %s)"),
+    (Position, "election_id = %s"),
+)
+
+_SETTINGS_FIELDS = ('election_name', 'is_active', 'is_manual_override', 'scheduled_start',
+                    'scheduled_end', 'manual_start_time', 'manual_end_time', 'created_at')
+
+
+def _strings(values):
+    # Fixed-width unicode, so np.load() needs no pickle
+    return np.array(list(values), dtype=np.str_) if values else np.array([], dtype='<U1')
+
+
+def _election_meta(election):
+    meta = {'id': election.id}
+    for name in _SETTINGS_FIELDS:
+        value = getattr(election, name)
+        meta[name] = value.isoformat() if hasattr(value, 'isoformat') else value
+    return meta
+
+
+def export(path, election):
+    """Write the election to `path` (.npz); returns the meta dict stored in it"""
+    columns = analytics.load_votes(election=election)
+    codes = columns.answer >= 0
+    keys, first, counts = np.unique(columns.candidate[codes] * len(analytics.ANSWERS) + columns.answer[codes],
+                                    return_index=True, return_counts=True)
+
+    positions = list(Position.objects.filter(election=election).order_by('id')
+                     .values_list('id', 'position_name', 'description'))
+    candidates = list(Candidate.objects.filter(candidate_position__election=election).order_by('id')
+                      .values_list('id', 'candidate_position', 'candidate_name',
+                                   'candidate_name__first_name', 'candidate_name__last_name'))
+    buckets = list(TurnoutBucket.objects.filter(election=election).values_list('minute', 'ballots'))
+    leaves = list(AuditLeaf.objects.filter(election=election).order_by('index')
+                  .values_list('index', 'leaf_hash', 'ballot'))
+    audit_size, audit_root = merkle.root()
+
+    meta = {
+        'format': FORMAT_VERSION,
+        'archived_at': timezone.now().isoformat(),
+        'election': _election_meta(election),
+        'total_voters': User.objects.count(),
+        'voted': tallies.voted_count(election),
+        'votes': len(columns),
+        'audit': {'tree_size': audit_size, 'root': audit_root, 'hash': 'sha256', 'tree': 'RFC 6962'},
+    }
+    np.savez_compressed(
+        path,
+        meta=np.array(json.dumps(meta)),
+        answers=_strings(f"{vote_type}:{choice}" for vote_type, choice in analytics.ANSWERS),
+        votes_voter=columns.voter,
+        votes_position=columns.position,
+        votes_candidate=columns.candidate,
+        votes_answer=columns.answer,
+        votes_timestamp=columns.timestamp,
+        tally_position=columns.position[codes][first],
+        tally_candidate=keys // len(analytics.ANSWERS),
+        tally_answer=(keys % len(analytics.ANSWERS)).astype(np.int8),
+        tally_votes=counts,
+        position_id=np.array([p[0] for p in positions], dtype=np.int64),
+        position_name=_strings(p[1] for p in positions),
+        position_description=_strings(p[2] for p in positions),
+        candidate_id=np.array([c[0] for c in candidates], dtype=np.int64),
+        candidate_position=np.array([c[1] for c in candidates], dtype=np.int64),
+        candidate_user=np.array([c[2] for c in candidates], dtype=np.int64),
+        candidate_name=_strings(f"{c[3]} {c[4]}" for c in candidates),
+        turnout_minute=np.array([int(minute.timestamp()) for minute, _ in buckets], dtype=np.int64),
+        turnout_ballots=np.array([n for _, n in buckets], dtype=np.int64),
+        audit_leaf_index=np.array([index for index, _, _ in leaves], dtype=np.int64),
+        audit_leaf_hash=_strings(leaf for _, leaf, _ in leaves),
+        audit_ballot=_strings(ballot for _, _, ballot in leaves),
+    )
+    return meta
+
+
+def load(path):
+    """(VoteColumns, meta) from an archive written by export()"""
+    with np.load(path, allow_pickle=False) as data:
+        columns = analytics.VoteColumns(
+            data['votes_voter'], data['votes_position'], data['votes_candidate'],
+            data['votes_answer'], data['votes_timestamp'],
+        )
+        return columns, json.loads(str(data['meta']))
+
+
+def clear(election):
+    """Delete the election's rows from the live tables; returns {table: rows deleted}"""
+    position_ids = list(Position.objects.filter(election=election).values_list('id', flat=True))
+    position_table = connection.ops.quote_name(Position._meta.db_table)
+    deleted = {}
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            for model, where in _CLEARED_MODELS:
+                table = connection.ops.quote_name(model._meta.db_table)
+                cursor.execute(f"DELETE FROM {table} WHERE {where.format(position=position_table)}", [election.id])
+                deleted[model._meta.db_table] = cursor.rowcount
+            leaves = connection.ops.quote_name(AuditLeaf._meta.db_table)
+            cursor.execute(f"UPDATE {leaves} SET election_id = NULL WHERE election_id = %s", [election.id])
+    store = ballot_shards.get_store()
+    if store is not None:
+        # Separate files: part of the shards' own transactions when the
+        # caller holds store.write_lock() (see archive_election)
+        store.clear(position_ids)
+    bump_ballot_version()
+    bump_results_version()
+    return deleted
+
+
+def reset_settings(election, name=None):
+    """Back to a fresh, inactive election with no schedule"""
+    election.election_name = name or election.election_name
+    election.is_active = False
+    election.is_manual_override = False
+    election.scheduled_start = election.scheduled_end = None
+    election.manual_start_time = election.manual_end_time = None
+    election.save()
@@ -0,0 +1,221 @@
+# main/ballot_export.py
+"""
+Columnar ballot export for analysts, instead of copies of the database.
+
+write() streams one election's votes into a NumPy .npz archive with one
+array per column, one entry per vote:
+- voter: the user id;
+- position, candidate: codes indexing the lookup tables position_id /
+  position_name and candidate_id / candidate_name / candidate_position
+  (-1 if the row has gone since);
+- answer: code indexing `answers` ('multiple:selected', 'single:yes',
+  'single:no'), the same codes as main/analytics.py; -1 is anything else;
+- timestamp: seconds since the epoch, UTC.
+`meta` is JSON with the election, the row count and the export time.
+
+The votes are read with values_list().iterator() (a cursor per shard
+with BALLOT_SHARDS), CHUNK_SIZE rows at a time. Each chunk is encoded
+with NumPy and appended to one spool file per column, so memory stays
+at one chunk however many votes there are. The spools are then copied
+into the archive as uncompressed .npy members. np.load() reads the file
+like any .npz. load() maps the columns straight from the file with
+np.memmap instead, so opening a million-row export takes no time and
+pages are only read when an analysis touches them.
+"""
+import itertools
+import json
+import os
+import shutil
+import struct
+import tempfile
+import zipfile
+
+import numpy as np
+from django.utils import timezone
+
+from . import analytics, ballot_shards, elections
+from .models import Candidate, Position, Vote
+
+CHUNK_SIZE = 50000
+FORMAT_VERSION = 1
+
+COLUMNS = (
+    ('voter', np.int64),
+    ('position', np.int32),
+    ('candidate', np.int32),
+    ('answer', np.int8),
+    ('timestamp', np.int64),
+)
+
+_ANSWER_CODES = {answer: code for code, answer in enumerate(analytics.ANSWERS)}
+
+
+def _strings(values):
+    # Fixed-width unicode, so np.load() needs no pickle
+    values = list(values)
+    return np.array(values, dtype=np.str_) if values else np.array([], dtype='<U1')
+
+
+def _lookups(election):
+    positions = list(Position.objects.filter(election=election).order_by('id')
+                     .values_list('id', 'position_name'))
+    candidates = list(Candidate.objects.filter(candidate_position__election=election).order_by('id')
+                      .values_list('id', 'candidate_position', 'candidate_name__first_name',
+                                   'candidate_name__last_name'))
+    position_ids = np.array([p[0] for p in positions], dtype=np.int64)
+    return {
+        'answers': _strings(f"{vote_type}:{choice}" for vote_type, choice in analytics.ANSWERS),
+        'position_id': position_ids,
+        'position_name': _strings(p[1] for p in positions),
+        'candidate_id': np.array([c[0] for c in candidates], dtype=np.int64),
+        'candidate_name': _strings(f"{c[2]} {c[3]}" for c in candidates),
+        'candidate_position': _codes(position_ids, np.array([c[1] for c in candidates], dtype=np.int64))
+                              .astype(np.int32),
+    }
+
+
+def _codes(ids, values):
+    """Index of each of `values` in the sorted `ids`, -1 where it isn't there"""
+    if not len(ids):
+        return np.full(len(values), -1, dtype=np.int64)
+    index = np.searchsorted(ids, values)
+    clipped = np.minimum(index, len(ids) - 1)
+    return np.where(ids[clipped] == values, clipped, -1)
+
+
+def _rows(election):
+    """(voter, position, candidate, vote_type, choice, epoch seconds) for every vote of the election, streamed"""
+    store = ballot_shards.get_store()
+    if store is not None:
+        position_ids = [int(pk) for pk in Position.objects.filter(election=election).values_list('id', flat=True)]
+        return store.iterate(
+            "SELECT voter_id, position_id, candidate_id, vote_type, choice,"
+            " CAST(strftime('%s', timestamp) AS INTEGER) FROM vote"
+            f" WHERE position_id IN ({','.join(map(str, position_ids)) or 'NULL'})"
+        )
+    rows = (Vote.objects.filter(election=election).order_by()
+            .values_list('voter_id', 'position_id', 'candidate_id', 'vote_type', 'choice', 'timestamp')
+            .iterator(chunk_size=CHUNK_SIZE))
+    return ((*row[:5], int(row[5].timestamp())) for row in rows)
+
+
+def _encode(chunk, lookups):
+    voters, positions, candidates, vote_types, choices, times = zip(*chunk)
+    return {
+        'voter': np.array(voters, dtype=np.int64),
+        'position': _codes(lookups['position_id'], np.array(positions, dtype=np.int64)).astype(np.int32),
+        'candidate': _codes(lookups['candidate_id'], np.array(candidates, dtype=np.int64)).astype(np.int32),
+        'answer': np.array([_ANSWER_CODES.get(answer, -1) for answer in zip(vote_types, choices)], dtype=np.int8),
+        'timestamp': np.array(times, dtype=np.int64),
+    }
+
+
+def _write_spooled(archive, name, dtype, count, spool):
+    """A column member: the .npy header, then the spooled bytes as they are"""
+    header = {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': False, 'shape': (count,)}
+    spool.seek(0)
+    with archive.open(f"{name}.npy", 'w', force_zip64=True) as member:
+        np.lib.format.write_array_header_1_0(member, header)
+        shutil.copyfileobj(spool, member, 1 << 20)
+
+
+def _write_array(archive, name, array):
+    with archive.open(f"{name}.npy", 'w', force_zip64=True) as member:
+        np.lib.format.write_array(member, array, allow_pickle=False)
+
+
+def write(out, election=None):
+    """
+    Export the votes of `election` (default: the default election) to
+    `out`, a path or a seekable binary file; returns the meta dict
+    """
+    election = elections.resolve(election)
+    lookups = _lookups(election)
+    count = 0
+    with tempfile.TemporaryDirectory(prefix='ballot-export-') as spool_dir:
+        spools = {name: open(os.path.join(spool_dir, name), 'w+b') for name, _ in COLUMNS}
+        try:
+            rows = _rows(election)
+            while True:
+                chunk = list(itertools.islice(rows, CHUNK_SIZE))
+                if not chunk:
+                    break
+                count += len(chunk)
+                for name, column in _encode(chunk, lookups).items():
+                    spools[name].write(column.tobytes())
+
+            meta = {
+                'format': FORMAT_VERSION,
+                'exported_at': timezone.now().isoformat(),
+                'election': {'id': election.id, 'name': election.election_name},
+                'votes': count,
+                'columns': [name for name, _ in COLUMNS],
+            }
+            # Stored, not deflated: load() maps the column bytes in place
+            with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+                for name, dtype in COLUMNS:
+                    _write_spooled(archive, name, dtype, count, spools[name])
+                for name, array in lookups.items():
+                    _write_array(archive, name, array)
+                _write_array(archive, 'meta', np.array(json.dumps(meta)))
+        finally:
+            for spool in spools.values():
+                spool.close()
+    return meta
+
+
+def _data_offset(f, info):
+    """Where the .npy of a stored zip member starts in the file"""
+    f.seek(info.header_offset)
+    local_header = f.read(30)
+    name_length, extra_length = struct.unpack('<HH', local_header[26:30])
+    return info.header_offset + 30 + name_length + extra_length
+
+
+def load(path, mmap=True):
+    """
+    (dict of name -> array, meta) from a file written by write(). With
+    `mmap`, the vote columns are read-only np.memmap views of the file.
+    """
+    if not mmap:
+        with np.load(path, allow_pickle=False) as data:
+            arrays = {name: data[name] for name in data.files}
+        return arrays, json.loads(str(arrays.pop('meta')))
+
+    columns = {name for name, _ in COLUMNS}
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            name = info.filename[:-len('.npy')]
+            if name not in columns or info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member, allow_pickle=False)
+                continue
+            f.seek(_data_offset(f, info))
+            version = np.lib.format.read_magic(f)
+            read_header = (np.lib.format.read_array_header_1_0 if version == (1, 0)
+                           else np.lib.format.read_array_header_2_0)
+            shape, fortran_order, dtype = read_header(f)
+            if not shape[0]:
+                arrays[name] = np.empty(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                                         order='F' if fortran_order else 'C')
+    return arrays, json.loads(str(arrays.pop('meta')))
+
+
+def vote_columns(arrays):
+    """The export as an analytics.VoteColumns (position and candidate ids instead of codes)"""
+    def ids(table, codes):
+        codes = np.asarray(codes)
+        if not len(table):
+            return np.full(len(codes), -1, dtype=np.int64)
+        return np.where(codes >= 0, table[np.maximum(codes, 0)], -1)
+
+    return analytics.VoteColumns(
+        np.asarray(arrays['voter']),
+        ids(arrays['position_id'], arrays['position']),
+        ids(arrays['candidate_id'], arrays['candidate']),
+        np.asarray(arrays['answer']),
+        np.asarray(arrays['timestamp']),
+    )
@@ -0,0 +1,311 @@
+# main/ballot_shards.py
+"""
+Optional sharded ballot store.
+
+SQLite allows one writer per file, so however many workers we run,
+ballots commit one at a time. With BALLOT_SHARDS = N (> 0), ballots go
+to N separate SQLite files under BALLOT_SHARD_DIR instead of main_vote.
+A voter's shard is picked by a hash of their user id, and different
+shards are written in parallel.
+
+Each shard has:
+- vote: the same columns as main.Vote (less election_id), with
+  UNIQUE(voter_id, position_id). That makes a second ballot from the same
+  voter in the same election fail inside the shard's transaction.
+- voter_status: one row per voter who has voted in any election.
+
+Positions belong to one election, so reads for one election filter on
+that election's position ids (`position_ids`) rather than on a column
+the shard files don't have.
+
+A voter's whole ballot lives in a single shard, so per-voter checks touch
+one file. Tallies and voter lists read every shard in parallel and
+combine the results (see main/tallies.py). Distinct-voter counts can be
+summed because no voter spans two shards.
+
+Users, positions and candidates stay in the main database. Shard rows
+only carry their ids.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils import timezone
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS voter_status ('
+    ' voter_id INTEGER PRIMARY KEY,'
+    ' voted_at TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS vote ('
+    ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+    ' voter_id INTEGER NOT NULL,'
+    ' position_id INTEGER NOT NULL,'
+    ' candidate_id INTEGER NOT NULL,'
+    ' vote_type TEXT NOT NULL,'
+    ' choice TEXT NOT NULL,'
+    ' timestamp TEXT NOT NULL,'
+    ' UNIQUE (voter_id, position_id))',
+    # Same covering tally index as main.Vote
+    'CREATE INDEX IF NOT EXISTS vote_tally ON vote (position_id, candidate_id, vote_type, choice)',
+    'CREATE INDEX IF NOT EXISTS vote_candidate ON vote (candidate_id)',
+)
+
+VOTE_COLUMNS = ('id', 'voter_id', 'position_id', 'candidate_id', 'vote_type', 'choice', 'timestamp')
+
+_local = threading.local()
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def shard_count():
+    return int(getattr(settings, 'BALLOT_SHARDS', 0) or 0)
+
+
+def is_enabled():
+    return shard_count() > 0
+
+
+def shard_dir():
+    return str(getattr(settings, 'BALLOT_SHARD_DIR', os.path.join(settings.BASE_DIR, 'ballot_shards')))
+
+
+def shard_index(voter_id, count):
+    """Stable shard number for a voter (same in every process, unlike hash())"""
+    digest = hashlib.blake2b(str(voter_id).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % count
+
+
+class ShardedBallotStore:
+    """N SQLite files holding ballots, partitioned by voter"""
+
+    def __init__(self, directory, count, synchronous='NORMAL'):
+        if count < 1:
+            raise ValueError("a sharded store needs at least one shard")
+        self.directory = str(directory)
+        self.count = count
+        self.synchronous = synchronous
+        self.paths = [os.path.join(self.directory, f'ballots_{i}.sqlite3') for i in range(count)]
+
+    def connection(self, index):
+        """This thread's connection to shard `index`, opening (and creating) it if needed"""
+        conns = getattr(_local, 'conns', None)
+        if conns is None:
+            conns = _local.conns = {}
+        path = self.paths[index]
+        conn = conns.get(path)
+        if conn is None:
+            os.makedirs(self.directory, exist_ok=True)
+            conn = sqlite3.connect(path, timeout=20, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(f'PRAGMA synchronous={self.synchronous}')
+            for statement in SCHEMA:
+                conn.execute(statement)
+            conns[path] = conn
+        return conn
+
+    def shard_for(self, voter_id):
+        return shard_index(voter_id, self.count)
+
+    # --- writes -----------------------------------------------------------
+
+    def write_ballot(self, voter_id, votes, before_commit=None):
+        """
+        Store one ballot atomically in the voter's shard.
+
+        `votes` is a list of (position_id, candidate_id, vote_type, choice).
+        Raises sqlite3.IntegrityError if this voter already has a ballot.
+        `before_commit`, if given, runs after the inserts and before COMMIT;
+        an exception from it rolls the ballot back. Returns the rows as dicts.
+        """
+        now = timezone.now().isoformat()
+        conn = self.connection(self.shard_for(voter_id))
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # A voter may vote in several elections; vote's UNIQUE stops a repeat in one
+            conn.execute('INSERT OR IGNORE INTO voter_status (voter_id, voted_at) VALUES (?, ?)', (voter_id, now))
+            rows = []
+            for position_id, candidate_id, vote_type, choice in votes:
+                cursor = conn.execute(
+                    'INSERT INTO vote (voter_id, position_id, candidate_id, vote_type, choice, timestamp)'
+                    ' VALUES (?, ?, ?, ?, ?, ?)',
+                    (voter_id, position_id, candidate_id, vote_type, choice, now),
+                )
+                rows.append(dict(zip(VOTE_COLUMNS, (cursor.lastrowid, voter_id, position_id,
+                                                    candidate_id, vote_type, choice, now))))
+            if before_commit is not None:
+                before_commit()
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return rows
+
+    @contextmanager
+    def write_lock(self):
+        """
+        Hold every shard's write lock for the block: ballots wait, reads
+        go on. This thread's writes inside commit together at the end (or
+        roll back on an exception).
+        """
+        started = []
+        try:
+            for index in range(self.count):
+                conn = self.connection(index)
+                conn.execute('BEGIN IMMEDIATE')
+                started.append(conn)
+            yield
+        except BaseException:
+            for conn in started:
+                conn.execute('ROLLBACK')
+            raise
+        for conn in started:
+            conn.execute('COMMIT')
+
+    def clear(self, position_ids=None):
+        """
+        Delete every ballot (or those for `position_ids`, i.e. one election)
+        from every shard; inside write_lock(), as part of its transactions
+        """
+        where, params = _positions(position_ids)
+        for index in range(self.count):
+            conn = self.connection(index)
+            own = not conn.in_transaction
+            if own:
+                conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(f'DELETE FROM vote WHERE {where}', params)
+                conn.execute('DELETE FROM voter_status WHERE voter_id NOT IN (SELECT voter_id FROM vote)')
+            except BaseException:
+                if own:
+                    conn.execute('ROLLBACK')
+                raise
+            if own:
+                conn.execute('COMMIT')
+
+    # --- single-shard reads ----------------------------------------------
+
+    def has_voted(self, voter_id, position_ids=None):
+        conn = self.connection(self.shard_for(voter_id))
+        if position_ids is None:
+            return conn.execute('SELECT 1 FROM voter_status WHERE voter_id = ?', (voter_id,)).fetchone() is not None
+        where, params = _positions(position_ids)
+        return conn.execute(f'SELECT 1 FROM vote WHERE voter_id = ? AND {where} LIMIT 1',
+                            (voter_id, *params)).fetchone() is not None
+
+    # --- scatter-gather ---------------------------------------------------
+
+    def gather(self, query, params=()):
+        """Run a read on every shard in parallel; returns one list of rows per shard"""
+        def run(index):
+            return self.connection(index).execute(query, params).fetchall()
+
+        if self.count == 1:
+            return [run(0)]
+        # sqlite3 releases the GIL while a statement runs, so shards are
+        # read concurrently
+        return list(_executor(self.count).map(run, range(self.count)))
+
+    def iterate(self, query, params=()):
+        """Run a read on each shard in turn, yielding rows as they are fetched (unlike gather(), never all at once)"""
+        for index in range(self.count):
+            yield from self.connection(index).execute(query, params)
+
+    def voted_count(self, position_ids=None):
+        if position_ids is None:
+            return sum(rows[0][0] for rows in self.gather('SELECT COUNT(*) FROM voter_status'))
+        where, params = _positions(position_ids)
+        return sum(rows[0][0] for rows in self.gather(
+            f'SELECT COUNT(DISTINCT voter_id) FROM vote WHERE {where}', params))
+
+    def voted_voter_ids(self, position_ids=None):
+        if position_ids is None:
+            query, params = 'SELECT voter_id FROM voter_status', ()
+        else:
+            where, params = _positions(position_ids)
+            query = f'SELECT DISTINCT voter_id FROM vote WHERE {where}'
+        return {voter_id for rows in self.gather(query, params) for (voter_id,) in rows}
+
+    def tally(self, position_ids=None):
+        """Counter of (position_id, candidate_id, vote_type, choice) -> votes"""
+        where, params = _positions(position_ids)
+        counts = Counter()
+        for rows in self.gather('SELECT position_id, candidate_id, vote_type, choice, COUNT(*)'
+                                f' FROM vote WHERE {where} GROUP BY position_id, candidate_id, vote_type, choice',
+                                params):
+            for position_id, candidate_id, vote_type, choice, n in rows:
+                counts[(position_id, candidate_id, vote_type, choice)] += n
+        return counts
+
+    def position_turnout(self, position_ids=None):
+        """Counter of position_id -> distinct voters (exact: a voter lives in one shard)"""
+        where, params = _positions(position_ids)
+        turnout = Counter()
+        for rows in self.gather('SELECT position_id, COUNT(DISTINCT voter_id) FROM vote'
+                                f' WHERE {where} GROUP BY position_id', params):
+            for position_id, n in rows:
+                turnout[position_id] += n
+        return turnout
+
+    def votes(self, voter_ids=None, candidate_id=None, position_ids=None):
+        """Vote rows as dicts, optionally only for some voters or one candidate, within `position_ids`"""
+        columns = ', '.join(VOTE_COLUMNS)
+        where, params = _positions(position_ids)
+        if voter_ids is not None:
+            # Only the shards that hold these voters
+            by_shard = {}
+            for voter_id in voter_ids:
+                by_shard.setdefault(self.shard_for(voter_id), []).append(voter_id)
+            rows = []
+            for index, ids in by_shard.items():
+                placeholders = ','.join('?' * len(ids))
+                rows.extend(self.connection(index).execute(
+                    f'SELECT {columns} FROM vote WHERE voter_id IN ({placeholders}) AND {where} ORDER BY id',
+                    (*ids, *params),
+                ).fetchall())
+        elif candidate_id is not None:
+            rows = [row for shard_rows in self.gather(
+                f'SELECT {columns} FROM vote WHERE candidate_id = ? AND {where} ORDER BY id', (candidate_id, *params)
+            ) for row in shard_rows]
+        else:
+            rows = [row for shard_rows in self.gather(f'SELECT {columns} FROM vote WHERE {where} ORDER BY id',
+                                                      params)
+                    for row in shard_rows]
+        return [dict(zip(VOTE_COLUMNS, row)) for row in rows]
+
+    def close(self):
+        conns = getattr(_local, 'conns', {})
+        for path in self.paths:
+            conn = conns.pop(path, None)
+            if conn is not None:
+                conn.close()
+
+
+def _positions(position_ids):
+    """SQL condition and params limiting vote rows to `position_ids` (None: no limit)"""
+    if position_ids is None:
+        return '1', ()
+    position_ids = tuple(position_ids)
+    if not position_ids:
+        return '0', ()
+    return f"position_id IN ({','.join('?' * len(position_ids))})", position_ids
+
+
+def _executor(workers):
+    """Process-wide reader pool; its threads keep their shard connections open"""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool._max_workers < workers:
+            _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ballot-shard')
+        return _pool
+
+
+def get_store():
+    """The configured store, or None when ballots live in main_vote"""
+    if not is_enabled():
+        return None
+    return ShardedBallotStore(shard_dir(), shard_count(), getattr(settings, 'BALLOT_SHARD_SYNCHRONOUS', 'NORMAL'))
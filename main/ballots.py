@@ -0,0 +1,119 @@
+# main/ballots.py
+import logging
+
+from django.db import transaction
+
+from . import ballot_shards, db, ledger, merkle, turnout
+from .models import ElectionSettings, Vote
+from .versions import bump_results_version
+
+logger = logging.getLogger(__name__)
+
+
+class VotingClosed(Exception):
+    """The ballot's election is not open for voting"""
+
+
+def check_open(election):
+    """
+    Raise VotingClosed unless `election` is open right now. Reads the
+    settings afresh: call it inside the ballot's write transaction, so a
+    close that commits first is always seen.
+    """
+    current = ElectionSettings.objects.filter(pk=election.pk).first()
+    if current is None or not current.get_voting_status():
+        raise VotingClosed(f"voting in {election.election_name} is not open")
+
+
+def ballot_rows(positions, cleaned_data):
+    """(position, candidate, vote_type, choice) for each answer on the ballot"""
+    rows = []
+    for position in positions:
+        candidates = position.candidate_position.all()
+
+        if candidates.count() > 1:
+            # Multiple candidates - get selected candidate ID
+            selected_candidate_id = cleaned_data.get(f'position_{position.id}')
+            if selected_candidate_id:
+                selected_candidate = next(c for c in candidates if c.id == int(selected_candidate_id))
+                rows.append((position, selected_candidate, Vote.MULTIPLE_CANDIDATES, 'selected'))
+        else:
+            # Single candidate - yes/no vote
+            for candidate in candidates:
+                choice = cleaned_data.get(f'candidate_{candidate.id}')
+                if choice:
+                    rows.append((position, candidate, Vote.SINGLE_CANDIDATE, choice))
+    return rows
+
+
+def record_ballot(voter, positions, cleaned_data, election):
+    """
+    Write one voter's whole ballot in a single transaction.
+
+    `positions` are the positions of `election`, with 'candidate_position'
+    prefetched; `cleaned_data` comes from a valid VotingForm. Either every
+    vote of the ballot is stored or none is, and the (voter, position)
+    unique constraint stops a second ballot from the same voter in the
+    same election. With BALLOT_SHARDS set, the ballot goes to the voter's
+    shard instead of main_vote. Raises VotingClosed, storing nothing, if
+    the election is not open when the ballot commits: published final
+    results and archives must never miss a late ballot.
+
+    The ballot is also added to the audit tree (main/merkle.py) and
+    counted in its turnout bucket (main/turnout.py). In main_vote both
+    happen in the ballot's transaction; if any of it fails, nothing is
+    stored. The ledger line (main/ledger.py) is only written once the
+    ballot has committed, so the ledger never holds a ballot the
+    database rejected.
+
+    A shard's transaction only covers the shard file, so there the order
+    is:
+    1. inside the shard transaction: the votes and the open-election
+       check (nothing in the main database is written while the shard is
+       locked);
+    2. after the shard commits: the ledger line, then the audit leaf and
+       turnout count in one main-database transaction.
+    A failed shard COMMIT thus leaves nothing behind. If step 2 fails,
+    the ballot stays stored and the error is logged: `manage.py
+    verify_audit` reports the ballot as missing from the tree and
+    `manage.py rebuild_turnout` recounts the chart.
+
+    Returns the Votes (unsaved instances when sharded).
+    """
+    rows = ballot_rows(positions, cleaned_data)
+    ids = [(p.id, c.id, vote_type, choice) for p, c, vote_type, choice in rows]
+
+    def write_ledger():
+        if not ledger.is_enabled():
+            return
+        try:
+            ledger.append(voter.id, ids, election.id)
+        except OSError:
+            logger.exception("ballot of voter %s committed but not written to the ledger", voter.id)
+
+    store = ballot_shards.get_store()
+    if store is not None:
+        store.write_ballot(voter.id, ids, before_commit=lambda: check_open(election))
+        write_ledger()
+        try:
+            with db.write_transaction():
+                merkle.append(voter, ids, election.id)
+                turnout.record(election.id)
+        except Exception:
+            logger.exception("ballot of voter %s stored in its shard without an audit leaf or turnout count",
+                             voter.id)
+        bump_results_version()
+        return [Vote(election=election, voter=voter, position=p, candidate=c, vote_type=vote_type, choice=choice)
+                for p, c, vote_type, choice in rows]
+
+    with db.write_transaction():
+        check_open(election)
+        votes = [
+            Vote.objects.create(voter=voter, position=p, candidate=c, vote_type=vote_type, choice=choice)
+            for p, c, vote_type, choice in rows
+        ]
+        merkle.append(voter, ids, election.id)
+        turnout.record(election.id)
+        transaction.on_commit(write_ledger)
+        transaction.on_commit(bump_results_version, robust=True)
+    return votes
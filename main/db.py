@@ -0,0 +1,67 @@
+# main/db.py
+"""
+SQLite tuning for the main database.
+
+Several gunicorn workers write ballots to the same SQLite file. With the
+default rollback journal a writer blocks every reader and concurrent
+writers fail with "database is locked". Migration 0011 switches the file
+to WAL once (the journal mode is stored in the file), so readers never
+block the writer. The PRAGMAs in SQLITE_PRAGMAS (settings.py) are applied
+to every new connection and make writers wait for the lock instead of
+failing.
+
+Transactions start DEFERRED, so read-only atomic() blocks never take the
+write lock. Ballot writes go through write_transaction(), which starts
+with BEGIN IMMEDIATE: a DEFERRED transaction that reads before it writes
+has to upgrade its read lock, and that upgrade fails at once, without
+waiting, when another worker holds the write lock.
+
+The read replica (main/replica.py) is a read-only snapshot and gets the
+read-side SQLITE_REPLICA_PRAGMAS instead.
+"""
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    if connection.alias == 'replica':
+        pragmas = getattr(settings, 'SQLITE_REPLICA_PRAGMAS', {})
+    else:
+        pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    if not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+@contextmanager
+def write_transaction(using=None):
+    """
+    transaction.atomic() that takes the SQLite write lock at BEGIN.
+
+    Only the outermost block starts a transaction; nested blocks and other
+    databases get a plain atomic().
+    """
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        with transaction.atomic(using=using):
+            yield
+        return
+    # transaction_mode is read from OPTIONS when the connection opens
+    connection.ensure_connection()
+    saved = connection.transaction_mode
+    connection.transaction_mode = 'IMMEDIATE'
+    try:
+        with transaction.atomic(using=using):
+            connection.transaction_mode = saved
+            yield
+    finally:
+        connection.transaction_mode = saved
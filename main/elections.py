@@ -0,0 +1,151 @@
+# main/elections.py
+"""
+Which election a request is about.
+
+Several elections (e.g. departmental ones) can run side by side. Each
+has its own positions, candidates and ballots: Position and Vote carry
+an `election` foreign key, and tallies, lists and results pages are
+all scoped to one election. The Vote indexes lead with election_id, so
+one election's queries only read that election's rows.
+
+A page takes its election from ?election=<id>, which the session then
+remembers. Otherwise it uses the default election: the newest one open
+for voting, or else the newest one. Staff pages may pick any election
+this way; the ballot only takes an open one (open_for_voting()). The default's id is also kept in the
+shared store. Pages that must not query the database (published
+results, the live stream) read it from there.
+"""
+from . import shared_store
+
+SESSION_KEY = 'election_id'
+DEFAULT_KEY = 'election:default'
+
+
+def _pick_default():
+    from .models import ElectionSettings
+    elections = list(ElectionSettings.objects.order_by('-created_at', '-id'))
+    for election in elections:
+        if election.get_voting_status():
+            return election
+    return elections[0] if elections else None
+
+
+def default():
+    """The default election, created if there is none yet"""
+    from .models import ElectionSettings
+    election = _pick_default()
+    if election is None:
+        election = ElectionSettings.objects.create(election_name="General Election")
+    if shared_store.get(DEFAULT_KEY) != election.id:
+        # A schedule can open an election without any save
+        shared_store.set(DEFAULT_KEY, election.id)
+    return election
+
+
+def refresh_default():
+    """Recompute the cached default id; called whenever an election is saved or deleted"""
+    election = _pick_default()
+    shared_store.set(DEFAULT_KEY, election.id if election else None)
+
+
+def default_id():
+    """The default election's id from the shared store (no database query); may be None"""
+    return shared_store.get(DEFAULT_KEY)
+
+
+def _parse(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def explicit_id(request):
+    """The election id in ?election=, or None; no session, no database"""
+    return _parse(request.GET.get('election'))
+
+
+def selected_id(request):
+    """The election id the request asked for (query string, then session), or None for the default"""
+    election_id = explicit_id(request)
+    if election_id is None and hasattr(request, 'session'):
+        election_id = _parse(request.session.get(SESSION_KEY))
+    return election_id
+
+
+def current_id(request):
+    """selected_id(), falling back to the default, without touching the database"""
+    election_id = selected_id(request)
+    return default_id() if election_id is None else election_id
+
+
+def query_id(request):
+    """?election=, falling back to the default; no session, so safe in async views"""
+    election_id = explicit_id(request)
+    return default_id() if election_id is None else election_id
+
+
+def remember(request):
+    """Keep an explicit ?election= in the session for the pages that follow"""
+    election_id = explicit_id(request)
+    if election_id is not None and hasattr(request, 'session'):
+        request.session[SESSION_KEY] = election_id
+
+
+def current(request=None):
+    """The election for this request; remembers an explicit ?election= in the session"""
+    from .models import ElectionSettings
+    if request is not None:
+        election_id = selected_id(request)
+        if election_id is not None:
+            election = ElectionSettings.objects.filter(pk=election_id).first()
+            if election is not None:
+                remember(request)
+                return election
+    return default()
+
+
+def open_for_voting(request):
+    """
+    The election a voter casts a ballot in, or None if it isn't open.
+
+    Unlike current(), an explicit ?election= is only honoured when that
+    election is open: a voter can't pick a closed, published or archived
+    one by id. An election remembered in the session that has since
+    closed falls back to the default.
+    """
+    from .models import ElectionSettings
+    election_id = explicit_id(request)
+    if election_id is not None:
+        election = ElectionSettings.objects.filter(pk=election_id).first()
+        if election is None or not election.get_voting_status():
+            return None
+        remember(request)
+        return election
+    election_id = selected_id(request)
+    if election_id is not None:
+        election = ElectionSettings.objects.filter(pk=election_id).first()
+        if election is not None and election.get_voting_status():
+            return election
+    election = default()
+    return election if election.get_voting_status() else None
+
+
+def all_elections():
+    from .models import ElectionSettings
+    return ElectionSettings.objects.order_by('-created_at', '-id')
+
+
+def resolve(election):
+    """An ElectionSettings for `election` (an instance, an id, or None for the default)"""
+    from .models import ElectionSettings
+    if election is None:
+        return default()
+    if isinstance(election, ElectionSettings):
+        return election
+    return ElectionSettings.objects.get(pk=election)
+
+
+def election_id(election):
+    """The id of `election` (an instance or an id); None stays None"""
+    return getattr(election, 'pk', election)
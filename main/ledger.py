@@ -0,0 +1,204 @@
+# main/ledger.py
+"""
+Append-only ballot ledger.
+
+Every ballot is also written as one line to LEDGER_PATH. The ledger does
+not depend on the SQLite file, so if db.sqlite3 (or a ballot shard) is
+lost or damaged, `manage.py replay_ledger` can rebuild main_vote and the
+tallies from it in a single pass.
+
+Line format (compact JSON, one ballot per line):
+
+    <crc32 of the JSON, 8 hex digits> {"ts":...,"voter":7,"election":1,"votes":[[position,candidate,type,choice],...]}
+
+Lines written before elections were scoped have no "election".
+
+The line is written just after the ballot's transaction commits
+(transaction.on_commit; with BALLOT_SHARDS, after the shard commits). A
+ballot the database rejects (already voted, bad data, a failed COMMIT)
+never reaches the ledger, so a replay never restores a ballot that was
+not stored. A line that cannot be written is logged; the ballot stays
+stored. Replay keeps the last ballot per voter and election.
+
+LEDGER_FSYNC controls durability:
+- 'always': fsync each line before the voter is answered (no confirmed
+  ballot is missing, even after power loss);
+- 'interval': fsync at most every LEDGER_FSYNC_INTERVAL seconds;
+- 'never': leave flushing to the OS.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+import zlib
+
+from django.conf import settings
+from django.utils import timezone
+
+try:
+    import fcntl
+except ImportError:  # POSIX only; elsewhere we rely on O_APPEND alone
+    fcntl = None
+
+
+class LedgerCorrupt(Exception):
+    """A ledger line failed its checksum or could not be parsed"""
+
+    def __init__(self, line_number, reason):
+        super().__init__(f"line {line_number}: {reason}")
+        self.line_number = line_number
+        self.reason = reason
+
+
+_lock = threading.Lock()
+_fd = None
+_fd_path = None
+_last_fsync = 0.0
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def is_enabled():
+    return _setting('LEDGER_ENABLED', True)
+
+
+def ledger_path():
+    return str(_setting('LEDGER_PATH', os.path.join(settings.BASE_DIR, 'ballots.ledger')))
+
+
+def encode(voter_id, votes, ts=None, election_id=None):
+    """One ledger line (with trailing newline) for a ballot"""
+    record = {'ts': ts or timezone.now().isoformat(), 'voter': voter_id}
+    if election_id is not None:
+        record['election'] = election_id
+    record['votes'] = [list(v) for v in votes]
+    payload = json.dumps(record, separators=(',', ':'))
+    return f"{zlib.crc32(payload.encode()):08x} {payload}\n".encode()
+
+
+def decode(line, line_number=0):
+    """Parse and verify one ledger line; raises LedgerCorrupt"""
+    if isinstance(line, bytes):
+        line = line.decode('utf-8', errors='replace')
+    checksum, _, payload = line.rstrip('\n').partition(' ')
+    try:
+        expected = int(checksum, 16)
+    except ValueError:
+        raise LedgerCorrupt(line_number, "missing checksum")
+    if zlib.crc32(payload.encode()) != expected:
+        raise LedgerCorrupt(line_number, "checksum mismatch")
+    try:
+        record = json.loads(payload)
+        record['voter'], record['votes']
+    except (ValueError, KeyError, TypeError):
+        raise LedgerCorrupt(line_number, "malformed record")
+    return record
+
+
+def _open(path):
+    global _fd, _fd_path
+    if _fd is None or _fd_path != path:
+        if _fd is not None:
+            os.close(_fd)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        _fd = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o640)
+        _fd_path = path
+        _seal_torn_tail(_fd)
+    return _fd
+
+
+def _seal_torn_tail(fd):
+    """
+    A worker killed mid-write leaves a last line without its newline; end
+    it so the next ballot doesn't get glued onto it. Replay then reports
+    the fragment as one corrupt line.
+    """
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        size = os.fstat(fd).st_size
+        if size and os.pread(fd, 1, size - 1) != b'\n':
+            os.write(fd, b'\n')
+    finally:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def append(voter_id, votes, election_id=None):
+    """
+    Write one ballot to the ledger. `votes` is a list of
+    (position_id, candidate_id, vote_type, choice); call it once the
+    ballot has committed. Raises OSError if the line could not be written.
+    """
+    global _last_fsync
+    line = encode(voter_id, votes, election_id=election_id)
+    policy = _setting('LEDGER_FSYNC', 'always')
+    with _lock:
+        fd = _open(ledger_path())
+        if fcntl is not None:
+            # Other workers append to the same file; keep lines whole
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            written = os.write(fd, line)
+            if written != len(line):
+                raise OSError(f"short write to ballot ledger ({written} of {len(line)} bytes)")
+            now = time.monotonic()
+            if policy == 'always' or (policy == 'interval' and
+                                      now - _last_fsync >= _setting('LEDGER_FSYNC_INTERVAL', 1.0)):
+                os.fsync(fd)
+                _last_fsync = now
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def rotate(dest):
+    """
+    Move the ledger's contents to `dest` and start it again empty; returns
+    the bytes moved. The file is copied and truncated rather than renamed:
+    workers keep it open with O_APPEND and carry on in the emptied file.
+    """
+    path = ledger_path()
+    if not os.path.exists(path):
+        return 0
+    fd = os.open(path, os.O_RDWR)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        size = os.fstat(fd).st_size
+        shutil.copyfile(path, dest)
+        with open(dest, 'rb') as f:
+            os.fsync(f.fileno())
+        os.ftruncate(fd, 0)
+        os.fsync(fd)
+        return size
+    finally:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def read(path=None, skip_corrupt=False):
+    """
+    Yield (line_number, record) for every ballot in the ledger, streaming.
+
+    A torn last line (the process died mid-write) is ignored. Any other bad
+    line raises LedgerCorrupt unless skip_corrupt is set, in which case it
+    is yielded as (line_number, LedgerCorrupt) so callers can count it.
+    """
+    path = path or ledger_path()
+    with open(path, 'rb') as f:
+        line_number = 0
+        for line in f:
+            line_number += 1
+            if not line.endswith(b'\n'):
+                return  # torn tail
+            try:
+                yield line_number, decode(line, line_number)
+            except LedgerCorrupt as e:
+                if not skip_corrupt:
+                    raise
+                yield line_number, e
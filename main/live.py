@@ -0,0 +1,173 @@
+# main/live.py
+"""
+Live results and turnout for dashboards, as server-sent events.
+
+Every open results page or dashboard subscribes to one Broadcaster per
+server process and election. A single producer task checks the results version
+(bumped by record_ballot on commit, see main/versions.py) every
+LIVE_POLL_INTERVAL seconds. When it has changed, the producer
+re-reads the tallies and turnout once, works out what changed, and
+queues that delta for every subscriber. The database work per process
+is the same for one screen or a thousand.
+
+Events (the data is compact JSON):
+- `snapshot`: the full state, sent first on every connection, and
+  again to a screen that fell too far behind;
+- `delta`: only the tally entries, per-position turnout and turnout
+  buckets that changed.
+
+The stream holds its connection open, so it is served only under ASGI
+(voting_software/asgi.py). The Procfile's web process runs that app on
+gunicorn's uvicorn workers. Under WSGI (e.g. runserver) the view
+answers 503 and the pages fall back to polling or to showing the
+figures from page load.
+"""
+import asyncio
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import tallies, turnout
+from .versions import results_version
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _read(election_id, since=None):
+    """Everything the screens show for one election, straight from the database"""
+    close_old_connections()
+    try:
+        return {
+            'version': results_version(),
+            'tally': tallies.vote_counts(election_id),
+            'positions': tallies.position_turnout(election_id),
+            'voted': tallies.voted_count(election_id),
+            'turnout': turnout.series(election_id, since),
+        }
+    finally:
+        close_old_connections()
+
+
+def _event(name, version, tally, positions, voted, turnout_series):
+    data = {
+        'version': version,
+        'tally': [[*key, n] for key, n in sorted(tally.items())],
+        'positions': [[position_id, n] for position_id, n in sorted(positions.items())],
+        'voted': voted,
+        'turnout': turnout_series,
+    }
+    return f"event: {name}\nid: {version}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def _changed(old, new):
+    """Entries of `new` that differ from `old`, with 0 for those that went away"""
+    return {key: new.get(key, 0) for key in set(old) | set(new) if old.get(key, 0) != new.get(key, 0)}
+
+
+class Broadcaster:
+    """One producer per process and election fanning results out to every connected screen"""
+
+    def __init__(self, election_id):
+        self.election_id = election_id
+        self.subscribers = set()
+        self._joining = 0
+        self._task = None
+        self._ready = asyncio.Event()
+        self._state = None
+        self._buckets = {}
+        self._snapshot = None
+
+    async def subscribe(self):
+        """A queue of SSE-formatted events, starting with a snapshot"""
+        queue = asyncio.Queue(maxsize=_setting('LIVE_QUEUE_SIZE', 16))
+        self._joining += 1
+        try:
+            if self._task is None or self._task.done():
+                self._ready.clear()
+                self._task = asyncio.create_task(self._run())
+            await self._ready.wait()
+        finally:
+            self._joining -= 1
+        # No await between these two, so no delta can slip in before the snapshot
+        queue.put_nowait(self._snapshot)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    def _apply(self, state):
+        """Take a fresh read as the current state; returns the delta event (None the first time)"""
+        series = state['turnout']
+        self._buckets.update(dict(series['buckets']))
+        delta = None
+        if self._state is not None:
+            delta = _event('delta', state['version'], _changed(self._state['tally'], state['tally']),
+                           _changed(self._state['positions'], state['positions']), state['voted'], series)
+        self._state = state
+        full_series = dict(series, buckets=[[minute, n] for minute, n in sorted(self._buckets.items())])
+        self._snapshot = _event('snapshot', state['version'], state['tally'], state['positions'],
+                                state['voted'], full_series)
+        return delta
+
+    def _publish(self, event):
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # A screen that stopped reading gets one up-to-date snapshot instead
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self._snapshot)
+
+    async def _run(self):
+        interval = _setting('LIVE_POLL_INTERVAL', 1)
+        read = sync_to_async(_read, thread_sensitive=False)
+        version = sync_to_async(results_version, thread_sensitive=False)
+        self._state, self._buckets = None, {}
+        while self.subscribers or self._joining:
+            try:
+                if self._state is None:
+                    self._apply(await read(self.election_id))
+                    self._ready.set()
+                elif await version() != self._state['version']:
+                    self._publish(self._apply(await read(self.election_id, self._state['turnout']['cursor'])))
+            except Exception:
+                logger.exception("live results producer failed; retrying")
+            await asyncio.sleep(interval)
+
+
+_broadcasters = {}
+
+
+def broadcaster(election_id):
+    """The Broadcaster for the running event loop and `election_id`"""
+    loop = asyncio.get_running_loop()
+    if any(key[0] is not loop for key in _broadcasters):
+        _broadcasters.clear()  # a previous loop (e.g. in tests) is gone
+    if (loop, election_id) not in _broadcasters:
+        _broadcasters[loop, election_id] = Broadcaster(election_id)
+    return _broadcasters[loop, election_id]
+
+
+async def stream(election_id):
+    """The event stream for one connected screen watching `election_id`"""
+    hub = broadcaster(election_id)
+    queue = await hub.subscribe()
+    keepalive = _setting('LIVE_KEEPALIVE', 15)
+    try:
+        yield f"retry: {keepalive * 1000}\n\n"
+        while True:
+            try:
+                yield await asyncio.wait_for(queue.get(), keepalive)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+    finally:
+        hub.unsubscribe(queue)
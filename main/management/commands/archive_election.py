@@ -0,0 +1,71 @@
+import os
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.text import slugify
+
+from main import archive, ballot_shards, db, elections, ledger, publish, tallies
+from main.models import ElectionSettings
+
+
+class Command(BaseCommand):
+    help = (
+        "Archive a closed election (ballots, tally, positions, candidates, "
+        "turnout, audit tree leaves and settings) into a compressed .npz file, "
+        "then delete its rows from the live tables in one transaction and "
+        "reset its settings for the next election. See main/archive.py."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--election', type=int, default=None, help="Election id (default: the default election)")
+        parser.add_argument('--output', default=None,
+                            help="Archive file (default: ELECTION_ARCHIVE_DIR/<election>-<time>.npz)")
+        parser.add_argument('--name', default=None, help="Name for the next election")
+        parser.add_argument('--keep', action='store_true', help="Only write the archive; leave the live tables")
+        parser.add_argument('--force', action='store_true', help="Archive even if voting has not closed")
+
+    def handle(self, *args, **options):
+        try:
+            election = elections.resolve(options['election'])
+        except ElectionSettings.DoesNotExist:
+            raise CommandError(f"No election with id {options['election']}")
+        if not options['force'] and not publish.election_closed(election):
+            raise CommandError("The election has not closed; use --force to archive anyway")
+
+        path = options['output']
+        if path is None:
+            directory = str(getattr(settings, 'ELECTION_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'archives')))
+            os.makedirs(directory, exist_ok=True)
+            name = slugify(election.election_name) or 'election'
+            path = os.path.join(directory, f"{name}-{timezone.now():%Y%m%d-%H%M%S}.npz")
+        elif not path.endswith('.npz'):
+            path += '.npz'  # np.savez adds it anyway
+
+        # One write transaction, locked from its BEGIN, from export to clear:
+        # no ballot can commit in between and be deleted without having been
+        # archived. Shards are separate files, so their write locks are held
+        # for the same span.
+        store = ballot_shards.get_store()
+        with store.write_lock() if store is not None else nullcontext(), db.write_transaction():
+            meta = archive.export(path, election)
+            self.stdout.write(
+                f"Archived {meta['votes']} votes from {meta['voted']} voters to {path} "
+                f"({os.path.getsize(path) / 1024:.0f} KiB)."
+            )
+            if options['keep']:
+                return
+            deleted = archive.clear(election)
+
+        # The ledger interleaves every election's ballots; move it only once none are left
+        if ledger.is_enabled() and not tallies.voted_count():
+            moved = ledger.rotate(path[:-len('.npz')] + '.ledger')
+            if moved:
+                self.stdout.write(f"Moved the ballot ledger ({moved} bytes) next to the archive.")
+        # Saving the reset settings also unpublishes the final results
+        archive.reset_settings(election, options['name'])
+        for table, rows in deleted.items():
+            self.stdout.write(f"  {table}: {rows} row(s) deleted")
+        self.stdout.write(self.style.SUCCESS(f"{election.election_name} cleared from the live tables; "
+                                             "ready for the next election."))
@@ -0,0 +1,141 @@
+import random
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+
+from main import slow_queries, tallies, turnout
+from main.models import ElectionSettings, Position, Candidate, Vote
+
+
+# Queries that read every ballot by design; a scan is the right plan
+EXPECTED_SCANS = {"voted_list: all ballots"}
+
+
+def hot_queries(election, candidate, voter):
+    """
+    (label, callable) pairs that call the functions the views read ballots
+    through (main/tallies.py and main/turnout.py) for one election, so the
+    audited SQL is exactly what they run.
+    """
+    return [
+        ("vote_view: has the user voted", lambda: tallies.has_voted(voter.id, election)),
+        ("dashboards: distinct voters", lambda: tallies.voted_count(election)),
+        ("not_voted_list: who has voted", lambda: tallies.voted_voter_ids(election)),
+        ("vote_results: grouped vote counts", lambda: tallies.vote_counts(election)),
+        ("vote_results: distinct voters per position", lambda: tallies.position_turnout(election)),
+        ("voted_list: all ballots", lambda: tallies.votes_by_voter(election)),
+        ("candidate_voters: votes for a candidate", lambda: tallies.votes_for_candidate(candidate.id)),
+        ("turnout: ballots per minute", lambda: turnout.series(election)),
+    ]
+
+
+def classify(plan, table):
+    """'scan' (full table scan), 'index' or '-' (table not touched) for the given table"""
+    touches = [line for line in plan.splitlines() if table in line]
+    if not touches:
+        return '-'
+    for line in touches:
+        upper = line.upper()
+        # SQLite: "SCAN main_vote" with no index; Postgres: "Seq Scan on main_vote"
+        if (upper.lstrip().startswith('SCAN') and 'INDEX' not in upper) or 'SEQ SCAN' in upper:
+            return 'scan'
+    return 'index'
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the hot ballot queries from main/tallies.py and main/turnout.py "
+        "against a generated dataset in a throwaway test database and report "
+        "whether each plan uses an index"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--voters', type=int, default=2000)
+        parser.add_argument('--positions', type=int, default=6)
+        parser.add_argument('--verbose-plans', action='store_true', help="Print the full plan of every statement")
+        parser.add_argument('--fail-on-scan', action='store_true',
+                            help="Exit with an error if any query full-scans main_vote")
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        # Never touch the real database: build a disposable one with all migrations applied
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            scans = self._audit(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if scans and options['fail_on_scan']:
+            raise CommandError(f"{scans} hot quer{'y' if scans == 1 else 'ies'} full-scan main_vote")
+
+    def _generate(self, n_voters, n_positions):
+        users = User.objects.bulk_create(User(username=f"voter{i}") for i in range(n_voters))
+        election = ElectionSettings.objects.create(election_name="Index audit")
+        positions = Position.objects.bulk_create(
+            Position(election=election, position_name=f"Position {i}", description='') for i in range(n_positions)
+        )
+        candidates = {}
+        for i, position in enumerate(positions):
+            # Alternate contested (3 candidates) and yes/no (1 candidate) positions
+            count = 3 if i % 2 == 0 else 1
+            candidates[position.id] = Candidate.objects.bulk_create(
+                Candidate(candidate_name=users[i * 3 + k], candidate_position=position, photo='')
+                for k in range(count)
+            )
+
+        votes = []
+        for user in users:
+            for position in positions:
+                options = candidates[position.id]
+                if len(options) > 1:
+                    votes.append(Vote(election_id=position.election_id, voter=user, position=position,
+                                      candidate=random.choice(options),
+                                      vote_type=Vote.MULTIPLE_CANDIDATES, choice='selected'))
+                else:
+                    votes.append(Vote(election_id=position.election_id, voter=user, position=position,
+                                      candidate=options[0],
+                                      vote_type=Vote.SINGLE_CANDIDATE, choice=random.choice(['yes', 'no'])))
+        Vote.objects.bulk_create(votes, batch_size=2000)
+
+        with connection.cursor() as cursor:
+            # Give the planner real statistics, as a long-running database would have
+            cursor.execute('ANALYZE')
+        return election, users, positions, candidates
+
+    def _audit(self, options):
+        election, users, positions, candidates = self._generate(options['voters'], options['positions'])
+        queries = hot_queries(election, candidates[positions[0].id][0], users[-1])
+
+        table = Vote._meta.db_table
+        self.stdout.write(f"Dataset: {len(users)} voters, {len(positions)} positions, "
+                          f"{Vote.objects.count()} votes ({connection.vendor})\n")
+
+        scans = 0
+        for label, run in queries:
+            recorder = slow_queries.StatementRecorder(connection.alias)
+            # The plans of main_vote, even where the real settings shard the ballots
+            with override_settings(BALLOT_SHARDS=0), connection.execute_wrapper(recorder):
+                run()
+            for alias, sql, params, many, duration in recorder.statements:
+                plan = slow_queries.explain(alias, sql, params)
+                verdict = classify(plan, table)
+                if verdict == 'scan' and label in EXPECTED_SCANS:
+                    verdict = 'scan*'
+                    style = self.style.NOTICE
+                elif verdict == 'scan':
+                    scans += 1
+                    style = self.style.ERROR
+                elif verdict == 'index':
+                    style = self.style.SUCCESS
+                else:
+                    style = self.style.NOTICE
+                self.stdout.write(style(f"[{verdict:>5}] {label} ({duration * 1000:.2f} ms)"))
+                if options['verbose_plans'] or verdict == 'scan':
+                    for line in plan.splitlines():
+                        self.stdout.write(f"          {line}")
+
+        summary = f"\n{scans} unexpected full scan(s) of {table} (scan* = reads every row by design)."
+        self.stdout.write(self.style.ERROR(summary) if scans else self.style.SUCCESS(summary))
+        return scans
@@ -0,0 +1,177 @@
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import override_settings
+
+from main import ballot_shards, tallies
+from main.ballots import record_ballot
+from main.models import AuditLeaf, Candidate, ElectionSettings, Position, TurnoutBucket
+
+
+@contextmanager
+def _throwaway_database(path):
+    """Point the default alias at `path`, as the test runner does with its test database"""
+    connection = connections[DEFAULT_DB_ALIAS]
+    connection.close()
+    saved = connection.settings_dict['NAME']
+    connection.settings_dict['NAME'] = path
+    try:
+        yield
+    finally:
+        connection.close()
+        connection.settings_dict['NAME'] = saved
+
+
+def _answers(voter_id, positions):
+    """A VotingForm's cleaned_data for one generated ballot"""
+    rng = random.Random(voter_id)
+    answers = {}
+    for position in positions:
+        candidates = position.candidate_position.all()
+        if len(candidates) > 1:
+            answers[f'position_{position.id}'] = str(rng.choice(candidates).id)
+        else:
+            answers[f'candidate_{candidates[0].id}'] = rng.choice(['yes', 'no'])
+    return answers
+
+
+def _writer(election_id, voter_ids, start):
+    election = ElectionSettings.objects.get(pk=election_id)
+    positions = list(Position.objects.filter(election=election).prefetch_related('candidate_position'))
+    voters = User.objects.in_bulk(voter_ids)
+    ballots = [(voters[voter_id], _answers(voter_id, positions)) for voter_id in voter_ids]
+    store = ballot_shards.get_store()
+    if store is not None:
+        for index in range(store.count):
+            store.connection(index)  # open and create the schema before the clock starts
+    start.wait(timeout=60)
+    try:
+        for voter, answers in ballots:
+            record_ballot(voter, positions, answers, election)
+    finally:
+        if store is not None:
+            store.close()
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure ballot commits per second for different BALLOT_SHARDS values. "
+        "Several processes (like gunicorn workers) cast ballots through "
+        "record_ballot, so each one also pays for its ledger line, audit leaf "
+        "and turnout count, as in vote_view. Everything is written to a "
+        "throwaway main database, shard directory and ledger; nothing touches "
+        "the real ones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', default='0,1,2,4,8',
+                            help="Comma-separated shard counts to try (0: ballots in main_vote)")
+        parser.add_argument('--writers', type=int, default=8, help="Concurrent writer processes")
+        parser.add_argument('--ballots', type=int, default=4000, help="Ballots per run")
+        parser.add_argument('--positions', type=int, default=6, help="Votes per ballot")
+        parser.add_argument('--candidates', type=int, default=3, help="Candidates per position")
+        parser.add_argument('--synchronous', choices=['NORMAL', 'FULL'], default='NORMAL',
+                            help="FULL fsyncs every shard commit, like a durable production disk setup")
+        parser.add_argument('--dir', default=None,
+                            help="Parent directory for the throwaway files (put it on the production disk)")
+
+    def handle(self, *args, **options):
+        try:
+            shard_counts = [int(n) for n in options['shards'].split(',') if n.strip()]
+        except ValueError:
+            raise CommandError("--shards must be a comma-separated list of integers")
+        if not shard_counts or min(shard_counts) < 0:
+            raise CommandError("shard counts must be 0 or more")
+        if min(options['positions'], options['candidates'], options['ballots']) < 1:
+            raise CommandError("need at least one ballot, position and candidate")
+
+        writers, ballots = options['writers'], options['ballots']
+        self.stdout.write(f"{ballots} ballots x {options['positions']} votes, {writers} writer processes, "
+                          f"synchronous={options['synchronous']}\n")
+        self.stdout.write(f"{'shards':>6}  {'seconds':>8}  {'ballots/s':>10}  {'speedup':>7}")
+
+        baseline = None
+        for shards in shard_counts:
+            with tempfile.TemporaryDirectory(prefix='bench-shards-', dir=options['dir']) as directory, \
+                    _throwaway_database(os.path.join(directory, 'main.sqlite3')), \
+                    override_settings(
+                        BALLOT_SHARDS=shards, BALLOT_SHARD_DIR=os.path.join(directory, 'shards'),
+                        LEDGER_PATH=os.path.join(directory, 'ballots.ledger'),
+                        SHARED_STORE_PATH=os.path.join(directory, 'shared_store.sqlite3'),
+                        PUBLISHED_RESULTS_DIR=os.path.join(directory, 'published'),
+                        BALLOT_SHARD_SYNCHRONOUS=options['synchronous'], REPLICA_ENABLED=False,
+                    ):
+                election_id, voter_ids = self._populate(ballots, options)
+                elapsed = self._run(election_id, voter_ids, writers)
+                self._check(election_id, ballots)
+
+            rate = ballots / elapsed
+            baseline = baseline or rate
+            self.stdout.write(f"{shards:>6}  {elapsed:>8.2f}  {rate:>10.0f}  {rate / baseline:>6.2f}x")
+
+    def _populate(self, ballots, options):
+        """Migrate the throwaway database and add an open election with its voters; returns (election id, voter ids)"""
+        call_command('migrate', verbosity=0, interactive=False, skip_checks=True)
+        election = ElectionSettings.objects.create(election_name="Benchmark", is_manual_override=True,
+                                                   is_active=True)
+        people = iter(User.objects.bulk_create(
+            User(username=f'candidate{i}') for i in range(options['positions'] * options['candidates'])
+        ))
+        for number in range(options['positions']):
+            position = Position.objects.create(election=election, position_name=f"Position {number + 1}",
+                                               description="")
+            for _ in range(options['candidates']):
+                Candidate.objects.create(candidate_name=next(people), candidate_position=position, photo='')
+        voters = User.objects.bulk_create(User(username=f'voter{i}') for i in range(ballots))
+        # Forked writers must not share the parent's connection
+        connections.close_all()
+        return election.id, [voter.id for voter in voters]
+
+    def _run(self, election_id, voter_ids, writers):
+        start = multiprocessing.Barrier(writers + 1)
+        processes = [
+            multiprocessing.Process(target=_writer, args=(election_id, voter_ids[i::writers], start))
+            for i in range(writers)
+        ]
+        for process in processes:
+            process.start()
+        try:
+            start.wait(timeout=60)
+        except threading.BrokenBarrierError:
+            for process in processes:
+                process.terminate()
+            raise CommandError("a writer process failed to start")
+        began = time.perf_counter()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - began
+        if any(process.exitcode for process in processes):
+            raise CommandError("a writer process failed")
+        return elapsed
+
+    def _check(self, election_id, ballots):
+        """Every ballot was stored, and audited and counted exactly once"""
+        election = ElectionSettings.objects.get(pk=election_id)
+        found = {
+            'stored': tallies.voted_count(election),
+            'audit leaves': AuditLeaf.objects.count(),
+            'turnout': sum(TurnoutBucket.objects.values_list('ballots', flat=True)),
+        }
+        for what, count in found.items():
+            if count != ballots:
+                raise CommandError(f"expected {ballots} ballots, found {count} ({what})")
+        store = ballot_shards.get_store()
+        if store is not None:
+            store.close()
+        connections.close_all()
+
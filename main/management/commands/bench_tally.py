@@ -0,0 +1,156 @@
+import os
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import Count
+
+from main import analytics
+from main.models import Vote
+
+BENCH_ALIAS = 'bench_tally'
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare ways of tallying the results page: a COUNT query per "
+        "candidate (the original vote_results), one grouped ORM query, and "
+        "NumPy columns from main/analytics.py. Runs against a throwaway "
+        "SQLite copy of main_vote filled with generated ballots."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--votes', type=int, default=1_000_000, help="Vote rows to generate")
+        parser.add_argument('--positions', type=int, default=6, help="Positions on each ballot")
+        parser.add_argument('--candidates', type=int, default=4,
+                            help="Candidates per multi-candidate position (every other position is yes/no)")
+        parser.add_argument('--repeat', type=int, default=3, help="Runs per method; the best is reported")
+        parser.add_argument('--dir', default=None, help="Directory for the throwaway database")
+
+    def handle(self, *args, **options):
+        if options['votes'] < options['positions'] or min(options['positions'], options['candidates']) < 1:
+            raise CommandError("need at least one ballot, position and candidate")
+
+        with tempfile.TemporaryDirectory(prefix='bench-tally-', dir=options['dir']) as directory:
+            connections.databases[BENCH_ALIAS] = dict(
+                connections.databases['default'], NAME=os.path.join(directory, 'bench.sqlite3'),
+            )
+            try:
+                started = time.perf_counter()
+                layout = self._populate(options)
+                self.stdout.write(f"{options['votes']} votes generated in {time.perf_counter() - started:.1f}s\n")
+                self._run(layout, options['repeat'])
+            finally:
+                connections[BENCH_ALIAS].close()
+                del connections.databases[BENCH_ALIAS]
+
+    def _populate(self, options):
+        """Create main_vote in the throwaway database and fill it; returns {position: [candidates]}"""
+        connection = connections[BENCH_ALIAS]
+        with connection.schema_editor() as editor:
+            editor.create_model(Vote)
+        with connection.cursor() as cursor:
+            # Only main_vote exists here; its foreign keys point nowhere
+            cursor.execute('PRAGMA foreign_keys = OFF')
+
+        layout = {}
+        for position in range(1, options['positions'] + 1):
+            count = options['candidates'] if position % 2 else 1
+            layout[position] = [position * 1000 + i for i in range(count)]
+
+        rng = np.random.default_rng(0)
+        voters = options['votes'] // options['positions']
+        start = np.datetime64('2026-01-01T08:00:00')
+        times = [str(ts).replace('T', ' ')
+                 for ts in start + rng.integers(0, 12 * 3600, voters).astype('timedelta64[s]')]
+        table = connection.ops.quote_name(Vote._meta.db_table)
+        # All in one election, as the tallies of one results page are
+        sql = (f'INSERT INTO {table} (election_id, voter_id, position_id, candidate_id, vote_type, choice, timestamp)'
+               f' VALUES (1, ?, ?, ?, ?, ?, ?)')
+        voter_ids = range(1, voters + 1)
+        with transaction.atomic(using=BENCH_ALIAS):
+            raw = connection.connection  # the sqlite3 connection; skips per-row parameter rewriting
+            for position, candidates in layout.items():
+                if len(candidates) > 1:
+                    rows = zip(voter_ids, [position] * voters, rng.choice(candidates, voters).tolist(),
+                               [Vote.MULTIPLE_CANDIDATES] * voters, ['selected'] * voters, times)
+                else:
+                    rows = zip(voter_ids, [position] * voters, [candidates[0]] * voters,
+                               [Vote.SINGLE_CANDIDATE] * voters, rng.choice(['yes', 'no'], voters).tolist(),
+                               times)
+                raw.executemany(sql, rows)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        return layout
+
+    def _per_candidate(self, layout):
+        """The original vote_results: COUNT queries per candidate"""
+        votes = Vote.objects.using(BENCH_ALIAS)
+        counts = {}
+        for position, candidates in layout.items():
+            for candidate in candidates:
+                if len(candidates) > 1:
+                    key = (position, candidate, Vote.MULTIPLE_CANDIDATES, 'selected')
+                    counts[key] = votes.filter(position_id=position, candidate_id=candidate,
+                                               choice='selected').count()
+                    votes.filter(position_id=position).values('voter').distinct().count()
+                else:
+                    for choice in ('yes', 'no'):
+                        key = (position, candidate, Vote.SINGLE_CANDIDATE, choice)
+                        counts[key] = votes.filter(position_id=position, candidate_id=candidate,
+                                                   choice=choice).count()
+        return counts
+
+    def _grouped(self, layout):
+        """tallies.vote_counts(): one GROUP BY query"""
+        rows = (Vote.objects.using(BENCH_ALIAS)
+                .values_list('position', 'candidate', 'vote_type', 'choice')
+                .annotate(n=Count('id')).order_by())
+        return {(p, c, t, ch): n for p, c, t, ch, n in rows}
+
+    def _numpy(self, layout):
+        """main/analytics.py: load the columns, then count them"""
+        return analytics.tally(analytics.load_votes(using=BENCH_ALIAS))
+
+    def _numpy_loaded(self, layout):
+        """main/analytics.py with the columns already in memory (loaded once for many analyses)"""
+        return analytics.tally(self._columns)
+
+    def _run(self, layout, repeat):
+        methods = [
+            ('ORM count per candidate', self._per_candidate),
+            ('ORM grouped query', self._grouped),
+            ('NumPy load + tally', self._numpy),
+            ('NumPy tally (loaded)', self._numpy_loaded),
+        ]
+        self._columns = analytics.load_votes(using=BENCH_ALIAS)
+        self.stdout.write(f"{'method':<26}  {'seconds':>8}  {'speedup':>7}")
+        expected, baseline = None, None
+        for name, method in methods:
+            best = float('inf')
+            for _ in range(repeat):
+                started = time.perf_counter()
+                counts = method(layout)
+                best = min(best, time.perf_counter() - started)
+            counts = {key: n for key, n in counts.items() if n}
+            if expected is None:
+                expected = counts
+            elif counts != expected:
+                raise CommandError(f"{name} gave different totals")
+            baseline = baseline or best
+            self.stdout.write(f"{name:<26}  {best:>8.3f}  {baseline / best:>6.1f}x")
+
+        # The rest of the analytics, on the same columns
+        columns = self._columns
+        positions = list(layout)
+        for name, compute in [
+            ('abstention', lambda: analytics.abstention(columns)),
+            ('turnout curve', lambda: analytics.turnout_curve(columns)),
+            ('co-selection, all pairs', lambda: [analytics.co_selection(columns, a, b)
+                                                 for i, a in enumerate(positions) for b in positions[i + 1:]]),
+        ]:
+            started = time.perf_counter()
+            compute()
+            self.stdout.write(f"  {name:<24}  {time.perf_counter() - started:>8.3f}")
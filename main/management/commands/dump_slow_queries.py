@@ -0,0 +1,27 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+
+from main import slow_queries
+
+
+class Command(BaseCommand):
+    help = "Dump the slow query log (with EXPLAIN plans) as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', help="Write to this file instead of stdout")
+        parser.add_argument('--limit', type=int, help="Only the newest N entries")
+        parser.add_argument('--clear', action='store_true', help="Empty the log after dumping")
+
+    def handle(self, *args, **options):
+        data = json.dumps({'entries': slow_queries.entries(limit=options['limit'])}, indent=2, cls=DjangoJSONEncoder)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(data)
+            self.stdout.write(self.style.SUCCESS(f"Slow query log written to {options['output']}"))
+        else:
+            self.stdout.write(data)
+
+        if options['clear']:
+            slow_queries.clear()
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from main.models import Candidate
+
+
+class Command(BaseCommand):
+    help = "Generate (or backfill) ballot-sized JPEG/WebP thumbnails for candidate photos"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help="Re-render thumbnails even if they already exist",
+        )
+
+    def handle(self, *args, **options):
+        done = failed = 0
+        for candidate in Candidate.objects.select_related('candidate_name').iterator():
+            if not candidate.photo:
+                continue
+            candidate.refresh_thumbnails(force=options['force'])
+            if candidate.photo_hash:
+                done += 1
+            else:
+                failed += 1
+                self.stderr.write(f"Could not process photo for {candidate} ({candidate.photo.name})")
+
+        self.stdout.write(self.style.SUCCESS(f"Thumbnails ready for {done} candidate(s), {failed} failed."))
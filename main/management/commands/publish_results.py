@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main import elections, publish
+from main.models import ElectionSettings
+
+
+class Command(BaseCommand):
+    help = (
+        "Render the final results page, JSON and PDF into static files and "
+        "serve them instead of the live results (see main/publish.py). Runs "
+        "by itself when an election is stopped, and in the background after "
+        "the first results request following a scheduled end; run it from "
+        "cron to publish right at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--election', type=int, default=None, help="Election id (default: the default election)")
+        parser.add_argument('--force', action='store_true',
+                            help="Publish even if voting is still open, and re-render if already published")
+        parser.add_argument('--unpublish', action='store_true', help="Go back to serving live results")
+
+    def handle(self, *args, **options):
+        try:
+            election = elections.resolve(options['election'])
+        except ElectionSettings.DoesNotExist:
+            raise CommandError(f"No election with id {options['election']}")
+        if options['unpublish']:
+            publish.unpublish(election.id)
+            self.stdout.write(self.style.SUCCESS(f"{election.election_name} unpublished; serving live results."))
+            return
+
+        if not options['force'] and not publish.election_closed(election):
+            raise CommandError("The election has not closed; use --force to publish anyway")
+        published = publish.publish(election, force=options['force'])
+        self.stdout.write(self.style.SUCCESS(f"Published results version {published['version']}:"))
+        for kind, url in sorted(published['urls'].items()):
+            self.stdout.write(f"  {kind}: {url}")
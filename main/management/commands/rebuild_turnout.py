@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from main import elections, turnout
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the per-minute turnout buckets behind the dashboard chart "
+        "from the stored ballots (e.g. for ballots cast before the buckets "
+        "existed). Each ballot counts at the time of its earliest vote."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--election', type=int, help="Election id (default: every election)")
+
+    def handle(self, *args, **options):
+        if options['election'] is not None:
+            targets = [elections.resolve(options['election'])]
+        else:
+            targets = list(elections.all_elections())
+        for election in targets:
+            count = turnout.rebuild(election)
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} turnout bucket(s) for {election.election_name}."))
@@ -0,0 +1,166 @@
+import itertools
+import os
+import time
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+
+from main import ballot_shards, elections, tallies
+from main.models import Position, Candidate, Vote
+
+
+class _Partition:
+    """One slice of the exported ballots as parallel typed arrays (cheap to pickle)"""
+
+    def __init__(self):
+        self.voters = array('q')
+        self.positions = array('q')
+        self.candidates = array('q')
+        self.answers = array('H')  # index into the (vote_type, choice) table
+
+    def add(self, voter_id, position_id, candidate_id, answer):
+        self.voters.append(voter_id)
+        self.positions.append(position_id)
+        self.candidates.append(candidate_id)
+        self.answers.append(answer)
+
+    def __len__(self):
+        return len(self.voters)
+
+
+def _tally_partition(partition):
+    """
+    Count one partition; runs in a worker process. Every partition holds
+    all the votes of its positions (or its voters), so the per-partition
+    results only need adding up.
+    """
+    counts = Counter(zip(partition.positions, partition.candidates, partition.answers))
+    pairs = Counter(zip(partition.positions, partition.voters))
+    turnout = Counter(position_id for position_id, _ in pairs)
+    repeated = [(position_id, voter_id, n) for (position_id, voter_id), n in pairs.items() if n > 1]
+    return counts, turnout, repeated
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount every ballot from the raw votes in parallel and compare it "
+        "with the live tally shown on the results page. The votes are read "
+        "once, split by position or voter range, counted in a process pool "
+        "and merged."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--by', choices=['position', 'voter'], default='voter',
+                            help="Partition by position or by voter id range (default: voter)")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Worker processes (default: one per core; 1 counts in this process)")
+        parser.add_argument('--partitions', type=int, default=None,
+                            help="Number of partitions (default: 4 per worker)")
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        partitions = options['partitions'] or workers * 4
+        if workers < 1 or partitions < 1:
+            raise CommandError("--workers and --partitions must be 1 or more")
+
+        # Every election is recounted; positions are never shared, so the keys don't collide
+        if any(election.get_voting_status() for election in elections.all_elections()):
+            self.stderr.write("Voting is still open: ballots cast during the recount will show as differences.")
+
+        started = time.perf_counter()
+        parts, answers = self._export(options['by'], partitions)
+        exported = time.perf_counter()
+
+        parts = [part for part in parts if len(part)]
+        counts, turnout, repeated = Counter(), Counter(), []
+        for part_counts, part_turnout, part_repeated in self._count(parts, workers):
+            counts.update(part_counts)
+            turnout.update(part_turnout)
+            repeated.extend(part_repeated)
+        counted = time.perf_counter()
+
+        recount = Counter({(p, c, *answers[a]): n for (p, c, a), n in counts.items()})
+        self.stdout.write(
+            f"{sum(counts.values())} votes in {len(parts)} partition(s) by {options['by']}, "
+            f"{workers} worker(s): exported in {exported - started:.2f}s, "
+            f"counted in {counted - exported:.2f}s"
+        )
+
+        problems = self._compare(recount, turnout, repeated)
+        if problems:
+            raise CommandError(f"{problems} discrepancy(ies) between the recount and the live tally")
+        self.stdout.write(self.style.SUCCESS("Recount matches the live tally."))
+
+    def _rows(self):
+        """(voter_id, position_id, candidate_id, vote_type, choice) for every stored vote, streamed"""
+        store = ballot_shards.get_store()
+        if store is not None:
+            return itertools.chain.from_iterable(
+                store.gather('SELECT voter_id, position_id, candidate_id, vote_type, choice FROM vote')
+            )
+        return (Vote.objects.values_list('voter_id', 'position_id', 'candidate_id', 'vote_type', 'choice')
+                .order_by().iterator(chunk_size=10000))
+
+    def _export(self, by, partitions):
+        """Split the votes into partitions in one pass; returns (partitions, answer table)"""
+        if by == 'position':
+            order = {pk: i for i, pk in enumerate(Position.objects.order_by('id').values_list('id', flat=True))}
+            def key(voter_id, position_id):
+                return order.get(position_id, position_id) % partitions
+        else:
+            # Contiguous voter id ranges of equal width
+            width = (User.objects.aggregate(top=Max('id'))['top'] or 0) // partitions + 1
+            def key(voter_id, position_id):
+                return min(voter_id // width, partitions - 1)
+
+        parts = [_Partition() for _ in range(partitions)]
+        codes = {}
+        for voter_id, position_id, candidate_id, vote_type, choice in self._rows():
+            answer = codes.setdefault((vote_type, choice), len(codes))
+            parts[key(voter_id, position_id)].add(voter_id, position_id, candidate_id, answer)
+        answers = {code: answer for answer, code in codes.items()}
+        return parts, answers
+
+    def _count(self, parts, workers):
+        if workers == 1 or len(parts) <= 1:
+            return [_tally_partition(part) for part in parts]
+        with ProcessPoolExecutor(max_workers=min(workers, len(parts))) as pool:
+            return list(pool.map(_tally_partition, parts))
+
+    def _compare(self, recount, turnout, repeated):
+        problems = 0
+        positions = Position.objects.in_bulk()
+        candidates = Candidate.objects.select_related('candidate_name').in_bulk()
+
+        def describe(position_id, candidate_id, vote_type, choice):
+            position = positions.get(position_id, f"position #{position_id}")
+            candidate = str(candidates.get(candidate_id, "")).strip() or f"candidate #{candidate_id}"
+            return f"{position}: {candidate} {choice}"
+
+        live = tallies.vote_counts()
+        for key in sorted(set(recount) | set(live)):
+            if recount.get(key, 0) != live.get(key, 0):
+                problems += 1
+                self.stdout.write(self.style.ERROR(
+                    f"  {describe(*key)}: recount {recount.get(key, 0)}, live {live.get(key, 0)}"
+                ))
+
+        live_turnout = tallies.position_turnout()
+        for position_id in sorted(set(turnout) | set(live_turnout)):
+            if turnout.get(position_id, 0) != live_turnout.get(position_id, 0):
+                problems += 1
+                self.stdout.write(self.style.ERROR(
+                    f"  {positions.get(position_id, f'position #{position_id}')} turnout: "
+                    f"recount {turnout.get(position_id, 0)}, live {live_turnout.get(position_id, 0)}"
+                ))
+
+        for position_id, voter_id, n in sorted(repeated):
+            problems += 1
+            self.stdout.write(self.style.ERROR(
+                f"  voter {voter_id} has {n} votes for {positions.get(position_id, f'position #{position_id}')}"
+            ))
+        return problems
@@ -0,0 +1,154 @@
+import time
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+
+from main import ballot_shards, ledger, tallies
+from main.models import Position, Candidate, Vote
+from main.versions import bump_results_version
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay the ballot ledger in one streaming pass: print the tallies it "
+        "implies, compare them with the live database, and optionally rebuild "
+        "the Vote rows from it"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ledger', help="Ledger file (default: LEDGER_PATH)")
+        parser.add_argument('--skip-corrupt', action='store_true',
+                            help="Count and skip lines that fail their checksum instead of stopping")
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Replace all stored ballots with the ledger's")
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help="Don't ask for confirmation before --rebuild")
+
+    def handle(self, *args, **options):
+        path = options['ledger'] or ledger.ledger_path()
+        started = time.perf_counter()
+        ballots, stats = self._read(path, options['skip_corrupt'])
+        read_seconds = time.perf_counter() - started
+
+        self.stdout.write(
+            f"{stats['lines']} ledger lines, {len(ballots)} ballots, "
+            f"{stats['superseded']} superseded, {stats['corrupt']} corrupt "
+            f"(read in {read_seconds:.2f}s)"
+        )
+
+        counts = Counter()
+        for _, votes in ballots.values():
+            for position_id, candidate_id, vote_type, choice in votes:
+                counts[(position_id, candidate_id, vote_type, choice)] += 1
+        self._print_tally(counts)
+
+        if options['rebuild']:
+            self._rebuild(ballots, options['interactive'])
+        else:
+            self._compare(counts)
+
+    def _read(self, path, skip_corrupt):
+        """(voter_id, election_id) -> (timestamp, votes), the voter's last ballot winning; plus counters"""
+        ballots = {}
+        stats = Counter(lines=0, superseded=0, corrupt=0)
+        try:
+            for line_number, record in ledger.read(path, skip_corrupt=skip_corrupt):
+                stats['lines'] += 1
+                if isinstance(record, ledger.LedgerCorrupt):
+                    stats['corrupt'] += 1
+                    self.stderr.write(f"skipping {record}")
+                    continue
+                key = (record['voter'], record.get('election'))
+                if key in ballots:
+                    # Only one ballot per voter and election can commit; keep the last line
+                    stats['superseded'] += 1
+                ballots[key] = (record['ts'], [tuple(v) for v in record['votes']])
+        except FileNotFoundError:
+            raise CommandError(f"no ledger at {path}")
+        except ledger.LedgerCorrupt as e:
+            raise CommandError(f"{path}: {e} (use --skip-corrupt to continue past it)")
+        return ballots, stats
+
+    def _print_tally(self, counts):
+        positions = Position.objects.in_bulk({p for p, _, _, _ in counts})
+        candidates = Candidate.objects.select_related('candidate_name').in_bulk({c for _, c, _, _ in counts})
+        for (position_id, candidate_id, vote_type, choice), n in sorted(counts.items()):
+            position = positions.get(position_id, f"position #{position_id}")
+            candidate = str(candidates.get(candidate_id, "")).strip() or f"candidate #{candidate_id}"
+            self.stdout.write(f"  {position}: {candidate} {choice} = {n}")
+
+    def _compare(self, counts):
+        live = tallies.vote_counts()
+        differences = sorted(set(counts) | set(live))
+        differences = [key for key in differences if counts.get(key, 0) != live.get(key, 0)]
+        if not differences:
+            self.stdout.write(self.style.SUCCESS("Ledger tallies match the database."))
+            return
+        self.stdout.write(self.style.ERROR(f"{len(differences)} tally difference(s) (ledger vs database):"))
+        for key in differences:
+            self.stdout.write(f"  {key}: {counts.get(key, 0)} vs {live.get(key, 0)}")
+
+    def _rebuild(self, ballots, interactive):
+        store = ballot_shards.get_store()
+        if interactive:
+            where = f"{store.count} ballot shard(s)" if store else "main_vote"
+            answer = input(f"This replaces every ballot in {where} with the ledger's {len(ballots)}. Type 'yes': ")
+            if answer != 'yes':
+                raise CommandError("Rebuild cancelled.")
+
+        # Ballots whose voter, position or candidate no longer exists can't be stored
+        users = set(User.objects.values_list('id', flat=True))
+        positions = dict(Position.objects.values_list('id', 'election_id'))
+        candidates = set(Candidate.objects.values_list('id', flat=True))
+        usable = {
+            key: (ts, votes) for key, (ts, votes) in ballots.items()
+            if key[0] in users and all(p in positions and c in candidates for p, c, _, _ in votes)
+        }
+        if len(usable) != len(ballots):
+            self.stderr.write(f"{len(ballots) - len(usable)} ballot(s) refer to deleted users, "
+                              f"positions or candidates and are skipped")
+
+        started = time.perf_counter()
+        if store is not None:
+            if store.voted_count():
+                raise CommandError("the ballot shards are not empty; move them aside before rebuilding")
+            for (voter, _), (_, votes) in usable.items():
+                store.write_ballot(voter, votes)
+        else:
+            self._rebuild_main_vote(usable, positions)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {len(usable)} ballots in {time.perf_counter() - started:.2f}s."
+        ))
+
+    def _rebuild_main_vote(self, ballots, position_elections):
+        fields = [Vote._meta.get_field(name) for name in ('election', 'voter', 'position', 'candidate',
+                                                           'vote_type', 'choice', 'timestamp')]
+        table = connection.ops.quote_name(Vote._meta.db_table)
+        columns = ', '.join(connection.ops.quote_name(f.column) for f in fields)
+        placeholders = ', '.join(['%s'] * len(fields))
+        # Raw INSERTs: bulk_create would overwrite the auto_now_add timestamps
+        sql = f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
+
+        def rows():
+            for (voter, _), (ts, votes) in ballots.items():
+                ts = connection.ops.adapt_datetimefield_value(parse_datetime(ts))
+                for position_id, candidate_id, vote_type, choice in votes:
+                    # Vote.election follows the position, as in Vote.save()
+                    yield (position_elections[position_id], voter, position_id, candidate_id, vote_type, choice, ts)
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                # Raw, like the INSERTs: delete() would load every Vote to send signals
+                cursor.execute(f"DELETE FROM {table}")
+                batch = []
+                for row in rows():
+                    batch.append(row)
+                    if len(batch) >= 5000:
+                        cursor.executemany(sql, batch)
+                        batch = []
+                if batch:
+                    cursor.executemany(sql, batch)
+        bump_results_version()
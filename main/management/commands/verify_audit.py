@@ -0,0 +1,134 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main import merkle, tallies
+from main.models import AuditLeaf, AuditNode
+
+
+class Command(BaseCommand):
+    help = (
+        "Check the ballot audit tree. With --leaf or --receipt, verify one "
+        "ballot's inclusion proof (O(log n) hashes); otherwise rehash every "
+        "leaf and node and compare each ballot with the stored votes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--leaf', type=int, help="Prove and verify one ballot by leaf index")
+        parser.add_argument('--receipt', help="Verify a voter's receipt JSON file (no database needed)")
+        parser.add_argument('--root', help="Root to check against (default: the receipt's or the current root)")
+        parser.add_argument('--size', type=int, help="Tree size the --root belongs to")
+
+    def handle(self, *args, **options):
+        if options['receipt']:
+            self._verify_receipt(options)
+        elif options['leaf'] is not None:
+            self._verify_leaf(options)
+        else:
+            self._verify_all()
+
+    def _check(self, leaf_hash_hex, index, size, path, root):
+        ok = merkle.verify_inclusion(leaf_hash_hex, index, size, path, root)
+        summary = f"ballot #{index} in tree of {size} against root {root[:16]}... ({len(path)} hashes)"
+        if not ok:
+            raise CommandError(f"NOT included: {summary}")
+        self.stdout.write(self.style.SUCCESS(f"Included: {summary}"))
+
+    def _verify_receipt(self, options):
+        try:
+            with open(options['receipt']) as f:
+                receipt = json.load(f)
+            ballot, index = receipt['ballot'], receipt['leaf_index']
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f"can't read receipt: {e}")
+
+        leaf_hash_hex = merkle.leaf_hash(ballot.encode()).hex()
+        if leaf_hash_hex != receipt.get('leaf_hash'):
+            raise CommandError("the receipt's ballot does not hash to its leaf_hash")
+        # Against another root (e.g. a later published one) the proof must be fetched
+        # for that size: /main/audit/proof/<index>/?size=N
+        root = options['root'] or receipt['root']
+        size = options['size'] or receipt['tree_size']
+        self._check(leaf_hash_hex, index, size, receipt['inclusion_proof'], root)
+
+    def _verify_leaf(self, options):
+        index = options['leaf']
+        size = options['size'] or merkle.tree_size()
+        try:
+            leaf = AuditLeaf.objects.get(index=index)
+            path = merkle.inclusion_proof(index, size)
+        except (AuditLeaf.DoesNotExist, ValueError):
+            raise CommandError(f"no ballot #{index} in a tree of {size}")
+        root = options['root'] or merkle.root(size)[1]
+        if merkle.leaf_hash(leaf.ballot.encode()).hex() != leaf.leaf_hash:
+            raise CommandError(f"ballot #{index} was altered: it no longer hashes to its leaf")
+        self._check(leaf.leaf_hash, index, size, path, root)
+
+    def _verify_all(self):
+        problems = 0
+        leaves = list(AuditLeaf.objects.order_by('index').values_list('index', 'ballot', 'leaf_hash', 'voter_id',
+                                                                      'election_id'))
+        size = len(leaves)
+        if [index for index, *_ in leaves] != list(range(size)):
+            raise CommandError("leaf indexes are not contiguous from 0")
+
+        # 1. Every ballot still hashes to its leaf
+        hashes = []
+        for index, ballot, leaf_hash_hex, *_ in leaves:
+            digest = merkle.leaf_hash(ballot.encode())
+            if digest.hex() != leaf_hash_hex:
+                problems += 1
+                self.stdout.write(self.style.ERROR(f"ballot #{index}: content does not match its leaf hash"))
+            hashes.append(digest)
+
+        # 2. Every stored node matches a recomputation from the leaves
+        stored = {(level, index): h for level, index, h in AuditNode.objects.values_list('level', 'index', 'hash')}
+        level, row = 0, hashes
+        while row:
+            for index, digest in enumerate(row):
+                if stored.get((level, index)) != digest.hex():
+                    problems += 1
+                    self.stdout.write(self.style.ERROR(f"node ({level}, {index}) does not match the leaves"))
+            row = [merkle.node_hash(row[i], row[i + 1]) for i in range(0, len(row) - 1, 2)]
+            level += 1
+
+        # 3. The published root is the root of these leaves
+        _, root = merkle.root(size)
+        if size and _mth(hashes).hex() != root:
+            problems += 1
+            self.stdout.write(self.style.ERROR("the root does not match the leaves"))
+
+        # 4. The stored votes are the ballots that were committed
+        # A voter has one ballot per election
+        stored_votes = {}
+        for voter_id, votes in tallies.votes_by_voter().items():
+            for vote in votes:
+                stored_votes.setdefault((voter_id, vote.election_id), []).append(vote)
+        seen = set()
+        for index, ballot, _, voter_id, election_id in leaves:
+            if voter_id is None or election_id is None:
+                continue  # voter or election deleted (or archived), and their votes with them
+            seen.add((voter_id, election_id))
+            committed = sorted(json.loads(ballot)['votes'])
+            current = sorted([v.position_id, v.candidate_id, v.vote_type, v.choice]
+                             for v in stored_votes.get((voter_id, election_id), []))
+            if committed != current:
+                problems += 1
+                self.stdout.write(self.style.ERROR(f"ballot #{index}: stored votes differ from the committed ballot"))
+        for voter_id, election_id in set(stored_votes) - seen:
+            problems += 1
+            self.stdout.write(self.style.ERROR(f"voter {voter_id} has votes in election {election_id} but no "
+                                               "ballot in the audit tree "
+                                               "(cast before auditing, or written outside vote_view)"))
+
+        if problems:
+            raise CommandError(f"{problems} problem(s) found in {size} ballots")
+        self.stdout.write(self.style.SUCCESS(f"{size} ballots verified; root {root}"))
+
+
+def _mth(hashes):
+    """RFC 6962 Merkle tree hash of a list of leaf hashes, straight from the definition"""
+    if len(hashes) == 1:
+        return hashes[0]
+    k = 1 << ((len(hashes) - 1).bit_length() - 1)
+    return merkle.node_hash(_mth(hashes[:k]), _mth(hashes[k:]))
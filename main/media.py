@@ -0,0 +1,156 @@
+# main/media.py
+"""
+Cache-friendly serving of uploaded media (candidate photos and thumbnails).
+
+django.views.static.serve is meant for development: it sends no caching
+headers and ties up a worker for the whole download. This view:
+
+- marks content-hashed files as immutable for a year, so browsers never
+  ask for them again: thumbnails, whose names carry the hash, and
+  photos requested with ?v=<hash> when that is the photo's current
+  Candidate.photo_hash (any other ?v= would pin a stale copy);
+- answers If-None-Match / If-Modified-Since with 304;
+- supports single byte-range requests (206 / 416);
+- prefers precompressed .br / .gz siblings when the client accepts them;
+- can hand the transfer off to the front server with X-Accel-Redirect or
+  X-Sendfile (MEDIA_SENDFILE_HEADER) so the worker is freed at once.
+"""
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .models import Candidate
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# <16 hex chars>_<size>.<ext>, as written by main.thumbnails
+_HASHED_NAME = re.compile(r'(^|/)[0-9a-f]{16}_\d+\.\w+$')
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Precompressed siblings, in order of preference
+_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+_CHUNK_SIZE = 64 * 1024
+
+
+def is_content_hashed(request, path):
+    if _HASHED_NAME.search(path):
+        return True
+    version = request.GET.get('v')
+    return bool(version) and Candidate.objects.filter(photo=path, photo_hash=version).exists()
+
+
+def _etag(path, stat):
+    match = _HASHED_NAME.search(path)
+    if match:
+        # Name already identifies the content
+        return '"%s"' % os.path.basename(path)
+    return '"%x-%x"' % (stat.st_mtime_ns, stat.st_size)
+
+
+def _cache_control(hashed):
+    if hashed:
+        return f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    return f"public, max-age={getattr(settings, 'MEDIA_CACHE_MAX_AGE', 3600)}"
+
+
+def _pick_encoding(request, full_path):
+    accepted = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    for encoding, suffix in _ENCODINGS:
+        if encoding in accepted and os.path.isfile(full_path + suffix):
+            return encoding, full_path + suffix
+    return None, full_path
+
+
+def _parse_range(header, size):
+    """Return (start, end) inclusive for a single satisfiable range, None to ignore it, or False if unsatisfiable"""
+    match = _RANGE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_media(request, path):
+    # safe_join raises SuspiciousFileOperation (400) for paths outside MEDIA_ROOT
+    full_path = safe_join(settings.MEDIA_ROOT, path)
+    if not os.path.isfile(full_path):
+        raise Http404("Media file not found")
+
+    stat = os.stat(full_path)
+    etag = _etag(path, stat)
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    cache_control = _cache_control(is_content_hashed(request, path))
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if not_modified is not None:
+        not_modified['Cache-Control'] = cache_control
+        return not_modified
+
+    sendfile_header = getattr(settings, 'MEDIA_SENDFILE_HEADER', None)
+    range_header = request.META.get('HTTP_RANGE')
+    if range_header and request.META.get('HTTP_IF_RANGE', etag) != etag:
+        # The client's partial copy is stale: send the whole file
+        range_header = None
+
+    if sendfile_header:
+        # Front server (nginx/Apache) streams the file and handles ranges itself
+        response = HttpResponse(content_type=content_type)
+        response[sendfile_header] = getattr(settings, 'MEDIA_SENDFILE_PREFIX', '/protected-media/') + path
+    elif range_header:
+        byte_range = _parse_range(range_header, stat.st_size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{stat.st_size}"
+            return response
+        if byte_range is None:
+            response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+        else:
+            start, end = byte_range
+            length = end - start + 1
+            response = StreamingHttpResponse(
+                _read_range(full_path, start, length), status=206, content_type=content_type,
+            )
+            response['Content-Length'] = str(length)
+            response['Content-Range'] = f"bytes {start}-{end}/{stat.st_size}"
+    else:
+        encoding, send_path = _pick_encoding(request, full_path)
+        response = FileResponse(open(send_path, 'rb'), content_type=content_type)
+        if encoding:
+            response['Content-Encoding'] = encoding
+        response['Vary'] = 'Accept-Encoding'
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = cache_control
+    return response
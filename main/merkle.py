@@ -0,0 +1,182 @@
+# main/merkle.py
+"""
+Append-only Merkle tree over committed ballots, so observers can check
+that no ballot was changed after it was cast.
+
+The tree follows RFC 6962 / RFC 9162 (Certificate Transparency):
+- leaf hash = SHA-256(0x00 || canonical ballot JSON);
+- node hash = SHA-256(0x01 || left || right);
+- for a tree that isn't a power of two, the left subtree is the largest
+  power of two.
+
+It is built incrementally. Each ballot adds its leaf and every subtree
+the leaf completes (AuditNode rows), inside the ballot's transaction
+(with BALLOT_SHARDS, just after the shard commits; see main/ballots.py).
+That is O(log n) work, and nodes are never rewritten. The root of n
+leaves is folded from at most log2(n) stored subtree roots.
+
+Each voter's receipt holds their ballot JSON (with a random nonce, so
+the hash can't be brute-forced from the few possible choices), its
+leaf index and an inclusion proof. Checking a proof against the
+published root costs O(log n) hashes; see verify_inclusion() and
+`manage.py verify_audit`.
+"""
+import hashlib
+import json
+import secrets
+
+from django.db.models import Q
+
+from .models import AuditLeaf, AuditNode
+
+
+def leaf_hash(data):
+    return hashlib.sha256(b'\x00' + data).digest()
+
+
+def node_hash(left, right):
+    return hashlib.sha256(b'\x01' + left + right).digest()
+
+
+def canonical_ballot(voter_id, nonce, votes):
+    """The JSON string whose UTF-8 bytes a ballot's leaf hash covers"""
+    return json.dumps(
+        {'voter': voter_id, 'nonce': nonce, 'votes': sorted(list(v) for v in votes)},
+        separators=(',', ':'), sort_keys=True,
+    )
+
+
+def _largest_power_of_two_below(n):
+    """Largest k = 2**i with k < n (n >= 2)"""
+    return 1 << ((n - 1).bit_length() - 1)
+
+
+def tree_size():
+    last = AuditLeaf.objects.order_by('-index').values_list('index', flat=True).first()
+    return 0 if last is None else last + 1
+
+
+def append(voter, votes, election_id=None):
+    """
+    Add a ballot to the tree; call inside the ballot's transaction. `votes`
+    is a list of (position_id, candidate_id, vote_type, choice). Returns
+    the AuditLeaf.
+    """
+    index = tree_size()
+    ballot = canonical_ballot(voter.id, secrets.token_hex(16), votes)
+    digest = leaf_hash(ballot.encode())
+    leaf = AuditLeaf.objects.create(index=index, voter=voter, election_id=election_id, ballot=ballot,
+                                    leaf_hash=digest.hex())
+
+    # Every trailing 1 bit of the index completes one subtree; its left
+    # halves are already stored, so fetch them in one query
+    wanted = []
+    level, i = 0, index
+    while i & 1:
+        wanted.append((level, i - 1))
+        level, i = level + 1, i >> 1
+    lefts = {}
+    if wanted:
+        query = Q()
+        for lvl, idx in wanted:
+            query |= Q(level=lvl, index=idx)
+        lefts = {(n.level, n.index): bytes.fromhex(n.hash) for n in AuditNode.objects.filter(query)}
+
+    nodes = [AuditNode(level=0, index=index, hash=digest.hex())]
+    level, i, current = 0, index, digest
+    while i & 1:
+        current = node_hash(lefts[(level, i - 1)], current)
+        level, i = level + 1, i >> 1
+        nodes.append(AuditNode(level=level, index=i, hash=current.hex()))
+    AuditNode.objects.bulk_create(nodes)
+    return leaf
+
+
+class _Nodes:
+    """Stored subtree hashes, fetched on demand and cached for one computation"""
+
+    def __init__(self):
+        self._cache = {}
+
+    def get(self, level, index):
+        key = (level, index)
+        if key not in self._cache:
+            row = AuditNode.objects.filter(level=level, index=index).values_list('hash', flat=True).first()
+            if row is None:
+                raise LookupError(f"audit node {key} is missing")
+            self._cache[key] = bytes.fromhex(row)
+        return self._cache[key]
+
+    def subtree(self, start, end):
+        """Merkle hash of leaves [start, end)"""
+        size = end - start
+        if size & (size - 1) == 0 and start % size == 0:
+            return self.get(size.bit_length() - 1, start // size)
+        k = _largest_power_of_two_below(size)
+        return node_hash(self.subtree(start, start + k), self.subtree(start + k, end))
+
+    def path(self, m, start, end):
+        """RFC 6962 audit path for leaf m within leaves [start, end)"""
+        size = end - start
+        if size == 1:
+            return []
+        k = _largest_power_of_two_below(size)
+        if m < start + k:
+            return self.path(m, start, start + k) + [self.subtree(start + k, end)]
+        return self.path(m, start + k, end) + [self.subtree(start, start + k)]
+
+
+def root(size=None):
+    """(tree size, root hash hex) now, or for an earlier size; the empty tree's root is SHA-256('')"""
+    size = tree_size() if size is None else size
+    if size == 0:
+        return 0, hashlib.sha256(b'').hexdigest()
+    return size, _Nodes().subtree(0, size).hex()
+
+
+def inclusion_proof(index, size=None):
+    """Audit path (list of hex hashes) proving leaf `index` is in the tree of `size` leaves"""
+    size = tree_size() if size is None else size
+    if not 0 <= index < size:
+        raise ValueError(f"leaf {index} is not in a tree of {size} ballots")
+    return [h.hex() for h in _Nodes().path(index, 0, size)]
+
+
+def verify_inclusion(leaf_hash_hex, index, size, path, root_hex):
+    """
+    RFC 9162 section 2.1.3.2: recompute the root from a leaf and its audit
+    path. Needs only the receipt and the published root, no database.
+    """
+    if not 0 <= index < size:
+        return False
+    fn, sn = index, size - 1
+    r = bytes.fromhex(leaf_hash_hex)
+    for p in path:
+        p = bytes.fromhex(p)
+        if sn == 0:
+            return False
+        if fn & 1 or fn == sn:
+            r = node_hash(p, r)
+            if not fn & 1:
+                while fn and not fn & 1:
+                    fn >>= 1
+                    sn >>= 1
+        else:
+            r = node_hash(r, p)
+        fn >>= 1
+        sn >>= 1
+    return sn == 0 and r.hex() == root_hex
+
+
+def receipt(leaf, size=None):
+    """Everything a voter needs to check their ballot later, as a dict"""
+    size, root_hex = root(size)
+    return {
+        'leaf_index': leaf.index,
+        # The exact string that was hashed: leaf_hash = SHA-256(0x00 || ballot)
+        'ballot': leaf.ballot,
+        'leaf_hash': leaf.leaf_hash,
+        'tree_size': size,
+        'root': root_hex,
+        'inclusion_proof': inclusion_proof(leaf.index, size),
+    }
@@ -0,0 +1,154 @@
+# main/metrics.py
+"""
+Request and election metrics in Prometheus text format.
+
+Each worker accumulates numbers in memory (cheap, no I/O per request) and
+every METRICS_FLUSH_INTERVAL seconds adds them into the shared store, so
+the /metrics endpoint reports totals for all gunicorn workers together.
+
+Recorded per URL name (see main/urls.py):
+- request latency histogram
+- SQL query count and time (via connection.execute_wrapper)
+- response bytes
+plus election counters: ballots committed, login successes/failures and
+credential emails sent.
+"""
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+from . import shared_store
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name -> (type, help)
+FAMILIES = {
+    'http_request_duration_seconds': ('histogram', 'Time spent handling the request, per URL name'),
+    'http_response_bytes_total': ('counter', 'Response body bytes sent, per URL name'),
+    'db_queries_total': ('counter', 'SQL statements executed, per URL name'),
+    'db_query_seconds_total': ('counter', 'Time spent in SQL statements, per URL name'),
+    'ballots_committed_total': ('counter', 'Ballots successfully submitted'),
+    'logins_total': ('counter', 'Login attempts by outcome'),
+    'credential_emails_total': ('counter', 'Credential emails by outcome'),
+}
+
+_lock = threading.Lock()
+_pending = defaultdict(float)
+_last_flush = time.monotonic()
+
+
+def is_enabled():
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+def _labels(**labels):
+    return ','.join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    """Add to a counter, e.g. inc('logins_total', outcome='success')"""
+    with _lock:
+        _pending[(name, _labels(**labels))] += amount
+
+
+def observe_request(view, duration, queries, query_seconds, response_bytes):
+    view_label = _labels(view=view)
+    with _lock:
+        # Buckets are cumulative, as Prometheus expects; every bucket is
+        # written (even with 0) so each view always exposes the full set
+        for bound in LATENCY_BUCKETS:
+            _pending[('http_request_duration_seconds_bucket', f'{view_label},le="{bound}"')] += duration <= bound
+        _pending[('http_request_duration_seconds_bucket', f'{view_label},le="+Inf"')] += 1
+        _pending[('http_request_duration_seconds_sum', view_label)] += duration
+        _pending[('http_request_duration_seconds_count', view_label)] += 1
+        _pending[('http_response_bytes_total', view_label)] += response_bytes
+        _pending[('db_queries_total', view_label)] += queries
+        _pending[('db_query_seconds_total', view_label)] += query_seconds
+
+
+def _ensure_table(conn):
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS metric ('
+        ' name TEXT NOT NULL,'
+        ' labels TEXT NOT NULL,'
+        ' value REAL NOT NULL,'
+        ' PRIMARY KEY (name, labels))'
+    )
+
+
+def flush(force=False):
+    """Push this worker's pending numbers into the shared store"""
+    global _last_flush
+    interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)
+    if not force and time.monotonic() - _last_flush < interval:
+        return
+
+    with _lock:
+        batch = list(_pending.items())
+        _pending.clear()
+        _last_flush = time.monotonic()
+    if not batch:
+        return
+
+    with shared_store.transaction() as conn:
+        _ensure_table(conn)
+        conn.executemany(
+            'INSERT INTO metric (name, labels, value) VALUES (?, ?, ?) '
+            'ON CONFLICT(name, labels) DO UPDATE SET value = value + excluded.value',
+            [(name, labels, value) for (name, labels), value in batch],
+        )
+
+
+def _family(name):
+    for suffix in ('_bucket', '_sum', '_count'):
+        if name.endswith(suffix) and name[:-len(suffix)] in FAMILIES:
+            return name[:-len(suffix)]
+    return name
+
+
+def _sort_key(row):
+    # Group a histogram's series by view, buckets in ascending order
+    name, labels, _ = row
+    base, _, bound = labels.partition(',le=')
+    bound = bound.strip('"')
+    return base, name, float('inf') if bound == '+Inf' else float(bound or 0)
+
+
+def render_prometheus():
+    flush(force=True)
+    conn = shared_store.get_connection()
+    _ensure_table(conn)
+    rows = conn.execute('SELECT name, labels, value FROM metric').fetchall()
+
+    by_family = defaultdict(list)
+    for name, labels, value in rows:
+        by_family[_family(name)].append((name, labels, value))
+
+    lines = []
+    for family in sorted(by_family):
+        kind, help_text = FAMILIES.get(family, ('untyped', ''))
+        lines.append(f'# HELP {family} {help_text}')
+        lines.append(f'# TYPE {family} {kind}')
+        for name, labels, value in sorted(by_family[family], key=_sort_key):
+            value = int(value) if float(value).is_integer() else value
+            lines.append(f'{name}{{{labels}}} {value}' if labels else f'{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+class QueryRecorder:
+    """connection.execute_wrapper hook that counts and times every statement"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
@@ -0,0 +1,198 @@
+# main/middleware.py
+import os
+import re
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+from django.middleware.gzip import GZipMiddleware
+from django.urls import Resolver404, resolve
+from django.utils.cache import patch_vary_headers
+from whitenoise.middleware import WhiteNoiseMiddleware
+from whitenoise.responders import MissingFileError
+
+from . import metrics, profiling, publish, slow_queries
+
+try:
+    import brotli
+except ImportError:  # optional: fall back to gzip only
+    brotli = None
+
+# Only text responses are worth compressing; images are already compressed
+# and event streams must reach the browser unbuffered.
+COMPRESSIBLE_TYPES = re.compile(
+    r'^(text/(?!event-stream)|application/(json|javascript|xml|xhtml\+xml)|image/svg\+xml)'
+)
+
+_accepts_br_re = re.compile(r'\bbr\b')
+
+
+class ProfilingMiddleware:
+    """
+    Run sampled requests under cProfile (see main.profiling).
+    While profiling is switched off this is a cached flag check per request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        config = profiling.get_config()
+        if not config['enabled']:
+            return self.get_response(request)
+
+        try:
+            url_name = resolve(request.path_info).url_name or 'unnamed'
+        except Resolver404:
+            url_name = 'unmatched'
+        if not profiling.should_profile(config, url_name):
+            return self.get_response(request)
+        return profiling.run_profiled(url_name, self.get_response, request)
+
+
+class SlowQueryMiddleware:
+    """
+    Keep the SQL each request runs and hand slow ones to main.slow_queries.
+    Sits outside MetricsMiddleware so its EXPLAINs are not counted as the
+    view's own queries.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not slow_queries.is_enabled():
+            return self.get_response(request)
+
+        recorders = []
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                recorder = slow_queries.StatementRecorder(connection.alias)
+                recorders.append(recorder)
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        statements = [s for recorder in recorders for s in recorder.statements]
+        if statements:
+            match = request.resolver_match
+            view = match.url_name if match and match.url_name else 'unmatched'
+            slow_queries.record(view, request.path, duration, statements)
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Record latency, SQL count/time and response size for every request,
+    labelled with the URL name. Numbers are exported by main.views.metrics_view.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not metrics.is_enabled():
+            return self.get_response(request)
+
+        recorder = metrics.QueryRecorder()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = request.resolver_match
+        view = match.url_name if match and match.url_name else 'unmatched'
+        if response.streaming:
+            size = int(response.get('Content-Length') or 0)
+        else:
+            size = len(response.content)
+
+        metrics.observe_request(view, duration, recorder.count, recorder.seconds, size)
+        metrics.flush()
+        return response
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Compress dynamic HTML/JSON responses.
+
+    Uses brotli when the `brotli` package is installed and the client asks
+    for it, gzip otherwise. Responses that may carry a secret (a CSRF
+    token was used while rendering them, or they set cookies) always get
+    gzip: GZipMiddleware pads its output with random bytes against BREACH,
+    and brotli has no such padding. Static files are compressed ahead of time by
+    WhiteNoise and skip this entirely because they already carry a
+    Content-Encoding.
+    """
+
+    def process_response(self, request, response):
+        content_type = response.get('Content-Type', '')
+        if not COMPRESSIBLE_TYPES.match(content_type):
+            return response
+
+        if (
+            brotli is None
+            or response.streaming
+            or not _accepts_br_re.search(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+            or len(response.content) < 200
+            or response.has_header('Content-Encoding')
+            or request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+            or response.cookies
+        ):
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        compressed = brotli.compress(response.content, quality=5)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+        # Compressed bytes differ from the uncompressed representation
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
+
+
+class PublishedResultsMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise, plus the published final results (main/publish.py).
+
+    WhiteNoise indexes its files once, at startup, but results are
+    published while the workers are running. Files under
+    PUBLISHED_RESULTS_URL are therefore looked up on first request and
+    then kept in the same index. Their names carry a content hash, so
+    they are served as immutable.
+    """
+
+    def __init__(self, *args, **kwargs):
+        # Before WhiteNoise's startup scan, which calls immutable_file_test()
+        self.published_prefix = publish.published_url()
+        super().__init__(*args, **kwargs)
+
+    def __call__(self, request):
+        url = request.path_info
+        if url.startswith(self.published_prefix) and url not in self.files:
+            static_file = self.find_published(url)
+            if static_file is not None:
+                return self.serve(static_file, request)
+        return super().__call__(request)
+
+    def find_published(self, url):
+        relative = url[len(self.published_prefix):]
+        if not self.url_is_canonical(url) or not publish.is_artifact(relative):
+            return None
+        try:
+            static_file = self.get_static_file(os.path.join(publish.published_dir(), relative), url)
+        except MissingFileError:
+            return None
+        self.files[url] = static_file
+        return static_file
+
+    def immutable_file_test(self, path, url):
+        return url.startswith(self.published_prefix) or super().immutable_file_test(path, url)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_electionsettings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='candidate',
+            name='photo_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=16),
+        ),
+    ]
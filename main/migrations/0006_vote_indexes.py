@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:21
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_candidate_photo_hash'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['position', 'candidate', 'vote_type', 'choice'], name='vote_tally_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['position', 'voter'], name='vote_position_voter_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['timestamp', 'voter'], name='vote_timestamp_voter_idx'),
+        ),
+    ]
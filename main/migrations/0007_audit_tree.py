@@ -0,0 +1,39 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_vote_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditLeaf',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField(unique=True)),
+                ('ballot', models.TextField()),
+                ('leaf_hash', models.CharField(max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('voter', models.OneToOneField(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='audit_leaf', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AuditNode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('level', models.PositiveSmallIntegerField()),
+                ('index', models.PositiveIntegerField()),
+                ('hash', models.CharField(max_length=64)),
+            ],
+            options={
+                'unique_together': {('level', 'index')},
+            },
+        ),
+    ]
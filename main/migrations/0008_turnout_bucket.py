@@ -0,0 +1,24 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_audit_tree'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TurnoutBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minute', models.DateTimeField(unique=True)),
+                ('ballots', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['minute'],
+            },
+        ),
+    ]
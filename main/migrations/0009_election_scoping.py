@@ -0,0 +1,118 @@
+# Generated by Django 5.2.5 on 2026-10-19 08:20
+
+import django.db.models.deletion
+import main.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+def assign_existing_rows(apps, schema_editor):
+    """Everything so far belonged to the one election there was"""
+    ElectionSettings = apps.get_model('main', 'ElectionSettings')
+    Position = apps.get_model('main', 'Position')
+    Vote = apps.get_model('main', 'Vote')
+    TurnoutBucket = apps.get_model('main', 'TurnoutBucket')
+    AuditLeaf = apps.get_model('main', 'AuditLeaf')
+
+    if not (Position.objects.exists() or TurnoutBucket.objects.exists() or AuditLeaf.objects.exists()):
+        return
+    election = ElectionSettings.objects.order_by('id').first()
+    if election is None:
+        election = ElectionSettings.objects.create(election_name="General Election")
+    Position.objects.filter(election__isnull=True).update(election=election)
+    Vote.objects.filter(election__isnull=True).update(
+        election_id=models.Subquery(
+            Position.objects.filter(pk=models.OuterRef('position_id')).values('election_id')[:1]
+        )
+    )
+    TurnoutBucket.objects.filter(election__isnull=True).update(election=election)
+    AuditLeaf.objects.filter(election__isnull=True).update(election=election)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_turnout_bucket'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='position',
+            name='election',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='positions', to='main.electionsettings'),
+        ),
+        migrations.AddField(
+            model_name='vote',
+            name='election',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='votes', to='main.electionsettings'),
+        ),
+        migrations.AddField(
+            model_name='turnoutbucket',
+            name='election',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='turnout_buckets', to='main.electionsettings'),
+        ),
+        migrations.AddField(
+            model_name='auditleaf',
+            name='election',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='main.electionsettings'),
+        ),
+        migrations.AlterField(
+            model_name='auditleaf',
+            name='voter',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='audit_leaves', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(assign_existing_rows, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='position',
+            name='election',
+            field=models.ForeignKey(default=main.models.default_election_id, on_delete=django.db.models.deletion.CASCADE, related_name='positions', to='main.electionsettings'),
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='election',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='votes', to='main.electionsettings'),
+        ),
+        migrations.AlterField(
+            model_name='turnoutbucket',
+            name='election',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='turnout_buckets', to='main.electionsettings'),
+        ),
+        migrations.AlterField(
+            model_name='turnoutbucket',
+            name='minute',
+            field=models.DateTimeField(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='turnoutbucket',
+            unique_together={('election', 'minute')},
+        ),
+        migrations.RemoveIndex(
+            model_name='vote',
+            name='vote_tally_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='vote',
+            name='vote_position_voter_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='vote',
+            name='vote_timestamp_voter_idx',
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['election', 'position', 'candidate', 'vote_type', 'choice'], name='vote_tally_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['election', 'position', 'voter'], name='vote_position_voter_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['election', 'timestamp', 'voter'], name='vote_timestamp_voter_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['election', 'voter'], name='vote_election_voter_idx'),
+        ),
+    ]
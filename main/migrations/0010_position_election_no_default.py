@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-19 08:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_election_scoping'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='position',
+            name='election',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='positions', to='main.electionsettings'),
+        ),
+    ]
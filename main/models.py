@@ -1,12 +1,22 @@
-from django.db import models
+from django.db import models, transaction
+from django.conf import settings
 from django.contrib.auth.models import User
 import uuid
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.utils import timezone 
+from .versions import bump_ballot_version, bump_results_version
+
+def default_election_id():
+    """The default election's id; only referenced by migration 0009 now"""
+    from .elections import default
+    return default().id
 
 # Create your models here.
 class Position(models.Model):
+    # No default: it would query (and could create) an election for every
+    # Position() built, even an empty PositionForm. Set it explicitly.
+    election = models.ForeignKey('ElectionSettings', on_delete=models.CASCADE, related_name='positions')
     position_name = models.CharField(max_length=100)
     description = models.TextField()
 
@@ -21,6 +31,8 @@ class Candidate(models.Model):
     candidate_name = models.ForeignKey(User, on_delete=models.CASCADE, related_name='candidate_name')
     photo = models.ImageField(upload_to='candidate_photos/')
     candidate_position = models.ForeignKey(Position, on_delete=models.CASCADE, related_name='candidate_position')
+    # Content hash of the current photo; names its ballot-sized thumbnails
+    photo_hash = models.CharField(max_length=16, blank=True, default='', editable=False)
 
     class Meta:
         unique_together = ('candidate_name', 'candidate_position')
@@ -28,11 +40,58 @@ class Candidate(models.Model):
     def __str__(self):
         return f"{self.candidate_name.first_name} {self.candidate_name.last_name}"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.refresh_thumbnails()
+
+    def refresh_thumbnails(self, force=False):
+        """Generate the photo thumbnails and remember which photo they belong to"""
+        from .thumbnails import generate_thumbnails
+
+        photo_hash = generate_thumbnails(self.photo, force=force) if self.photo else ''
+        if photo_hash != self.photo_hash:
+            self.photo_hash = photo_hash
+            # update() so we don't re-enter save()
+            Candidate.objects.filter(pk=self.pk).update(photo_hash=photo_hash)
+            # The ballot markup points at the thumbnails, so it is stale now
+            bump_ballot_version()
+
+    def thumbnail_url(self, size, ext='jpg'):
+        from .thumbnails import thumbnail_name
+        return settings.MEDIA_URL + thumbnail_name(self.photo_hash, size, ext)
+
+    def _srcset(self, ext):
+        from .thumbnails import thumbnail_sizes
+        return ", ".join(f"{self.thumbnail_url(size, ext)} {size}w" for size in thumbnail_sizes())
+
+    @property
+    def photo_versioned_url(self):
+        """Original photo URL with a content version, so it can be cached as immutable"""
+        if self.photo_hash:
+            return f"{self.photo.url}?v={self.photo_hash}"
+        return self.photo.url
+
+    @property
+    def photo_thumbnail_url(self):
+        """Smallest JPEG thumbnail, used as the plain <img src> fallback"""
+        from .thumbnails import thumbnail_sizes
+        return self.thumbnail_url(min(thumbnail_sizes()))
+
+    @property
+    def photo_srcset(self):
+        return self._srcset('jpg')
+
+    @property
+    def photo_webp_srcset(self):
+        return self._srcset('webp')
+
 class Vote(models.Model):
     # Different vote types based on number of candidates
     SINGLE_CANDIDATE = 'single'
     MULTIPLE_CANDIDATES = 'multiple'
     
+    # Copied from the position on save, so every index can lead with it
+    election = models.ForeignKey('ElectionSettings', on_delete=models.CASCADE, related_name='votes', editable=False)
     voter = models.ForeignKey(User, on_delete=models.CASCADE, related_name='votes')
     position = models.ForeignKey(Position, on_delete=models.CASCADE)
     candidate = models.ForeignKey(Candidate, on_delete=models.CASCADE)
@@ -45,6 +104,17 @@ class Vote(models.Model):
     class Meta:
         # Each voter can only vote once per position
         unique_together = ('voter', 'position')
+        # All lead with the election, so one election's queries only read its own rows
+        indexes = [
+            # Tally counts filter on all four columns; covering, so counts never touch the table
+            models.Index(fields=['election', 'position', 'candidate', 'vote_type', 'choice'], name='vote_tally_idx'),
+            # Distinct voters per position (turnout per position)
+            models.Index(fields=['election', 'position', 'voter'], name='vote_position_voter_idx'),
+            # Turnout over time
+            models.Index(fields=['election', 'timestamp', 'voter'], name='vote_timestamp_voter_idx'),
+            # Who has voted in the election
+            models.Index(fields=['election', 'voter'], name='vote_election_voter_idx'),
+        ]
 
     def __str__(self):
         if self.vote_type == self.SINGLE_CANDIDATE:
@@ -59,13 +129,65 @@ class Vote(models.Model):
             self.choice = 'selected'
         else:
             self.vote_type = self.SINGLE_CANDIDATE
+        self.election_id = self.position.election_id
         super().save(*args, **kwargs)
 
+class TurnoutBucket(models.Model):
+    """
+    Ballots committed in one minute (UTC) in one election, kept up to date
+    by record_ballot so the dashboard's turnout chart never scans
+    main_vote. See main/turnout.py.
+    """
+    election = models.ForeignKey('ElectionSettings', on_delete=models.CASCADE, related_name='turnout_buckets')
+    minute = models.DateTimeField()
+    ballots = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['minute']
+        unique_together = ('election', 'minute')
+
+    def __str__(self):
+        return f"{self.minute:%Y-%m-%d %H:%M}: {self.ballots}"
+
+class AuditLeaf(models.Model):
+    """
+    One committed ballot in the audit Merkle tree (see main/merkle.py).
+    `ballot` is the exact canonical JSON that was hashed into `leaf_hash`.
+    """
+    index = models.PositiveIntegerField(unique=True)
+    # Kept if the user or election is later deleted: the tree can't change.
+    # One tree covers every election; a voter has one leaf per election.
+    voter = models.ForeignKey(User, null=True, on_delete=models.SET_NULL, related_name='audit_leaves')
+    election = models.ForeignKey('ElectionSettings', null=True, on_delete=models.SET_NULL, related_name='+')
+    ballot = models.TextField()
+    leaf_hash = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Ballot #{self.index} ({self.leaf_hash[:12]})"
+
+class AuditNode(models.Model):
+    """
+    A complete subtree of the audit tree: level 0 are leaf hashes, a node
+    at (level, index) covers leaves [index * 2**level, (index + 1) * 2**level).
+    Written once, when its last leaf arrives, and never updated.
+    """
+    level = models.PositiveSmallIntegerField()
+    index = models.PositiveIntegerField()
+    hash = models.CharField(max_length=64)
+
+    class Meta:
+        unique_together = ('level', 'index')
+
+    def __str__(self):
+        return f"({self.level}, {self.index}) {self.hash[:12]}"
+
 class ElectionSettings(models.Model):
     """
-    Controls when voting is active
+    One election, and controls when voting is active
     - Can use scheduled timing (automatic)
     - Can use manual override (buttons)
+    Several can run side by side; positions and votes belong to one.
     """
     election_name = models.CharField(max_length=200, default="General Election")
     
@@ -151,4 +273,52 @@ class ElectionSettings(models.Model):
 def create_default_election_settings(sender, instance, created, **kwargs):
     """Create default election settings if none exist"""
     if created and not ElectionSettings.objects.exists():
-        ElectionSettings.objects.create(election_name="General Election")
\ No newline at end of file
+        ElectionSettings.objects.create(election_name="General Election")
+
+# Anything shown on the ballot changed: cached ballot markup is stale
+@receiver(post_save, sender=Position)
+@receiver(post_delete, sender=Position)
+@receiver(post_save, sender=Candidate)
+@receiver(post_delete, sender=Candidate)
+def invalidate_ballot_cache(sender, **kwargs):
+    bump_ballot_version()
+
+@receiver(post_save, sender=User)
+def invalidate_ballot_cache_on_user_change(sender, update_fields=None, **kwargs):
+    """Candidate names come from User, but logins only touch last_login"""
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    if Candidate.objects.filter(candidate_name=kwargs['instance']).exists():
+        bump_ballot_version()
+
+# Anything shown on the results pages changed: cached results are stale
+@receiver(post_save, sender=Vote)
+def invalidate_results_cache_on_vote_change(sender, created=False, **kwargs):
+    # New ballots come through record_ballot, which bumps once per ballot
+    if not created:
+        transaction.on_commit(bump_results_version, robust=True)
+
+@receiver(post_delete, sender=Vote)
+@receiver(post_delete, sender=User)
+def invalidate_results_cache(sender, **kwargs):
+    transaction.on_commit(bump_results_version, robust=True)
+
+@receiver(post_save, sender=ElectionSettings)
+def unpublish_reopened_results(sender, instance, **kwargs):
+    """Published final results no longer hold once voting can resume"""
+    from .publish import election_closed, unpublish
+    if not election_closed(instance):
+        unpublish(instance.id)
+
+@receiver(post_save, sender=ElectionSettings)
+@receiver(post_delete, sender=ElectionSettings)
+def refresh_default_election(sender, **kwargs):
+    from .elections import refresh_default
+    refresh_default()
+
+@receiver(post_save, sender=User)
+def invalidate_results_cache_on_user_change(sender, created=False, update_fields=None, **kwargs):
+    """The voter lists show names and e-mails; logins only touch last_login"""
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    transaction.on_commit(bump_results_version, robust=True)
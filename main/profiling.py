@@ -0,0 +1,147 @@
+# main/profiling.py
+"""
+On-demand request profiling for production.
+
+Staff switch profiling on at /main/profiles/ with a sample rate and/or a
+list of URL names. The switch lives in the shared store so every worker
+follows it. Each worker re-reads it at most every PROFILING_CONFIG_TTL
+seconds, so while profiling is off a request costs one clock comparison.
+
+Sampled requests run under cProfile. The stats are written to
+PROFILING_DIR as .prof files, which load with `python -m pstats`,
+snakeviz, or flameprof/gprof2dot for flame graphs.
+"""
+import cProfile
+import os
+import random
+import re
+import time
+
+from django.conf import settings
+
+from . import shared_store
+
+# <epoch ms>_<url name>_<duration ms>ms_<pid>.prof
+PROFILE_NAME = re.compile(r'^(\d+)_([\w-]+)_(\d+)ms_(\d+)\.prof$')
+
+_cached = (0.0, None)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def profile_dir():
+    return str(_setting('PROFILING_DIR', os.path.join(settings.BASE_DIR, 'profiles')))
+
+
+def get_config():
+    """Current switch as {'enabled', 'rate', 'url_names'}, cached briefly per worker"""
+    global _cached
+    expires, config = _cached
+    now = time.monotonic()
+    if config is not None and now < expires:
+        return config
+
+    names = shared_store.get('profiling:url_names', '') or ''
+    config = {
+        'enabled': bool(shared_store.get('profiling:enabled', 0)),
+        'rate': float(shared_store.get('profiling:rate', 0.0) or 0.0),
+        'url_names': [n for n in names.split(',') if n],
+    }
+    _cached = (now + _setting('PROFILING_CONFIG_TTL', 2), config)
+    return config
+
+
+def set_config(enabled, rate=0.0, url_names=()):
+    global _cached
+    with shared_store.transaction():
+        shared_store.set('profiling:enabled', 1 if enabled else 0)
+        shared_store.set('profiling:rate', max(0.0, min(float(rate), 1.0)))
+        shared_store.set('profiling:url_names', ','.join(url_names))
+    _cached = (0.0, None)
+
+
+def should_profile(config, url_name):
+    if not config['enabled']:
+        return False
+    if url_name in config['url_names']:
+        return True
+    return config['rate'] > 0 and random.random() < config['rate']
+
+
+def run_profiled(url_name, func, *args):
+    """
+    Call func(*args) under cProfile and save the stats; returns func's
+    result. Python 3.12+ allows one active profiler per process, so while
+    another thread's request is being profiled this one runs unprofiled.
+    """
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        return func(*args)
+    start = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        profiler.disable()
+        elapsed_ms = int((time.perf_counter() - start) * 1000)
+        _save(profiler, url_name, elapsed_ms)
+
+
+def _save(profiler, url_name, elapsed_ms):
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    name = f"{int(time.time() * 1000)}_{url_name}_{elapsed_ms}ms_{os.getpid()}.prof"
+    profiler.dump_stats(os.path.join(directory, name))
+    _prune(directory)
+
+
+def _prune(directory):
+    keep = _setting('PROFILING_MAX_FILES', 200)
+    names = sorted(n for n in os.listdir(directory) if PROFILE_NAME.match(n))
+    for old in names[:-keep] if len(names) > keep else []:
+        try:
+            os.remove(os.path.join(directory, old))
+        except FileNotFoundError:
+            pass  # another worker pruned it first
+
+
+def list_profiles():
+    """Saved profiles, newest first"""
+    directory = profile_dir()
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in os.listdir(directory):
+        match = PROFILE_NAME.match(name)
+        if not match:
+            continue
+        started, url_name, duration, pid = match.groups()
+        profiles.append({
+            'name': name,
+            'url_name': url_name,
+            'duration_ms': int(duration),
+            'pid': int(pid),
+            'recorded_at': int(started) / 1000,
+            'size': os.path.getsize(os.path.join(directory, name)),
+        })
+    profiles.sort(key=lambda p: p['recorded_at'], reverse=True)
+    return profiles
+
+
+def profile_path(name):
+    """Absolute path of a saved profile, or None if the name is not one of ours"""
+    if not PROFILE_NAME.match(name):
+        return None
+    path = os.path.join(profile_dir(), name)
+    return path if os.path.isfile(path) else None
+
+
+def delete_all():
+    for profile in list_profiles():
+        try:
+            os.remove(os.path.join(profile_dir(), profile['name']))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,288 @@
+# main/publish.py
+"""
+Final results, published once as static files when the election closes.
+
+After the close nothing can change the results, yet that is when the
+public loads them most. publish() renders the results page, a JSON
+document and the PDF once, into PUBLISHED_RESULTS_DIR/<version>/, where
+<version> is a hash of the JSON. PublishedResultsMiddleware (a
+WhiteNoise subclass, main/middleware.py) serves that directory under
+PUBLISHED_RESULTS_URL. The names change with the content, so the files
+are cached as immutable. vote_results then serves the published page
+straight from disk, without touching the database.
+
+current-<election id>.json in the same directory names an election's
+published version. Each worker rereads it only when its mtime changes,
+so checking "are the results published?" costs one stat() per request.
+Without ?election=, vote_results shows the most recently published
+election (latest()), so creating the next election doesn't replace the
+results that were just published with an empty page.
+
+The page is its own template (published_results.html). It is rendered
+without a request and served to everyone, so it has no per-user
+navigation or messages.
+
+Publishing happens when the election is stopped manually, or with
+`manage.py publish_results` (e.g. from cron after a scheduled end). The
+first results request after a scheduled end also starts it, in a
+background thread; until that finishes, requests get the live page,
+which shows the same final counts. Reopening the election unpublishes (see the
+ElectionSettings receiver in main/models.py). Old versions stay on disk
+because browsers may still have their URLs cached.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections
+from django.http import FileResponse, HttpResponseNotModified
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from . import elections, results_pdf, tallies
+
+try:
+    import fcntl
+except ImportError:  # POSIX only; elsewhere concurrent publishes just repeat the work
+    fcntl = None
+
+ARTIFACTS = ('results.html', 'results.json', 'results.pdf')
+_ARTIFACT_PATH = re.compile(r'^[0-9a-f]{16}/results\.(html|json|pdf)$')
+_MANIFEST_NAME = re.compile(r'^current-(\d+)\.json$')
+
+logger = logging.getLogger(__name__)
+
+_manifests = {}  # election id -> (mtime_ns, data) of its last current-<id>.json read
+_lock = threading.Lock()
+_publishing = set()  # election ids being published by a thread of this worker
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def published_dir():
+    return str(_setting('PUBLISHED_RESULTS_DIR', os.path.join(settings.BASE_DIR, 'published')))
+
+
+def published_url():
+    return _setting('PUBLISHED_RESULTS_URL', '/published/')
+
+
+def is_artifact(relative_path):
+    """Whether '<version>/<name>' names a published file"""
+    return bool(_ARTIFACT_PATH.match(relative_path))
+
+
+def _manifest_path(election_id):
+    return os.path.join(published_dir(), f'current-{int(election_id)}.json')
+
+
+def current(election_id):
+    """The election's published version as {'version', 'published_at', 'election', 'urls'}, or None"""
+    if election_id is None:
+        return None
+    path = _manifest_path(election_id)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    cached = _manifests.get(election_id)
+    if cached is None or cached[0] != mtime:
+        with open(path, encoding='utf-8') as f:
+            cached = _manifests[election_id] = (mtime, json.load(f))
+    return cached[1]
+
+
+def latest():
+    """
+    The manifest of the most recently published election, or None. One
+    directory listing and a stat() per published election; no database.
+    """
+    try:
+        entries = os.scandir(published_dir())
+    except FileNotFoundError:
+        return None
+    newest = None
+    with entries:
+        for entry in entries:
+            match = _MANIFEST_NAME.match(entry.name)
+            if not match:
+                continue
+            try:
+                mtime = entry.stat().st_mtime_ns
+            except FileNotFoundError:
+                continue  # unpublished meanwhile
+            if newest is None or mtime > newest[0]:
+                newest = (mtime, int(match.group(1)))
+    return current(newest[1]) if newest else None
+
+
+def election_closed(election):
+    """Voting has ended (manually or on schedule) and can't take more ballots"""
+    if election is None or election.get_voting_status():
+        return False
+    if election.is_manual_override:
+        return election.manual_end_time is not None
+    return election.scheduled_end is not None and election.scheduled_end <= timezone.now()
+
+
+def _document(election, context):
+    """The results as plain JSON-ready data"""
+    total_voters = User.objects.count()
+    voted_count = tallies.voted_count(election)
+    positions = []
+    for result in context['results']:
+        candidates = []
+        for item in result['candidates']:
+            candidate = item['candidate']
+            entry = {
+                'id': candidate.id,
+                'name': f"{candidate.candidate_name.first_name} {candidate.candidate_name.last_name}",
+            }
+            if item['is_multiple']:
+                entry.update(selected=item['selected_count'], total_votes=item['total_votes'])
+            else:
+                entry.update(yes=item['yes_count'], no=item['no_count'], total=item['total'])
+            candidates.append(entry)
+        positions.append({
+            'id': result['position'].id,
+            'name': result['position'].position_name,
+            'has_multiple': result['has_multiple'],
+            'candidates': candidates,
+        })
+    return {
+        'election_id': election.id,
+        'election': election.election_name,
+        'total_voters': total_voters,
+        'voted': voted_count,
+        'not_voted': total_voters - voted_count,
+        'audit': {'tree_size': context['audit_size'], 'root': context['audit_root'],
+                  'hash': 'sha256', 'tree': 'RFC 6962'},
+        'positions': positions,
+    }
+
+
+def _write_atomic(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _render(directory, version, election, context, document):
+    prefix = f"{published_url()}{version}/"
+    manifest = {
+        'version': version,
+        'published_at': timezone.now().isoformat(),
+        'election_id': document['election_id'],
+        'election': document['election'],
+        'urls': {name.rsplit('.', 1)[1]: prefix + name for name in ARTIFACTS},
+    }
+    body = json.dumps(document, indent=2).encode()
+    html = render_to_string('main/published_results.html', dict(
+        context, published=manifest, election=election,
+    )).encode()
+    for name, data in (('results.json', body), ('results.html', html)):
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(data)
+        # WhiteNoise serves these precompressed copies to clients that accept gzip
+        with open(os.path.join(directory, name + '.gz'), 'wb') as f:
+            f.write(gzip.compress(data, 9, mtime=0))
+    results_pdf.build(os.path.join(directory, 'results.pdf'), election)
+    return manifest
+
+
+def publish(election=None, force=False):
+    """
+    Render and publish the final results of `election` (default: the
+    default election); returns the manifest. Without `force`, an already
+    published version is returned as it is.
+    """
+    from .views import _vote_results_context  # views imports this module
+
+    election = elections.resolve(election)
+    root = published_dir()
+    os.makedirs(root, exist_ok=True)
+    lock_fd = os.open(os.path.join(root, '.lock'), os.O_RDWR | os.O_CREAT, 0o640)
+    try:
+        if fcntl is not None:
+            # Another worker may be publishing right now; wait and reuse its result
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        published = current(election.id)
+        if published is not None and not force:
+            return published
+
+        context = _vote_results_context(election)
+        document = _document(election, context)
+        version = hashlib.sha256(json.dumps(document, sort_keys=True).encode()).hexdigest()[:16]
+        directory = os.path.join(root, version)
+        if os.path.isdir(directory):
+            with open(os.path.join(directory, 'manifest.json'), encoding='utf-8') as f:
+                manifest = json.load(f)
+        else:
+            staging = tempfile.mkdtemp(dir=root, prefix='.publish-')
+            os.chmod(staging, 0o755)  # mkdtemp is private; a front server may serve these too
+            try:
+                manifest = _render(staging, version, election, context, document)
+                with open(os.path.join(staging, 'manifest.json'), 'w', encoding='utf-8') as f:
+                    json.dump(manifest, f)
+                os.replace(staging, directory)
+            except BaseException:
+                shutil.rmtree(staging, ignore_errors=True)
+                raise
+        _write_atomic(_manifest_path(election.id), json.dumps(manifest).encode())
+        return manifest
+    finally:
+        if fcntl is not None:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+        os.close(lock_fd)
+
+
+def _run(election_id):
+    try:
+        publish(election_id)
+    except Exception:
+        logger.exception("publishing the final results of election %s failed", election_id)
+    finally:
+        connections.close_all()  # this thread's connections only
+        with _lock:
+            _publishing.discard(election_id)
+
+
+def publish_in_background(election):
+    """Start publish() for `election` in a thread, unless this worker is already publishing it"""
+    with _lock:
+        if election.id in _publishing:
+            return
+        _publishing.add(election.id)
+    threading.Thread(target=_run, args=(election.id,), name='publish-results', daemon=True).start()
+
+
+def unpublish(election_id):
+    """Go back to live results for the election; the published files stay for cached links"""
+    try:
+        os.unlink(_manifest_path(election_id))
+    except FileNotFoundError:
+        pass
+
+
+def serve_page(request, published):
+    """The published results page at its usual URL: cached for a while, revalidated by version"""
+    etag = f'"{published["version"]}"'
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+    else:
+        path = os.path.join(published_dir(), published['version'], 'results.html')
+        response = FileResponse(open(path, 'rb'), content_type='text/html; charset=utf-8')
+    response['ETag'] = etag
+    response['Cache-Control'] = f"public, max-age={_setting('PUBLISHED_RESULTS_MAX_AGE', 300)}"
+    return response
@@ -0,0 +1,235 @@
+# main/replica.py
+"""
+Read replica for read-only pages.
+
+Views decorated with @read_from_replica (the admin home page and the
+per-candidate voter list) send their main-app reads to the 'replica'
+alias instead of the SQLite file that ballot writes are serialized on.
+That alias is a snapshot copy of the primary, taken with SQLite's
+online backup API.
+
+The results pages, dashboard, voted/not-voted lists and the PDF read
+the primary: they are cached per results tag (main/results_cache.py),
+and a lagging snapshot would be cached under the newer tag. The voter
+list only reads users, which stay on the primary (below).
+
+- The snapshot is refreshed lazily, in a background thread, never in
+  the request that notices it is due. A replica read finding it older
+  than half of REPLICA_MAX_STALENESS starts the copy, so it is normally
+  done before the snapshot is too old to use. Only one worker copies at
+  a time, coordinated through the shared store.
+- A new snapshot is written to a temp file and swapped in with
+  os.replace, so readers never see a half-written copy. Each worker
+  reopens its replica connection when the snapshot generation changes.
+- While the snapshot is missing or older than REPLICA_MAX_STALENESS
+  (the copy is still running, failed, or the primary is not SQLite),
+  requests read from the primary.
+
+Writes, and models that must always be current (see ReplicaRouter),
+always go to the primary. That includes django.contrib.auth, so
+request.user and permission checks never see a stale copy (a staff
+account created or promoted a moment ago must pass
+@staff_member_required at once).
+"""
+import contextvars
+import functools
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from . import shared_store
+
+logger = logging.getLogger(__name__)
+
+REPLICA_DB_ALIAS = 'replica'
+
+# Set for the duration of a @read_from_replica view
+_use_replica = contextvars.ContextVar('use_replica', default=False)
+
+# Snapshot generation each thread's replica connection was opened on
+_local = threading.local()
+
+_refresh_lock = threading.Lock()
+_refresh_thread = None  # this worker's background refresh, if one is running
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def is_enabled():
+    if not _setting('REPLICA_ENABLED', True) or REPLICA_DB_ALIAS not in settings.DATABASES:
+        return False
+    # Under the test runner the replica mirrors the primary; nothing to copy
+    return connections[REPLICA_DB_ALIAS].settings_dict['NAME'] != connections[DEFAULT_DB_ALIAS].settings_dict['NAME']
+
+
+def snapshot_path():
+    return str(_setting('REPLICA_SNAPSHOT_PATH', os.path.join(settings.BASE_DIR, 'db_replica.sqlite3')))
+
+
+def state():
+    """(generation, refreshed_at) of the current snapshot; (0, 0.0) if there is none"""
+    return (int(shared_store.get('replica:generation', 0) or 0),
+            float(shared_store.get('replica:refreshed_at', 0.0) or 0.0))
+
+
+def _primary_path():
+    primary = connections[DEFAULT_DB_ALIAS]
+    if primary.vendor != 'sqlite' or primary.is_in_memory_db():
+        return None
+    return str(primary.settings_dict['NAME'])
+
+
+def _refresh_after():
+    """Seconds after which a snapshot is due for a new copy"""
+    return _setting('REPLICA_MAX_STALENESS', 30) / 2
+
+
+def refresh(force=False):
+    """
+    Copy the primary into a fresh snapshot. Returns True if this call made
+    a new snapshot, False if it was fresh enough already, another worker
+    is copying, or the primary can't be snapshotted. Blocks for the whole
+    copy; requests use refresh_in_background().
+    """
+    source = _primary_path()
+    if source is None:
+        return False
+
+    now = time.time()
+    with shared_store.transaction():
+        refreshed_at = float(shared_store.get('replica:refreshed_at', 0.0) or 0.0)
+        busy_until = float(shared_store.get('replica:refreshing_until', 0.0) or 0.0)
+        if not force and now - refreshed_at < _refresh_after():
+            return False
+        if busy_until > now:
+            return False
+        # Claim the copy; the claim lapses on its own if this worker dies
+        shared_store.set('replica:refreshing_until', now + _setting('REPLICA_REFRESH_TIMEOUT', 60))
+
+    target = snapshot_path()
+    try:
+        _copy(source, target)
+    except (sqlite3.Error, OSError):
+        shared_store.set('replica:refreshing_until', 0.0)
+        return False
+
+    with shared_store.transaction():
+        shared_store.incr('replica:generation')
+        shared_store.set('replica:refreshed_at', now)
+        shared_store.set('replica:refreshing_until', 0.0)
+    return True
+
+
+def _copy(source, target):
+    directory = os.path.dirname(target) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix='.replica-', suffix='.sqlite3', dir=directory)
+    os.close(fd)
+    try:
+        src = sqlite3.connect(source, timeout=20)
+        dst = sqlite3.connect(tmp)
+        try:
+            # One step: the whole copy reads a single consistent snapshot.
+            # In WAL mode that doesn't hold up ballot writers.
+            src.backup(dst)
+            # A plain rollback-journal file: the snapshot is only ever read,
+            # and must not leave -wal/-shm files behind when it is swapped
+            dst.execute('PRAGMA journal_mode = DELETE')
+        finally:
+            dst.close()
+            src.close()
+        os.replace(tmp, target)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _run_refresh():
+    try:
+        refresh(force=not os.path.exists(snapshot_path()))
+    except Exception:
+        logger.exception("refreshing the read replica failed")
+    finally:
+        connections.close_all()  # this thread's connections only
+
+
+def refresh_in_background():
+    """Start refresh() in a thread, unless this worker's previous one is still running"""
+    global _refresh_thread
+    with _refresh_lock:
+        if _refresh_thread is not None and _refresh_thread.is_alive():
+            return
+        _refresh_thread = threading.Thread(target=_run_refresh, name='replica-refresh', daemon=True)
+        _refresh_thread.start()
+
+
+def _prepare():
+    """Whether there is a usable snapshot (False: read from the primary); starts a refresh when one is due"""
+    generation, refreshed_at = state()
+    age = time.time() - refreshed_at
+    exists = os.path.exists(snapshot_path())
+    if not exists or age >= _refresh_after():
+        refresh_in_background()
+    if not exists or age >= _setting('REPLICA_MAX_STALENESS', 30):
+        return False
+
+    # The snapshot file was swapped since this thread's connection opened
+    # it; the old connection would keep reading the replaced copy
+    if getattr(_local, 'generation', None) != generation:
+        connections[REPLICA_DB_ALIAS].close()
+        _local.generation = generation
+    return True
+
+
+def read_from_replica(view_func):
+    """Route the view's reads to the snapshot replica when one is fresh enough"""
+    @functools.wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if not is_enabled() or not _prepare():
+            return view_func(request, *args, **kwargs)
+        token = _use_replica.set(True)
+        try:
+            return view_func(request, *args, **kwargs)
+        finally:
+            _use_replica.reset(token)
+    return wrapper
+
+
+class ReplicaRouter:
+    """
+    Sends reads to the replica inside @read_from_replica views; everything
+    else, and all writes, go to the primary.
+    """
+    # Not auth: users and permissions must be current (see the module docstring)
+    replica_apps = {'main'}
+    # Election state decides whether voting is open and is created on
+    # demand; reading it from a stale copy could open a closed election
+    # or create a second settings row
+    primary_only = {'main.electionsettings'}
+
+    def db_for_read(self, model, **hints):
+        if not _use_replica.get():
+            return None
+        if model._meta.app_label not in self.replica_apps or model._meta.label_lower in self.primary_only:
+            return None
+        return REPLICA_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is a copy of the primary, never migrated itself
+        return db != REPLICA_DB_ALIAS
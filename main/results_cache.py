@@ -0,0 +1,124 @@
+# main/results_cache.py
+"""
+Versioned cache for the results and turnout pages.
+
+Everything these pages show is fixed by the results tag from
+main/versions.py: '<results version>.<ballot version>'. The results
+version moves on every committed ballot and voter roll change, and the
+ballot version on every position or candidate change. Nothing cached
+under a tag ever has to be invalidated; a new tag simply misses.
+
+Three layers, cheapest first:
+- @conditional: ETag/Last-Modified from the tag. A browser polling an
+  unchanged page gets a 304 after two shared-store lookups, with no
+  database query and no rendering.
+- The page content is a {% cache %} fragment keyed on the tag, so a
+  new visitor gets the rendered HTML without any tally work.
+- lazy_context(): the computed context is built only when that fragment
+  has to be re-rendered. It is kept in the shared RESULTS_CACHE alias,
+  and when the tag moves, only one worker computes it (claimed in the
+  shared store). The others wait for that result instead of all
+  running the same queries at once.
+
+The computed contexts are read from the primary, not the replica. They
+are computed once per tag, and a stale snapshot would be cached under
+the newer tag.
+"""
+import datetime
+import functools
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.functional import SimpleLazyObject
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from . import elections, shared_store
+from .versions import results_changed_at, results_tag
+
+RESULTS_CACHE_ALIAS = 'results'
+_MISSING = object()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _etag(request, *args, **kwargs):
+    # The navigation bar differs between users, so each gets their own tag;
+    # the same URL shows a different election depending on ?election/session
+    return f"{results_tag()}-{elections.current_id(request) or 0}-{request.user.pk or 0}"
+
+
+def _last_modified(request, *args, **kwargs):
+    changed = results_changed_at()
+    return datetime.datetime.fromtimestamp(changed, tz=datetime.timezone.utc) if changed else None
+
+
+def conditional(view_func):
+    """ETag/Last-Modified from the results tag; unchanged pages get a 304"""
+    decorated = condition(etag_func=_etag, last_modified_func=_last_modified)(view_func)
+    # Browsers may keep the page but must check it with us before reuse
+    return functools.wraps(view_func)(cache_control(private=True, no_cache=True)(decorated))
+
+
+def _claim(lock_key):
+    """Take the right to compute; False if another worker holds an unexpired claim"""
+    now = time.time()
+    with shared_store.transaction():
+        if float(shared_store.get(lock_key, 0.0) or 0.0) > now:
+            return False
+        shared_store.set(lock_key, now + _setting('RESULTS_CACHE_LOCK_TIMEOUT', 30))
+    return True
+
+
+def get_or_compute(name, compute, tag=None):
+    """
+    The value cached for `name` under the current results tag, computing
+    it with compute() if needed. Concurrent misses across workers run
+    compute() once; the rest wait for its result (at most
+    RESULTS_CACHE_LOCK_TIMEOUT seconds, then compute it themselves).
+    """
+    tag = tag or results_tag()
+    cache = caches[RESULTS_CACHE_ALIAS]
+    key = f"results:{name}:{tag}"
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        return value
+
+    lock_key = f"lock:results:{name}"
+    deadline = time.monotonic() + _setting('RESULTS_CACHE_LOCK_TIMEOUT', 30)
+    while True:
+        if _claim(lock_key):
+            try:
+                value = compute()
+                cache.set(key, value, _setting('RESULTS_CACHE_TIMEOUT', 3600))
+                return value
+            finally:
+                shared_store.set(lock_key, 0.0)
+        time.sleep(0.05)
+        value = cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if time.monotonic() >= deadline:
+            return compute()  # the claim holder is stuck; don't wait forever
+
+
+def lazy_context(name, compute, keys):
+    """
+    A template context whose `keys` are only computed (with
+    get_or_compute) when the template first uses one of them, plus
+    'results_tag' and 'results_cache_timeout' for the {% cache %} tag.
+    compute() must return a dict of picklable values. Per-election pages
+    put the election id in `name` and in their fragment key.
+    """
+    tag = results_tag()
+    computed = SimpleLazyObject(lambda: get_or_compute(name, compute, tag))
+
+    def lazy(key):
+        return SimpleLazyObject(lambda: computed[key])
+
+    context = {key: lazy(key) for key in keys}
+    context.update(results_tag=tag, results_cache_timeout=_setting('RESULTS_CACHE_TIMEOUT', 3600))
+    return context
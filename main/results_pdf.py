@@ -0,0 +1,222 @@
+# main/results_pdf.py
+"""
+The results PDF, generated once per election and results tag
+(main/versions.py).
+
+A ballot, a voter roll change or a position/candidate change moves the
+tag. The first download after that starts a background thread that
+builds the PDF into RESULTS_PDF_DIR as
+vote_results-<election id>-<tag>.pdf. Every download for the same
+election and tag waits for that one build, in this worker or in any
+other, and then gets the same file.
+
+Builds are coalesced at two levels:
+- within a worker, one thread per election and tag (_building);
+- across workers, an exclusive flock on RESULTS_PDF_DIR/.lock. A worker
+  that gets the lock after another one finishes finds the file already
+  there and doesn't build it again.
+
+The file is written to a temporary name and renamed into place, so a
+reader never sees a half-written PDF. The election's files for older
+tags are deleted after each build; open_pdf() then moves on to the
+newer file if one disappears between get() and open().
+"""
+import glob
+import logging
+import os
+import tempfile
+import threading
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections
+from django.utils.html import escape
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from . import merkle, tallies
+from .models import ElectionSettings, Position, Vote
+from .versions import results_tag
+
+try:
+    import fcntl
+except ImportError:  # POSIX only; elsewhere builds are coalesced per worker only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_building = {}  # (election id, tag) -> threading.Event set when that build ends
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def pdf_dir():
+    return str(_setting('RESULTS_PDF_DIR', os.path.join(settings.BASE_DIR, 'results_pdf')))
+
+
+def pdf_path(election_id, tag):
+    return os.path.join(pdf_dir(), f"vote_results-{election_id}-{tag}.pdf")
+
+
+def _results(election):
+    """Per-position rows, as on the results page"""
+    counts = tallies.vote_counts(election)
+    turnout = tallies.position_turnout(election)
+    results = []
+    for position in Position.objects.filter(election=election).prefetch_related('candidate_position__candidate_name'):
+        candidates = position.candidate_position.all()
+        has_multiple = len(candidates) > 1
+        rows = []
+        for candidate in candidates:
+            name = f"{candidate.candidate_name.first_name} {candidate.candidate_name.last_name}"
+            if has_multiple:
+                selected = counts[(position.id, candidate.id, Vote.MULTIPLE_CANDIDATES, 'selected')]
+                total_votes = turnout[position.id]
+                percentage = (selected / total_votes * 100) if total_votes > 0 else 0
+                rows.append([name, str(selected), str(total_votes), f"{percentage:.1f}%"])
+            else:
+                yes = counts[(position.id, candidate.id, Vote.SINGLE_CANDIDATE, 'yes')]
+                no = counts[(position.id, candidate.id, Vote.SINGLE_CANDIDATE, 'no')]
+                total = yes + no
+                yes_percentage = (yes / total * 100) if total > 0 else 0
+                rows.append([name, str(yes), str(no), str(total), f"{yes_percentage:.1f}%"])
+        results.append((position.position_name, has_multiple, rows))
+    return results
+
+
+def build(out, election):
+    """
+    Write the PDF for `election` to `out` (a path or file object), summarising:
+    - total voters
+    - number who voted
+    - number not voted
+    - per-position candidate counts
+    """
+    total_voters = User.objects.count()
+    voted_count = tallies.voted_count(election)
+
+    doc = SimpleDocTemplate(out, pagesize=A4, rightMargin=36, leftMargin=36, topMargin=36, bottomMargin=36)
+    styles = getSampleStyleSheet()
+    story = []
+
+    story.append(Paragraph(f"Vote Results: {escape(election.election_name)}", styles['Title']))
+    story.append(Spacer(1, 12))
+
+    # summary counts
+    story.append(Paragraph(f"Total registered voters: <b>{total_voters}</b>", styles['Normal']))
+    story.append(Paragraph(f"Voted: <b>{voted_count}</b>", styles['Normal']))
+    story.append(Paragraph(f"Yet to vote: <b>{total_voters - voted_count}</b>", styles['Normal']))
+    audit_size, audit_root = merkle.root()
+    story.append(Paragraph(f"Audit root over {audit_size} ballots (SHA-256, RFC 6962): "
+                           f"<font face='Courier' size='7'>{audit_root}</font>", styles['Normal']))
+    story.append(Spacer(1, 12))
+
+    # per-position tables
+    for position_name, has_multiple, rows in _results(election):
+        story.append(Paragraph(position_name, styles['Heading2']))
+        story.append(Spacer(1, 6))
+
+        if has_multiple:
+            table = Table([["Candidate", "Votes", "Total Votes", "Percentage"]] + rows,
+                          colWidths=[200, 60, 80, 80])
+        else:
+            table = Table([["Candidate", "Yes", "No", "Total", "Yes %"]] + rows,
+                          colWidths=[200, 60, 60, 60, 60])
+
+        table.setStyle(TableStyle([
+            ('BACKGROUND', (0,0), (-1,0), colors.HexColor("#3E2723")),
+            ('TEXTCOLOR', (0,0), (-1,0), colors.white),
+            ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+            ('ALIGN',(1,1),(-1,-1),'CENTER'),
+            ('GRID', (0,0), (-1,-1), 0.25, colors.grey),
+            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+            ('LEFTPADDING', (0,0), (-1,-1), 6),
+            ('RIGHTPADDING', (0,0), (-1,-1), 6),
+        ]))
+        story.append(table)
+        story.append(Spacer(1, 12))
+
+    doc.build(story)
+
+
+def _write(election_id, tag):
+    """Build the PDF for `election_id` and `tag` unless another worker already has; holds the cross-worker lock"""
+    directory = pdf_dir()
+    os.makedirs(directory, exist_ok=True)
+    lock_fd = os.open(os.path.join(directory, '.lock'), os.O_RDWR | os.O_CREAT, 0o640)
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        path = pdf_path(election_id, tag)
+        if os.path.exists(path):
+            return
+        election = ElectionSettings.objects.get(pk=election_id)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.vote_results-', suffix='.pdf')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                build(out, election)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        for old in glob.glob(os.path.join(directory, f'vote_results-{election_id}-*.pdf')):
+            if old != path:
+                os.unlink(old)  # a download still reading it keeps its open file
+    finally:
+        if fcntl is not None:
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+        os.close(lock_fd)
+
+
+def _run(election_id, tag, done):
+    try:
+        _write(election_id, tag)
+    except Exception:
+        logger.exception("building the results PDF for election %s, %s failed", election_id, tag)
+    finally:
+        connections.close_all()  # this thread's connections only
+        with _lock:
+            _building.pop((election_id, tag), None)
+        done.set()
+
+
+def get(election_id, tag=None, wait=None):
+    """
+    Path of the results PDF of `election_id` for `tag` (default: the
+    current one), starting a background build if there is none yet. Waits
+    up to `wait` seconds (RESULTS_PDF_WAIT) for the build; None if it
+    isn't ready by then.
+    """
+    tag = tag or results_tag()
+    path = pdf_path(election_id, tag)
+    if os.path.exists(path):
+        return path
+    with _lock:
+        done = _building.get((election_id, tag))
+        if done is None:
+            done = _building[election_id, tag] = threading.Event()
+            threading.Thread(target=_run, args=(election_id, tag, done), name='results-pdf', daemon=True).start()
+    done.wait(_setting('RESULTS_PDF_WAIT', 20) if wait is None else wait)
+    return path if os.path.exists(path) else None
+
+
+def open_pdf(election_id, wait=None):
+    """
+    The current results PDF of `election_id`, opened for reading, or None
+    if it isn't ready within `wait` seconds. If a newer build deletes the
+    file before it is opened, the newer one is fetched instead.
+    """
+    for _ in range(3):
+        path = get(election_id, wait=wait)
+        if path is None:
+            return None
+        try:
+            return open(path, 'rb')
+        except FileNotFoundError:
+            continue  # replaced by a newer tag's build
+    return None
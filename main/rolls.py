@@ -0,0 +1,138 @@
+# main/rolls.py
+"""
+Printable voter rolls as PDF: everyone, voted, not voted, and the
+voters for one candidate.
+
+A roll can run to tens of thousands of rows. SimpleDocTemplate would
+keep the whole story in memory and lay out one huge Table, which gets
+slower the longer it is. Instead, users are read with .iterator() and
+drawn straight onto a canvas, one page-sized Table at a time. Memory
+then stays at one page of rows plus the compressed pages already
+written, and the time grows linearly with the number of rows.
+
+Who voted (and for whom) comes from main/tallies.py, so sharded
+ballots work too. It is loaded once as a set or dict of voter ids and
+checked against each user, rather than passed to the database as an IN
+list of every voter.
+"""
+from django.contrib.auth.models import User
+from django.utils import timezone
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+from reportlab.platypus import Table, TableStyle
+
+from . import ballot_shards, tallies
+from .models import Vote
+
+ROLLS = {
+    'all': "Voter Roll",
+    'voted': "Voters Who Have Voted",
+    'not-voted': "Voters Yet to Vote",
+}
+
+MARGIN = 36
+ROW_HEIGHT = 16
+ROWS_PER_PAGE = int((A4[1] - 2 * MARGIN - 40) // ROW_HEIGHT) - 1  # less the header row
+CHUNK_SIZE = 2000
+
+_STYLE = TableStyle([
+    ('BACKGROUND', (0,0), (-1,0), colors.HexColor("#3E2723")),
+    ('TEXTCOLOR', (0,0), (-1,0), colors.white),
+    ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0,0), (-1,-1), 8),
+    ('GRID', (0,0), (-1,-1), 0.25, colors.grey),
+    ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+    ('LEFTPADDING', (0,0), (-1,-1), 4),
+    ('RIGHTPADDING', (0,0), (-1,-1), 4),
+])
+
+
+def _users():
+    return (User.objects.order_by('username')
+            .values_list('id', 'username', 'first_name', 'last_name')
+            .iterator(chunk_size=CHUNK_SIZE))
+
+
+def _fit(text, width):
+    # Long names are cut rather than wrapped, so every row keeps ROW_HEIGHT
+    text = text or ''
+    return text if len(text) <= width else text[:width - 1] + '…'
+
+
+def roll_rows(roll, election):
+    """(staff id, first name, last name, extra) for a roll in ROLLS of `election`; extra is Yes/No for 'all'"""
+    voted = tallies.voted_voter_ids(election)
+    for user_id, username, first_name, last_name in _users():
+        has_voted = user_id in voted
+        if roll == 'voted' and not has_voted or roll == 'not-voted' and has_voted:
+            continue
+        extra = ('Yes' if has_voted else 'No') if roll == 'all' else None
+        yield username, first_name, last_name, extra
+
+
+def _candidate_choices(candidate):
+    """voter_id -> choice for every vote for this candidate"""
+    store = ballot_shards.get_store()
+    if store is not None:
+        return {row['voter_id']: row['choice'] for row in store.votes(candidate_id=candidate.id)}
+    return dict(Vote.objects.filter(candidate=candidate).values_list('voter', 'choice')
+                .iterator(chunk_size=CHUNK_SIZE))
+
+
+def candidate_rows(candidate):
+    """(staff id, first name, last name, choice) for everyone who voted for this candidate"""
+    choices = _candidate_choices(candidate)
+    for user_id, username, first_name, last_name in _users():
+        if user_id in choices:
+            yield username, first_name, last_name, choices[user_id]
+
+
+def build(out, title, rows, extra_heading=None):
+    """
+    Write a roll PDF to `out` (a path or file object). `rows` is an
+    iterable of (staff id, first name, last name, extra); the extra
+    column is only printed when `extra_heading` is given.
+    """
+    heading = ['#', 'Staff ID', 'First Name', 'Last Name']
+    widths = [44, 130, 150, 150]
+    if extra_heading:
+        heading.append(extra_heading)
+        widths.append(A4[0] - 2 * MARGIN - sum(widths))
+    else:
+        widths[-1] = A4[0] - 2 * MARGIN - sum(widths[:-1])
+    generated = timezone.localtime().strftime('%Y-%m-%d %H:%M')
+
+    pdf = canvas.Canvas(out, pagesize=A4, pageCompression=1)
+    pdf.setTitle(title)
+    page = []
+    number = pages = 0
+
+    def draw(page_rows):
+        nonlocal pages
+        pages += 1
+        top = A4[1] - MARGIN
+        pdf.setFont('Helvetica-Bold', 14)
+        pdf.drawString(MARGIN, top - 14, title)
+        pdf.setFont('Helvetica', 8)
+        pdf.drawRightString(A4[0] - MARGIN, top - 14, f"Generated {generated}")
+        pdf.drawRightString(A4[0] - MARGIN, MARGIN / 2, f"Page {pages}")
+        table = Table([heading] + page_rows, colWidths=widths, rowHeights=ROW_HEIGHT)
+        table.setStyle(_STYLE)
+        _, height = table.wrapOn(pdf, A4[0] - 2 * MARGIN, A4[1])
+        table.drawOn(pdf, MARGIN, top - 40 - height)
+        pdf.showPage()
+
+    for username, first_name, last_name, extra in rows:
+        number += 1
+        row = [str(number), _fit(username, 24), _fit(first_name, 28), _fit(last_name, 28)]
+        if extra_heading:
+            row.append(extra or '')
+        page.append(row)
+        if len(page) == ROWS_PER_PAGE:
+            draw(page)
+            page = []
+    if page or not pages:
+        draw(page)
+    pdf.save()
+    return number
@@ -0,0 +1,91 @@
+# main/shared_store.py
+"""
+Tiny key/value store shared by every gunicorn worker on this machine.
+
+Workers are separate processes, so anything kept in module globals is
+per-worker. This store keeps the few bits of state that must be agreed on
+by all of them (admission slots, counters, versions) in a small SQLite
+file next to the main database. It is deliberately separate from
+db.sqlite3 so it never competes with ballot writes for the database lock.
+"""
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+_local = threading.local()
+
+
+def _store_path():
+    return str(getattr(settings, 'SHARED_STORE_PATH', settings.BASE_DIR / 'shared_store.sqlite3'))
+
+
+def get_connection():
+    """Return this thread's connection to the shared store, opening it if needed"""
+    path = _store_path()
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and getattr(_local, 'path', None) == path:
+        return conn
+
+    conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS kv ('
+        ' key TEXT PRIMARY KEY,'
+        ' value,'
+        ' updated REAL NOT NULL)'
+    )
+    _local.conn = conn
+    _local.path = path
+    return conn
+
+
+@contextmanager
+def transaction():
+    """
+    Run a block under the store's write lock.
+
+    BEGIN IMMEDIATE takes the lock up front, so read-then-write sequences
+    (check capacity, then grant a slot) are atomic across workers.
+    """
+    conn = get_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def get(key, default=None):
+    row = get_connection().execute('SELECT value FROM kv WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else default
+
+
+def set(key, value):
+    get_connection().execute(
+        'INSERT INTO kv (key, value, updated) VALUES (?, ?, ?) '
+        'ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated = excluded.updated',
+        (key, value, time.time()),
+    )
+
+
+def incr(key, delta=1):
+    """Atomically add delta to a numeric key and return the new value"""
+    row = get_connection().execute(
+        'INSERT INTO kv (key, value, updated) VALUES (?, ?, ?) '
+        'ON CONFLICT(key) DO UPDATE SET value = value + excluded.value, updated = excluded.updated '
+        'RETURNING value',
+        (key, delta, time.time()),
+    ).fetchone()
+    return row[0]
+
+
+def updated(key):
+    """When key was last written (UNIX time), or None if it was never set"""
+    row = get_connection().execute('SELECT updated FROM kv WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else None
@@ -0,0 +1,181 @@
+# main/slow_queries.py
+"""
+Slow-query log with EXPLAIN capture.
+
+SlowQueryMiddleware keeps every statement a request runs (via
+connection.execute_wrapper). When the request is slow, or its SQL time
+or a single statement crosses a threshold, the worst statements are
+written to a bounded log in the shared store together with:
+
+- the view that ran them and how long the request took,
+- the *shape* of the parameters (types and lengths, never the values -
+  these can be ballot choices),
+- the backend's plan: EXPLAIN QUERY PLAN on SQLite, EXPLAIN elsewhere.
+
+Staff can browse the log at /main/slow_queries/ (?format=json to dump
+it) or run `manage.py dump_slow_queries`.
+"""
+import json
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import connections
+
+from . import shared_store
+
+# Statements we can safely ask the planner about
+_EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE', 'WITH')
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def is_enabled():
+    return _setting('SLOW_QUERY_LOG_ENABLED', True)
+
+
+class StatementRecorder:
+    """execute_wrapper hook that keeps (alias, sql, params, many, seconds) for each statement"""
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.statements.append((self.alias, sql, params, many, time.perf_counter() - start))
+
+
+def params_shape(params, many=False):
+    """Describe parameters by type (and length for strings) without their values"""
+    if many:
+        rows = list(params or [])
+        return {'rows': len(rows), 'row': params_shape(rows[0]) if rows else []}
+    if params is None:
+        return []
+    if isinstance(params, dict):
+        return {key: _value_shape(value) for key, value in params.items()}
+    return [_value_shape(value) for value in params]
+
+
+def _value_shape(value):
+    if isinstance(value, (str, bytes)):
+        return f"{type(value).__name__}({len(value)})"
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+def explain(alias, sql, params):
+    """Ask the backend for the query plan; returns the plan as text"""
+    if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+        return ''
+    connection = connections[alias]
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            rows = cursor.fetchall()
+    except Exception as e:  # a failed EXPLAIN must never break the request
+        return f"EXPLAIN failed: {e}"
+    if connection.vendor == 'sqlite':
+        # (id, parent, notused, detail)
+        return '\n'.join(str(row[-1]) for row in rows)
+    return '\n'.join(' '.join(str(col) for col in row) for row in rows)
+
+
+def _ensure_table(conn):
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS slow_query ('
+        ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+        ' recorded_at REAL NOT NULL,'
+        ' view TEXT NOT NULL,'
+        ' path TEXT NOT NULL,'
+        ' request_seconds REAL NOT NULL,'
+        ' query_seconds REAL NOT NULL,'
+        ' alias TEXT NOT NULL,'
+        ' statement TEXT NOT NULL,'
+        ' params_shape TEXT NOT NULL,'
+        ' duration REAL NOT NULL,'
+        ' plan TEXT NOT NULL)'
+    )
+
+
+def pick_slow_statements(statements, request_seconds):
+    """
+    Decide what to log for one request.
+
+    Every statement over SLOW_QUERY_STATEMENT_SECONDS is logged. If the
+    request as a whole was slow (latency or total SQL time), its
+    SLOW_QUERY_TOP_N slowest statements are logged as well.
+    """
+    query_seconds = sum(s[-1] for s in statements)
+    statement_limit = _setting('SLOW_QUERY_STATEMENT_SECONDS', 0.05)
+    picked = [s for s in statements if s[-1] >= statement_limit]
+
+    slow_request = (
+        request_seconds >= _setting('SLOW_QUERY_REQUEST_SECONDS', 0.5)
+        or query_seconds >= _setting('SLOW_QUERY_DB_SECONDS', 0.2)
+    )
+    if slow_request:
+        top = sorted(statements, key=lambda s: s[-1], reverse=True)[:_setting('SLOW_QUERY_TOP_N', 3)]
+        picked.extend(s for s in top if s not in picked)
+    return picked, query_seconds
+
+
+def record(view, path, request_seconds, statements):
+    picked, query_seconds = pick_slow_statements(statements, request_seconds)
+    if not picked:
+        return
+
+    now = time.time()
+    rows = [
+        (now, view, path, request_seconds, query_seconds, alias, sql,
+         json.dumps(params_shape(params, many)), duration,
+         explain(alias, sql, params) if not many else '')
+        for alias, sql, params, many, duration in picked
+    ]
+    keep = _setting('SLOW_QUERY_LOG_SIZE', 500)
+    with shared_store.transaction() as conn:
+        _ensure_table(conn)
+        conn.executemany(
+            'INSERT INTO slow_query (recorded_at, view, path, request_seconds, query_seconds,'
+            ' alias, statement, params_shape, duration, plan) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            rows,
+        )
+        # Ring buffer: keep only the newest `keep` entries
+        conn.execute(
+            'DELETE FROM slow_query WHERE id <= (SELECT MAX(id) FROM slow_query) - ?', (keep,)
+        )
+
+
+def entries(limit=None):
+    """Logged statements, newest first, as dicts"""
+    conn = shared_store.get_connection()
+    _ensure_table(conn)
+    sql = (
+        'SELECT id, recorded_at, view, path, request_seconds, query_seconds, alias,'
+        ' statement, params_shape, duration, plan FROM slow_query ORDER BY id DESC'
+    )
+    if limit:
+        sql += ' LIMIT %d' % int(limit)
+    keys = ('id', 'recorded_at', 'view', 'path', 'request_seconds', 'query_seconds', 'alias',
+            'statement', 'params_shape', 'duration', 'plan')
+    result = []
+    for row in conn.execute(sql):
+        entry = dict(zip(keys, row))
+        entry['params_shape'] = json.loads(entry['params_shape'])
+        entry['recorded'] = datetime.fromtimestamp(entry['recorded_at'], tz=timezone.utc)
+        result.append(entry)
+    return result
+
+
+def clear():
+    conn = shared_store.get_connection()
+    _ensure_table(conn)
+    conn.execute('DELETE FROM slow_query')
@@ -0,0 +1,79 @@
+// Update current time display
+function updateCurrentTime() {
+    var now = new Date();
+    var timeStr = now.toLocaleString('en-US', {
+        weekday: 'long',
+        year: 'numeric',
+        month: 'long',
+        day: 'numeric',
+        hour: '2-digit',
+        minute: '2-digit',
+        second: '2-digit',
+        hour12: true
+    });
+    document.getElementById('current-time').innerHTML = 
+        '<i class="fas fa-clock"></i> Current Server Time: ' + timeStr;
+}
+
+// Initial update
+updateCurrentTime();
+// Update every second
+setInterval(updateCurrentTime, 1000);
+
+// Auto-refresh page every 60 seconds to update election status
+setTimeout(function() {
+    location.reload();
+}, 60000); // 60 seconds
+
+// Confirmations for start/stop actions
+document.querySelectorAll('.btn-start').forEach(function(btn) {
+    btn.addEventListener('click', function(e) {
+        if (!confirm('Are you sure you want to START the election?\n\nThis will override any schedule.')) {
+            e.preventDefault();
+        }
+    });
+});
+
+document.querySelectorAll('.btn-stop').forEach(function(btn) {
+    btn.addEventListener('click', function(e) {
+        if (!confirm('Are you sure you want to STOP the election?\n\nThis will end voting immediately.')) {
+            e.preventDefault();
+        }
+    });
+});
+
+// Load Font Awesome if not loaded
+if (!document.querySelector('link[href*="font-awesome"]')) {
+    var faLink = document.createElement('link');
+    faLink.rel = 'stylesheet';
+    faLink.href = 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css';
+    document.head.appendChild(faLink);
+}
+
+// Confirmation for sending credentials
+document.querySelectorAll('.btn-send').forEach(function(btn) {
+    if (btn.href.includes('send_credentials')) {
+        btn.addEventListener('click', function(e) {
+            if (!confirm('Send credentials to ALL users?\n\nThis will generate new passwords and send emails.')) {
+                e.preventDefault();
+            }
+        });
+    }
+});
+
+// Add smooth scrolling for anchor links
+document.querySelectorAll('a[href^="#"]').forEach(anchor => {
+    anchor.addEventListener('click', function (e) {
+        e.preventDefault();
+        const targetId = this.getAttribute('href');
+        if (targetId === '#') return;
+
+        const targetElement = document.querySelector(targetId);
+        if (targetElement) {
+            window.scrollTo({
+                top: targetElement.offsetTop - 20,
+                behavior: 'smooth'
+            });
+        }
+    });
+});
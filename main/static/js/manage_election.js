@@ -0,0 +1,76 @@
+// Update current time display
+function updateCurrentTime() {
+    var now = new Date();
+    var timeStr = now.toLocaleString('en-US', {
+        weekday: 'long',
+        year: 'numeric',
+        month: 'long',
+        day: 'numeric',
+        hour: '2-digit',
+        minute: '2-digit',
+        second: '2-digit',
+        hour12: true
+    });
+    document.getElementById('current-time').innerHTML = 
+        '<i class="fas fa-clock"></i> Current Server Time: ' + timeStr;
+}
+
+// Initial update
+updateCurrentTime();
+// Update every second
+setInterval(updateCurrentTime, 1000);
+
+// Auto-refresh page every 30 seconds to update status
+setTimeout(function() {
+    location.reload();
+}, 30000); // 30 seconds
+
+// Confirmation for manual override checkbox
+var manualOverrideCheckbox = document.querySelector('input[name="is_manual_override"]');
+if (manualOverrideCheckbox) {
+    manualOverrideCheckbox.addEventListener('change', function() {
+        if (this.checked) {
+            if (!confirm('Enabling Manual Override will ignore scheduled times.\n\nAre you sure?')) {
+                this.checked = false;
+            }
+        }
+    });
+}
+
+// Confirmation for start/stop actions
+document.querySelectorAll('.btn-success').forEach(function(btn) {
+    if (btn.textContent.includes('Start')) {
+        btn.addEventListener('click', function(e) {
+            if (!confirm('Are you sure you want to START the election?\n\nThis will override any schedule.')) {
+                e.preventDefault();
+            }
+        });
+    }
+});
+
+document.querySelectorAll('.btn-danger').forEach(function(btn) {
+    if (btn.textContent.includes('Stop')) {
+        btn.addEventListener('click', function(e) {
+            if (!confirm('Are you sure you want to STOP the election?\n\nThis will end voting immediately.')) {
+                e.preventDefault();
+            }
+        });
+    }
+});
+
+// Load Font Awesome if not loaded
+if (!document.querySelector('link[href*="font-awesome"]')) {
+    var faLink = document.createElement('link');
+    faLink.rel = 'stylesheet';
+    faLink.href = 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css';
+    document.head.appendChild(faLink);
+}
+
+// Add datetime-local fallback for older browsers
+if (window.Modernizr && !Modernizr.inputtypes['datetime-local']) {
+    document.querySelectorAll('input[type="datetime-local"]').forEach(function(input) {
+        input.type = 'text';
+        input.placeholder = 'YYYY-MM-DDTHH:MM';
+        input.pattern = '\d{4}-\d{2}-\d{2}T\d{2}:\d{2}';
+    });
+}
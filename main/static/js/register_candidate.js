@@ -0,0 +1,16 @@
+// Add styling to all select boxes
+document.querySelectorAll('select').forEach(function(el) {
+    el.classList.add('select-box');
+});
+
+// Only filter candidate name select options
+document.getElementById('candidate-search').addEventListener('input', function() {
+    var search = this.value.toLowerCase();
+    var candidateSelect = document.getElementById('id_candidate_name');
+    if (candidateSelect) {
+        candidateSelect.querySelectorAll('option').forEach(function(option) {
+            var candidateName = option.textContent.toLowerCase();
+            option.style.display = candidateName.includes(search) ? '' : 'none';
+        });
+    }
+});
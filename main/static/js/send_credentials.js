@@ -0,0 +1,29 @@
+// Show loading state
+document.querySelector('form').addEventListener('submit', function() {
+    var btn = document.getElementById('sendBtn');
+    var originalHTML = btn.innerHTML;
+    btn.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Sending... Please wait';
+    btn.disabled = true;
+
+    // Add a small delay to show the loading state
+    setTimeout(function() {
+        btn.innerHTML = originalHTML;
+        btn.disabled = false;
+    }, 5000); // Reset after 5 seconds if still on page
+});
+
+// Confirm before submitting
+document.querySelector('form').addEventListener('submit', function(e) {
+    if (!confirm('Are you sure you want to send credentials to ALL ' + this.dataset.totalUsers + ' users?\n\nThis will generate new passwords for everyone.')) {
+        e.preventDefault();
+        return false;
+    }
+});
+
+// Load Font Awesome if not loaded
+if (!document.querySelector('link[href*="font-awesome"]')) {
+    var faLink = document.createElement('link');
+    faLink.rel = 'stylesheet';
+    faLink.href = 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css';
+    document.head.appendChild(faLink);
+}
@@ -0,0 +1,113 @@
+// Live turnout chart: follows the live stream (or polls the per-minute
+// buckets where the stream isn't served) and draws cumulative ballots
+(function() {
+    var chart = document.getElementById('turnout-chart');
+    if (!chart) return;
+    var canvas = document.getElementById('turnout-canvas');
+    var interval = parseInt(chart.dataset.pollInterval, 10) * 1000;
+    var buckets = {};  // minute (epoch seconds) -> ballots
+    var cursor = null;
+
+    function draw() {
+        var minutes = Object.keys(buckets).map(Number).sort(function(a, b) { return a - b; });
+        document.getElementById('turnout-empty').style.display = minutes.length ? 'none' : '';
+        canvas.style.display = minutes.length ? '' : 'none';
+        if (!minutes.length) return;
+
+        var width = canvas.width = canvas.clientWidth;
+        var height = canvas.height;
+        var ctx = canvas.getContext('2d');
+        var pad = 28;
+        var first = minutes[0], last = Math.max(minutes[minutes.length - 1], first + 60);
+        var total = 0, points = [];
+        minutes.forEach(function(minute) {
+            total += buckets[minute];
+            points.push([minute, total]);
+        });
+
+        function x(minute) { return pad + (width - 2 * pad) * (minute - first) / (last - first); }
+        function y(count) { return height - pad - (height - 2 * pad) * count / total; }
+
+        ctx.clearRect(0, 0, width, height);
+        ctx.strokeStyle = '#d7ccc8';
+        ctx.beginPath();
+        ctx.moveTo(pad, pad);
+        ctx.lineTo(pad, height - pad);
+        ctx.lineTo(width - pad, height - pad);
+        ctx.stroke();
+
+        ctx.strokeStyle = '#6d4c41';
+        ctx.lineWidth = 2;
+        ctx.beginPath();
+        ctx.moveTo(x(first), y(0));
+        points.forEach(function(p) { ctx.lineTo(x(p[0] + 60), y(p[1])); });
+        ctx.stroke();
+        ctx.lineWidth = 1;
+
+        ctx.fillStyle = '#3E2723';
+        ctx.font = '11px sans-serif';
+        ctx.textAlign = 'left';
+        ctx.fillText(new Date(first * 1000).toLocaleTimeString([], {hour: '2-digit', minute: '2-digit'}), pad, height - 8);
+        ctx.textAlign = 'right';
+        ctx.fillText(new Date((last + 60) * 1000).toLocaleTimeString([], {hour: '2-digit', minute: '2-digit'}),
+                     width - pad, height - 8);
+        ctx.fillText(total, pad - 4, pad + 4);
+    }
+
+    function update(series, voted) {
+        series.buckets.forEach(function(b) { buckets[b[0]] = b[1]; });
+        cursor = series.cursor;
+        document.getElementById('turnout-total').textContent = series.total + ' ballots';
+        if (voted !== undefined) {
+            document.querySelectorAll('[data-live="voted"]').forEach(function(el) {
+                el.textContent = voted;
+            });
+            document.querySelectorAll('[data-live="not-voted"]').forEach(function(el) {
+                el.textContent = parseInt(el.dataset.totalVoters, 10) - voted;
+            });
+        }
+        draw();
+    }
+
+    function poll() {
+        var base = chart.dataset.seriesUrl;
+        var url = cursor === null ? base : base + (base.indexOf('?') < 0 ? '?' : '&') + 'since=' + cursor;
+        fetch(url, {credentials: 'same-origin'})
+            .then(function(resp) { return resp.json(); })
+            .then(function(series) {
+                update(series);
+                setTimeout(poll, interval);
+            })
+            .catch(function() { setTimeout(poll, interval * 2); });
+    }
+
+    function listen() {
+        var source = new EventSource(chart.dataset.streamUrl);
+        var connected = false;
+        source.addEventListener('snapshot', function(e) {
+            var state = JSON.parse(e.data);
+            connected = true;
+            buckets = {};
+            update(state.turnout, state.voted);
+        });
+        source.addEventListener('delta', function(e) {
+            var state = JSON.parse(e.data);
+            update(state.turnout, state.voted);
+        });
+        source.onerror = function() {
+            // Never connected: no stream here (e.g. a WSGI server), so poll instead.
+            // Otherwise the browser reconnects by itself.
+            if (!connected) {
+                source.close();
+                poll();
+            }
+        };
+    }
+
+    window.addEventListener('resize', draw);
+    if (window.EventSource && chart.dataset.streamUrl) {
+        listen();
+    } else {
+        poll();
+    }
+})();
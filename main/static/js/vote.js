@@ -0,0 +1,59 @@
+// For single candidate yes/no selection
+function selectVote(candidateId, value, btn) {
+    var hidden = document.getElementById('candidate_' + candidateId);
+    if (!hidden) return;
+    hidden.value = value;
+    var container = btn.parentElement;
+    var buttons = container.querySelectorAll('button');
+    buttons.forEach(function(b) { 
+        b.classList.remove('selected'); 
+        b.style.transform = '';
+    });
+    btn.classList.add('selected');
+    btn.style.transform = 'scale(1.05)';
+    var row = document.getElementById('candidate-row-' + candidateId);
+    if (row) {
+        row.style.borderColor = (value === 'yes') ? '#4CAF50' : '#f44336';
+        row.style.boxShadow = (value === 'yes') 
+            ? '0 4px 12px rgba(76, 175, 80, 0.2)' 
+            : '0 4px 12px rgba(244, 67, 54, 0.2)';
+    }
+}
+
+// For multiple candidate radio selection
+function selectCandidate(positionId, candidateId) {
+    var options = document.querySelectorAll('#position-' + positionId + ' .radio-option');
+    options.forEach(function(option) {
+        option.classList.remove('selected');
+        option.style.transform = '';
+    });
+    var selectedOption = document.getElementById('option-' + candidateId);
+    if (selectedOption) {
+        selectedOption.classList.add('selected');
+        selectedOption.style.transform = 'translateY(-3px)';
+    }
+}
+
+// Form submission - SIMPLIFIED VERSION
+document.getElementById('vote-form').addEventListener('submit', function(evt) {
+    // Show loading indicator
+    var submitBtn = document.querySelector('.btn-vote');
+    if (submitBtn) {
+        submitBtn.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Submitting...';
+        submitBtn.disabled = true;
+    }
+
+    // Allow form to submit normally - NO validation alerts
+    return true;
+});
+
+// Add CSS animation for error highlighting
+var style = document.createElement('style');
+style.textContent = `
+    @keyframes pulse {
+        0% { box-shadow: 0 0 0 0 rgba(255, 87, 34, 0.7); }
+        70% { box-shadow: 0 0 0 10px rgba(255, 87, 34, 0); }
+        100% { box-shadow: 0 0 0 0 rgba(255, 87, 34, 0); }
+    }
+`;
+document.head.appendChild(style);
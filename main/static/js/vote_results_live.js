@@ -0,0 +1,59 @@
+// Keeps the results page current from the live stream (main/live.py).
+// Without the stream (e.g. a WSGI server) the page keeps its load-time figures.
+(function() {
+    var container = document.querySelector('.results-container[data-stream-url]');
+    if (!container || !window.EventSource) return;
+    var tally = {};      // "position:candidate:choice" -> votes
+    var positions = {};  // position id -> voters
+
+    function apply(state, replace) {
+        if (replace) {
+            tally = {};
+            positions = {};
+        }
+        state.tally.forEach(function(row) {
+            tally[row[0] + ':' + row[1] + ':' + row[3]] = row[4];
+        });
+        state.positions.forEach(function(row) { positions[row[0]] = row[1]; });
+        render();
+    }
+
+    function count(card, choice) {
+        return tally[card.dataset.position + ':' + card.dataset.candidate + ':' + choice] || 0;
+    }
+
+    // Same markup as templates/main/vote_results.html
+    function render() {
+        container.querySelectorAll('.candidate-card[data-candidate]').forEach(function(card) {
+            var badges = card.querySelector('.vote-badges');
+            if (card.dataset.multiple === '1') {
+                var selected = count(card, 'selected');
+                var voters = positions[card.dataset.position] || 0;
+                badges.innerHTML = '<div class="badge badge-selected">Selected: ' + selected + '</div>' + (voters > 0
+                    ? '<div class="percentage-display">' + selected + ' / ' + voters + ' votes (' +
+                      Math.round(selected * 100 / voters) + '%)</div>'
+                    : '<div class="vote-stats">No votes yet</div>');
+            } else {
+                var yes = count(card, 'yes'), no = count(card, 'no'), total = yes + no;
+                var pct = total > 0 ? Math.floor(yes * 100 / total) : 0;
+                badges.innerHTML = '<div class="badge badge-yes">Yes ' + yes + '</div>' +
+                                   '<div class="badge badge-no">No ' + no + '</div>';
+                card.querySelector('.vote-stats').innerHTML = total > 0
+                    ? total + ' total votes <div class="progress" aria-hidden="true"><i style="width: ' + pct +
+                      '%;"></i></div><div class="percentage-text">' + pct + '% Yes</div>'
+                    : 'No votes yet';
+            }
+        });
+    }
+
+    var source = new EventSource(container.dataset.streamUrl);
+    var connected = false;
+    source.addEventListener('snapshot', function(e) {
+        connected = true;
+        apply(JSON.parse(e.data), true);
+    });
+    source.addEventListener('delta', function(e) { apply(JSON.parse(e.data), false); });
+    source.onerror = function() {
+        if (!connected) source.close();
+    };
+})();
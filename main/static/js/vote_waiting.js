@@ -0,0 +1,21 @@
+(function() {
+    var room = document.getElementById('waiting-room');
+    var interval = parseInt(room.dataset.pollInterval, 10) * 1000;
+
+    function poll() {
+        fetch(room.dataset.statusUrl, {credentials: 'same-origin'})
+            .then(function(resp) { return resp.json(); })
+            .then(function(state) {
+                if (state.admitted) {
+                    window.location.href = room.dataset.voteUrl;
+                    return;
+                }
+                document.getElementById('queue-position').textContent = state.position;
+                document.getElementById('queue-eta').textContent = state.eta_seconds;
+                setTimeout(poll, interval);
+            })
+            .catch(function() { setTimeout(poll, interval * 2); });
+    }
+
+    setTimeout(poll, interval);
+})();
@@ -0,0 +1,116 @@
+# main/tallies.py
+"""
+Where views read ballots from.
+
+Ballots live either in main_vote (the default) or, with BALLOT_SHARDS
+set, in the sharded store from main/ballot_shards.py. The functions here
+give the same answers for both, so the views don't need to care which
+one is in use. They also replace the one-COUNT-per-candidate loops with
+a single grouped query.
+
+Each function takes the `election` (an ElectionSettings or its id) to
+count; None counts every election. In main_vote that is a filter on the
+leading column of every Vote index. In the shards it is a filter on the
+election's positions.
+"""
+from collections import Counter, defaultdict
+
+from django.contrib.auth.models import User
+from django.db.models import Count
+
+from . import ballot_shards
+from .elections import election_id
+from .models import Position, Candidate, Vote
+
+
+def _votes(election):
+    votes = Vote.objects.all()
+    if election is not None:
+        votes = votes.filter(election_id=election_id(election))
+    return votes
+
+
+def _position_ids(election):
+    """The shard filter for `election`: its position ids, or None for every election"""
+    if election is None:
+        return None
+    return list(Position.objects.filter(election_id=election_id(election)).values_list('id', flat=True))
+
+
+def has_voted(voter_id, election=None):
+    store = ballot_shards.get_store()
+    if store is not None:
+        return store.has_voted(voter_id, _position_ids(election))
+    return _votes(election).filter(voter_id=voter_id).exists()
+
+
+def voted_count(election=None):
+    store = ballot_shards.get_store()
+    if store is not None:
+        return store.voted_count(_position_ids(election))
+    return _votes(election).values('voter').distinct().count()
+
+
+def voted_voter_ids(election=None):
+    store = ballot_shards.get_store()
+    if store is not None:
+        return store.voted_voter_ids(_position_ids(election))
+    return set(_votes(election).values_list('voter', flat=True).distinct())
+
+
+def vote_counts(election=None):
+    """Counter of (position_id, candidate_id, vote_type, choice) -> votes"""
+    store = ballot_shards.get_store()
+    if store is not None:
+        return store.tally(_position_ids(election))
+    rows = (_votes(election).values_list('position', 'candidate', 'vote_type', 'choice')
+            .annotate(n=Count('id')).order_by())
+    return Counter({(p, c, t, ch): n for p, c, t, ch, n in rows})
+
+
+def position_turnout(election=None):
+    """Counter of position_id -> number of distinct voters"""
+    store = ballot_shards.get_store()
+    if store is not None:
+        return store.position_turnout(_position_ids(election))
+    rows = _votes(election).values_list('position').annotate(n=Count('voter', distinct=True)).order_by()
+    return Counter(dict(rows))
+
+
+def _as_votes(rows):
+    """Unsaved Vote instances (with related objects attached) for shard rows"""
+    users = User.objects.in_bulk({row['voter_id'] for row in rows})
+    positions = Position.objects.in_bulk({row['position_id'] for row in rows})
+    candidates = Candidate.objects.select_related('candidate_name').in_bulk({row['candidate_id'] for row in rows})
+    votes = []
+    for row in rows:
+        voter = users.get(row['voter_id'])
+        position = positions.get(row['position_id'])
+        candidate = candidates.get(row['candidate_id'])
+        if voter is None or position is None or candidate is None:
+            continue  # deleted since; main_vote would have cascaded
+        vote = Vote(election_id=position.election_id, voter=voter, position=position, candidate=candidate,
+                    vote_type=row['vote_type'], choice=row['choice'])
+        vote.timestamp = row['timestamp']
+        votes.append(vote)
+    return votes
+
+
+def votes_by_voter(election=None):
+    """dict of voter_id -> list of Votes (with voter, position and candidate loaded)"""
+    store = ballot_shards.get_store()
+    if store is not None:
+        votes = _as_votes(store.votes(position_ids=_position_ids(election)))
+    else:
+        votes = _votes(election).select_related('voter', 'candidate__candidate_name', 'position').order_by('id')
+    grouped = defaultdict(list)
+    for vote in votes:
+        grouped[vote.voter_id].append(vote)
+    return dict(grouped)
+
+
+def votes_for_candidate(candidate_id):
+    store = ballot_shards.get_store()
+    if store is not None:
+        return _as_votes(store.votes(candidate_id=candidate_id))
+    return list(Vote.objects.filter(candidate_id=candidate_id).select_related('voter', 'position'))
@@ -1,3 +1,1367 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.db import connection, connections, transaction
+from django.conf import settings
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.core.management.base import CommandError
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import (admission, analytics, archive, ballot_export, ballot_shards, db, elections, ledger, live, media, merkle,
+               metrics, profiling, publish, replica, results_cache, results_pdf, rolls, shared_store, slow_queries,
+               tallies, thumbnails, turnout)
+from .ballots import VotingClosed, record_ballot
+from .management.commands import audit_indexes, bench_tally
+from .models import AuditLeaf, ElectionSettings, Position, Candidate, Vote, TurnoutBucket
+from .versions import ballot_version
+
+
+# No collectstatic manifest under the test runner: pages that render templates use plain static URLs
+PLAIN_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+@override_settings(SHARED_STORE_PATH=tempfile.mktemp(suffix='.sqlite3'),
+                   LEDGER_PATH=tempfile.mktemp(suffix='.ledger'))
+class ConcurrentBallotTests(TransactionTestCase):
+    """
+    Several writers submit ballots at the same moment against the
+    file-backed SQLite test database. With WAL, busy_timeout and
+    ballots written under BEGIN IMMEDIATE every ballot must commit - none may fail
+    with "database is locked".
+    """
+    WRITERS = 12
+
+    def setUp(self):
+        self.election = ElectionSettings.objects.create(election_name="Test", is_manual_override=True,
+                                                        is_active=True)
+        self.contested = Position.objects.create(election=self.election, position_name="President", description="")
+        self.yes_no = Position.objects.create(election=self.election, position_name="Secretary", description="")
+        people = [User.objects.create_user(f"candidate{i}") for i in range(3)]
+        self.candidates = [
+            Candidate.objects.create(candidate_name=people[0], candidate_position=self.contested, photo=''),
+            Candidate.objects.create(candidate_name=people[1], candidate_position=self.contested, photo=''),
+        ]
+        self.single = Candidate.objects.create(candidate_name=people[2], candidate_position=self.yes_no, photo='')
+        self.voters = [User.objects.create_user(f"voter{i}") for i in range(self.WRITERS)]
+
+    def test_sqlite_profile_is_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0].lower(), 'wal')
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertGreater(cursor.fetchone()[0], 0)
+
+    def test_only_ballot_writes_take_the_write_lock_at_begin(self):
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                list(ElectionSettings.objects.all())
+        self.assertNotIn('BEGIN IMMEDIATE', [q['sql'] for q in queries])
+        with CaptureQueriesContext(connection) as queries:
+            with db.write_transaction():
+                with db.write_transaction():
+                    list(ElectionSettings.objects.all())
+        self.assertEqual([q['sql'] for q in queries].count('BEGIN IMMEDIATE'), 1)
+        self.assertIsNone(connection.transaction_mode)
+
+    def test_concurrent_writers_commit_without_lock_errors(self):
+        start = threading.Barrier(self.WRITERS)
+        errors = []
+
+        def cast(i, voter):
+            try:
+                client = Client()
+                client.force_login(voter)
+                start.wait()
+                response = client.post(reverse('vote'), {
+                    f'position_{self.contested.id}': self.candidates[i % 2].id,
+                    f'candidate_{self.single.id}': 'yes' if i % 3 else 'no',
+                })
+                # A committed ballot redirects home; a failed one re-renders the form
+                if response.status_code != 302 or response.url != reverse('user_homepage'):
+                    errors.append(f"{voter.username}: HTTP {response.status_code}")
+            except Exception as e:
+                errors.append(repr(e))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=cast, args=(i, voter)) for i, voter in enumerate(self.voters)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Vote.objects.count(), self.WRITERS * 2)
+        self.assertEqual(Vote.objects.values('voter').distinct().count(), self.WRITERS)
+        # Every committed ballot also reached the ledger, one whole line each
+        self.assertEqual(sorted(record['voter'] for _, record in ledger.read()),
+                         sorted(voter.id for voter in self.voters))
+        # ...and was counted once in the turnout buckets
+        self.assertEqual(sum(TurnoutBucket.objects.values_list('ballots', flat=True)), self.WRITERS)
+
+    def test_closed_election_takes_no_ballots(self):
+        self.election.stop_manually()
+        positions = Position.objects.filter(election=self.election).prefetch_related('candidate_position')
+        with self.assertRaises(VotingClosed):
+            record_ballot(self.voters[0], positions, {f'position_{self.contested.id}': self.candidates[0].id,
+                                                      f'candidate_{self.single.id}': 'yes'}, self.election)
+
+        client = Client()
+        client.force_login(self.voters[1])
+        response = client.post(reverse('vote'), {f'position_{self.contested.id}': self.candidates[0].id,
+                                                 f'candidate_{self.single.id}': 'yes'})
+        self.assertRedirects(response, reverse('user_homepage'), fetch_redirect_response=False)
+        self.assertFalse(Vote.objects.exists())
+        self.assertFalse(TurnoutBucket.objects.exists())
+
+    def test_voters_cannot_pick_a_closed_election(self):
+        closed = ElectionSettings.objects.create(election_name="Closed", is_manual_override=True, is_active=False)
+        position = Position.objects.create(election=closed, position_name="Treasurer", description="")
+        Candidate.objects.create(candidate_name=self.voters[2], candidate_position=position, photo='')
+
+        client = Client()
+        client.force_login(self.voters[1])
+        response = client.post(f"{reverse('vote')}?election={closed.id}", {f'candidate_{position.id}': 'yes'})
+        self.assertRedirects(response, reverse('user_homepage'), fetch_redirect_response=False)
+        self.assertFalse(Vote.objects.filter(election=closed).exists())
+
+    def test_sharded_ballot_writes_audit_trail_only_after_shard_commit(self):
+        answers = {f'position_{self.contested.id}': self.candidates[0].id, f'candidate_{self.single.id}': 'no'}
+        positions = Position.objects.filter(election=self.election).prefetch_related('candidate_position')
+        with tempfile.TemporaryDirectory() as shard_dir, \
+                override_settings(BALLOT_SHARDS=2, BALLOT_SHARD_DIR=shard_dir):
+            store = ballot_shards.get_store()
+            try:
+                self.election.stop_manually()
+                with self.assertRaises(VotingClosed):
+                    record_ballot(self.voters[0], positions, answers, self.election)
+                self.assertFalse(AuditLeaf.objects.exists())
+                self.assertFalse(TurnoutBucket.objects.exists())
+
+                self.election.start_manually()
+                record_ballot(self.voters[0], positions, answers, self.election)
+                self.assertTrue(store.has_voted(self.voters[0].id))
+                self.assertEqual(list(AuditLeaf.objects.values_list('voter', flat=True)), [self.voters[0].id])
+                self.assertEqual(sum(TurnoutBucket.objects.values_list('ballots', flat=True)), 1)
+            finally:
+                store.close()
+
+    def test_archiving_a_sharded_election_keeps_every_ballot(self):
+        answers = {f'position_{self.contested.id}': self.candidates[1].id, f'candidate_{self.single.id}': 'yes'}
+        positions = Position.objects.filter(election=self.election).prefetch_related('candidate_position')
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(BALLOT_SHARDS=2, BALLOT_SHARD_DIR=directory):
+            store = ballot_shards.get_store()
+            try:
+                for voter in self.voters[:3]:
+                    record_ballot(voter, positions, answers, self.election)
+                self.election.stop_manually()
+                path = os.path.join(directory, 'archive.npz')
+                call_command('archive_election', election=self.election.id, output=path, stdout=io.StringIO())
+
+                columns, meta = archive.load(path)
+                self.assertEqual((len(columns), meta['voted']), (6, 3))
+                self.assertEqual(store.voted_count(), 0)
+            finally:
+                store.close()
+
+@override_settings(SHARED_STORE_PATH=tempfile.mktemp(suffix='.sqlite3'), MEDIA_ROOT=tempfile.mkdtemp(),
+                   MEDIA_SENDFILE_HEADER=None, MEDIA_CACHE_MAX_AGE=3600)
+class MediaTests(TestCase):
+    """Caching headers, conditional requests and byte ranges of main/media.py"""
+    PHOTO = 'candidate_photos/photo.jpg'
+    THUMBNAIL = 'candidate_photos/thumbs/0123456789abcdef_100.jpg'
+    CONTENT = bytes(range(100))
+
+    def setUp(self):
+        for name in (self.PHOTO, self.THUMBNAIL):
+            path = os.path.join(settings.MEDIA_ROOT, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(self.CONTENT)
+        election = ElectionSettings.objects.create(election_name="Test")
+        position = Position.objects.create(election=election, position_name="President", description="")
+        candidate = Candidate.objects.create(candidate_name=User.objects.create_user('candidate'),
+                                             candidate_position=position, photo='')
+        # update(): the bytes above are no image to make thumbnails from
+        Candidate.objects.filter(pk=candidate.pk).update(photo=self.PHOTO, photo_hash='fedcba9876543210')
+
+    def get(self, name, query='', **headers):
+        return self.client.get(reverse('media', kwargs={'path': name}) + query, **headers)
+
+    def test_whole_file_with_validators(self):
+        response = self.get(self.PHOTO)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+        self.assertTrue(response.has_header('Last-Modified'))
+
+    def test_if_none_match_gives_304(self):
+        etag = self.get(self.PHOTO)['ETag']
+        response = self.get(self.PHOTO, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+        self.assertEqual(self.get(self.PHOTO, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_if_modified_since_gives_304(self):
+        last_modified = self.get(self.PHOTO)['Last-Modified']
+        self.assertEqual(self.get(self.PHOTO, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+    def test_byte_ranges(self):
+        response = self.get(self.PHOTO, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT[10:20])
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(response['Content-Length'], '10')
+
+        response = self.get(self.PHOTO, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT[-5:])
+        self.assertEqual(response['Content-Range'], 'bytes 95-99/100')
+
+        response = self.get(self.PHOTO, HTTP_RANGE='bytes=200-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */100')
+
+        # Not a byte range we understand: the whole file
+        self.assertEqual(self.get(self.PHOTO, HTTP_RANGE='lines=1-2').status_code, 200)
+
+    def test_stale_if_range_sends_whole_file(self):
+        etag = self.get(self.PHOTO)['ETag']
+        self.assertEqual(self.get(self.PHOTO, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag).status_code, 206)
+        response = self.get(self.PHOTO, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT)
+
+    def test_only_content_hashed_urls_are_immutable(self):
+        immutable = f'public, max-age={media.IMMUTABLE_MAX_AGE}, immutable'
+        self.assertEqual(self.get(self.THUMBNAIL)['Cache-Control'], immutable)
+        self.assertEqual(self.get(self.PHOTO, '?v=fedcba9876543210')['Cache-Control'], immutable)
+        # A made-up or outdated version must not pin the photo for a year
+        self.assertEqual(self.get(self.PHOTO, '?v=x')['Cache-Control'], 'public, max-age=3600')
+
+
+@override_settings(SHARED_STORE_PATH=tempfile.mktemp(suffix='.sqlite3'),
+                   LEDGER_PATH=tempfile.mktemp(suffix='.ledger'))
+class AuditTreeTests(TestCase):
+    """Inclusion proofs from main/merkle.py and `manage.py verify_audit`"""
+    BALLOTS = 7  # not a power of two: the tree has an unbalanced right edge
+
+    def setUp(self):
+        self.election = ElectionSettings.objects.create(election_name="Test", is_manual_override=True,
+                                                        is_active=True)
+        self.position = Position.objects.create(election=self.election, position_name="President", description="")
+        self.candidates = [
+            Candidate.objects.create(candidate_name=User.objects.create_user(f"candidate{i}"),
+                                     candidate_position=self.position, photo='')
+            for i in range(2)
+        ]
+
+    def cast(self, count):
+        """Cast `count` ballots; returns the root after each one"""
+        roots = []
+        for i in range(count):
+            voter = User.objects.create_user(f"voter{i}")
+            record_ballot(voter, [self.position], {f'position_{self.position.id}': str(self.candidates[i % 2].id)},
+                          self.election)
+            roots.append(merkle.root())
+        return roots
+
+    def test_empty_tree_root(self):
+        self.assertEqual(merkle.root(), (0, hashlib.sha256(b'').hexdigest()))
+
+    def test_inclusion_proofs_hold_for_every_tree_size(self):
+        roots = self.cast(self.BALLOTS)
+        leaves = list(AuditLeaf.objects.order_by('index'))
+        for size in range(1, self.BALLOTS + 1):
+            # Later ballots must not change the root an earlier size had
+            self.assertEqual(merkle.root(size), roots[size - 1])
+            root = roots[size - 1][1]
+            for leaf in leaves[:size]:
+                proof = merkle.inclusion_proof(leaf.index, size)
+                self.assertTrue(merkle.verify_inclusion(leaf.leaf_hash, leaf.index, size, proof, root),
+                                f"leaf {leaf.index} in tree of {size}")
+
+    def test_tampered_proofs_fail(self):
+        self.cast(self.BALLOTS)
+        leaf = AuditLeaf.objects.get(index=2)
+        size, root = merkle.root()
+        proof = merkle.inclusion_proof(leaf.index)
+        self.assertTrue(merkle.verify_inclusion(leaf.leaf_hash, leaf.index, size, proof, root))
+
+        altered = [proof[0][:-1] + ('0' if proof[0][-1] != '0' else '1')] + proof[1:]
+        self.assertFalse(merkle.verify_inclusion(leaf.leaf_hash, leaf.index, size, altered, root))
+        self.assertFalse(merkle.verify_inclusion(leaf.leaf_hash, leaf.index + 1, size, proof, root))
+        self.assertFalse(merkle.verify_inclusion(leaf.leaf_hash, leaf.index, leaf.index, proof, root))
+        self.assertFalse(merkle.verify_inclusion(leaf.leaf_hash, leaf.index, size, proof[:-1], root))
+        self.assertFalse(merkle.verify_inclusion(leaf.leaf_hash, leaf.index, size, proof, merkle.root(size - 1)[1]))
+        with self.assertRaises(ValueError):
+            merkle.inclusion_proof(size)
+
+    def test_verify_audit_passes_then_catches_an_altered_ballot(self):
+        self.cast(3)
+        call_command('verify_audit', stdout=io.StringIO())
+        call_command('verify_audit', leaf=1, stdout=io.StringIO())
+
+        leaf = AuditLeaf.objects.get(index=1)
+        AuditLeaf.objects.filter(pk=leaf.pk).update(ballot=leaf.ballot.replace('"nonce":"', '"nonce":"0'))
+        out = io.StringIO()
+        with self.assertRaises(CommandError):
+            call_command('verify_audit', stdout=out)
+        self.assertIn("ballot #1: content does not match its leaf hash", out.getvalue())
+        with self.assertRaisesMessage(CommandError, "ballot #1 was altered"):
+            call_command('verify_audit', leaf=1, stdout=io.StringIO())
+
+    def test_verify_audit_catches_votes_changed_after_the_ballot(self):
+        self.cast(3)
+        vote = Vote.objects.filter(election=self.election).first()
+        other = next(c for c in self.candidates if c.id != vote.candidate_id)
+        Vote.objects.filter(pk=vote.pk).update(candidate=other)
+        out = io.StringIO()
+        with self.assertRaises(CommandError):
+            call_command('verify_audit', stdout=out)
+        self.assertIn("stored votes differ from the committed ballot", out.getvalue())
+
+
+@override_settings(SHARED_STORE_PATH=tempfile.mktemp(suffix='.sqlite3'))
+class LedgerTests(TestCase):
+    """main/ledger.py lines and `manage.py replay_ledger`"""
+
+    def setUp(self):
+        # A fresh file per test: the ledger keeps its file open per path
+        self.path = os.path.join(tempfile.mkdtemp(), 'ballots.ledger')
+        self.enterContext(self.settings(LEDGER_PATH=self.path))
+
+    def test_append_and_read_round_trip(self):
+        ledger.append(7, [(1, 2, 'multiple', 'selected')], election_id=3)
+        ledger.append(8, [(1, 4, 'single', 'no')])
+        records = list(ledger.read())
+        self.assertEqual([number for number, _ in records], [1, 2])
+        self.assertEqual([(r['voter'], r.get('election'), r['votes']) for _, r in records], [
+            (7, 3, [[1, 2, 'multiple', 'selected']]),
+            (8, None, [[1, 4, 'single', 'no']]),
+        ])
+
+    def test_corrupt_line_is_reported(self):
+        ledger.append(7, [(1, 2, 'multiple', 'selected')])
+        ledger.append(8, [(1, 2, 'multiple', 'selected')])
+        ledger.append(9, [(1, 2, 'multiple', 'selected')])
+        with open(self.path, 'rb') as f:
+            lines = f.readlines()
+        lines[1] = lines[1].replace(b'"voter":8', b'"voter":6')
+        with open(self.path, 'wb') as f:
+            f.writelines(lines)
+
+        with self.assertRaises(ledger.LedgerCorrupt) as caught:
+            list(ledger.read())
+        self.assertEqual((caught.exception.line_number, caught.exception.reason), (2, "checksum mismatch"))
+        records = [record for _, record in ledger.read(skip_corrupt=True)]
+        self.assertIsInstance(records[1], ledger.LedgerCorrupt)
+        self.assertEqual([records[0]['voter'], records[2]['voter']], [7, 9])
+
+    def test_torn_tail_is_sealed_before_the_next_ballot(self):
+        whole = ledger.encode(7, [(1, 2, 'multiple', 'selected')])
+        with open(self.path, 'wb') as f:
+            f.write(whole + whole[:20])  # the writer died mid-line
+
+        # A torn last line is ignored
+        self.assertEqual([r['voter'] for _, r in ledger.read()], [7])
+
+        ledger.append(8, [(1, 2, 'multiple', 'selected')])
+        records = [record for _, record in ledger.read(skip_corrupt=True)]
+        self.assertEqual(len(records), 3)
+        self.assertIsInstance(records[1], ledger.LedgerCorrupt)
+        # The next ballot starts on its own line, intact
+        self.assertEqual(records[2]['voter'], 8)
+
+    def test_only_committed_ballots_reach_the_ledger(self):
+        election = ElectionSettings.objects.create(election_name="Test", is_manual_override=True, is_active=True)
+        position = Position.objects.create(election=election, position_name="Secretary", description="")
+        candidate = Candidate.objects.create(candidate_name=User.objects.create_user('candidate'),
+                                             candidate_position=position, photo='')
+        answers = {f'candidate_{candidate.id}': 'yes'}
+
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                record_ballot(User.objects.create_user('rolled_back'), [position], answers, election)
+                raise RuntimeError("COMMIT failed")
+        self.assertFalse(os.path.exists(self.path) and list(ledger.read()))
+
+        voter = User.objects.create_user('committed')
+        with self.captureOnCommitCallbacks(execute=True):
+            record_ballot(voter, [position], answers, election)
+        self.assertEqual([record['voter'] for _, record in ledger.read()], [voter.id])
+
+    def test_replay_rebuilds_the_ballots(self):
+        election = ElectionSettings.objects.create(election_name="Test", is_manual_override=True, is_active=True)
+        position = Position.objects.create(election=election, position_name="President", description="")
+        candidates = [
+            Candidate.objects.create(candidate_name=User.objects.create_user(f"candidate{i}"),
+                                     candidate_position=position, photo='')
+            for i in range(2)
+        ]
+        voters = [User.objects.create_user(f"voter{i}") for i in range(3)]
+        with self.captureOnCommitCallbacks(execute=True):
+            for i, voter in enumerate(voters):
+                record_ballot(voter, [position], {f'position_{position.id}': str(candidates[i % 2].id)}, election)
+        # A retry after a failed COMMIT: the voter's last line wins
+        ledger.append(voters[0].id, [(position.id, candidates[1].id, Vote.MULTIPLE_CANDIDATES, 'selected')],
+                      election_id=election.id)
+        Vote.objects.all().delete()
+
+        out = io.StringIO()
+        call_command('replay_ledger', rebuild=True, interactive=False, stdout=out)
+        self.assertIn("4 ledger lines, 3 ballots, 1 superseded, 0 corrupt", out.getvalue())
+        self.assertEqual(
+            sorted(Vote.objects.values_list('election', 'voter', 'candidate')),
+            [(election.id, voters[0].id, candidates[1].id), (election.id, voters[1].id, candidates[1].id),
+             (election.id, voters[2].id, candidates[0].id)],
+        )
+
+        out = io.StringIO()
+        call_command('replay_ledger', stdout=out)
+        self.assertIn("Ledger tallies match the database.", out.getvalue())
+
+
+@override_settings(SHARED_STORE_PATH=tempfile.mktemp(suffix='.sqlite3'),
+                   LEDGER_PATH=tempfile.mktemp(suffix='.ledger'),
+                   CACHES={
+                       'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                       'results': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                   'LOCATION': tempfile.mkdtemp()},
+                   },
+                   STORAGES=PLAIN_STORAGES)
+class ResultsCacheTests(TestCase):
+    """ETag/304 on the results pages and coalesced computes in main/results_cache.py"""
+
+    def setUp(self):
+        self.election = ElectionSettings.objects.create(election_name="Test", is_manual_override=True,
+                                                        is_active=True)
+        self.position = Position.objects.create(election=self.election, position_name="President",
+                                                description="")
+        self.candidate = Candidate.objects.create(candidate_name=User.objects.create_user('candidate'),
+                                                  candidate_position=self.position, photo='')
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        self.url = reverse('voted_list') + f'?election={self.election.id}'
+
+    def test_unchanged_page_gets_304_until_a_ballot_commits(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        etag = response['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            record_ballot(User.objects.create_user('zelda'), [self.position],
+                          {f'candidate_{self.candidate.id}': 'yes'}, self.election)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, 'zelda')
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+        start = threading.Barrier(8)
+        values = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)  # long enough for every thread to miss
+            return {'answer': 42}
+
+        def fetch():
+            start.wait()
+            values.append(results_cache.get_or_compute('test', compute, tag='1.0'))
+
+        threads = [threading.Thread(target=fetch) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(values, [{'answer': 42}] * 8)
+        # A new tag misses and computes again
+        results_cache.get_or_compute('test', compute, tag='2.0')
+        self.assertEqual(len(calls), 2)
+
+
+@override_settings(SHARED_STORE_PATH=tempfile.mktemp(suffix='.sqlite3'),
+                   LEDGER_PATH=tempfile.mktemp(suffix='.ledger'), LIVE_POLL_INTERVAL=0.05)
+class LiveStreamTests(TransactionTestCase):
+    """The server-sent events of main/live.py (the producer reads from other threads, hence committed data)"""
+
+    def setUp(self):
+        self.election = ElectionSettings.objects.create(election_name="Test", is_manual_override=True,
+                                                        is_active=True)
+        self.position = Position.objects.create(election=self.election, position_name="President", description="")
+        self.candidate = Candidate.objects.create(candidate_name=User.objects.create_user('candidate'),
+                                                  candidate_position=self.position, photo='')
+
+    @staticmethod
+    def parse(event):
+        fields = dict(line.split(': ', 1) for line in event.strip().splitlines())
+        return fields['event'], json.loads(fields['data'])
+
+    def cast(self):
+        record_ballot(User.objects.create_user('voter'), [self.position],
+                      {f'candidate_{self.candidate.id}': 'yes'}, self.election)
+
+    async def test_snapshot_then_delta_after_a_ballot(self):
+        events = live.stream(self.election.id)
+        try:
+            self.assertTrue((await anext(events)).startswith('retry:'))
+            name, data = self.parse(await anext(events))
+            self.assertEqual((name, data['voted'], data['tally']), ('snapshot', 0, []))
+
+            await sync_to_async(self.cast)()
+            name, data = self.parse(await asyncio.wait_for(anext(events), 5))
+            self.assertEqual(name, 'delta')
+            self.assertEqual(data['voted'], 1)
+            self.assertEqual(data['tally'], [[self.position.id, self.candidate.id, Vote.SINGLE_CANDIDATE, 'yes', 1]])
+            self.assertEqual(data['positions'], [[self.position.id, 1]])
+        finally:
+            await events.aclose()
+            # The producer stops once its last screen has gone
+            await asyncio.wait_for(live.broadcaster(self.election.id)._task, 5)
+
+
+@override_settings(SHARED_STORE_PATH=tempfile.mktemp(suffix='.sqlite3'))
+class ResultsPdfTests(TransactionTestCase):
+    """Coalesced builds in main/results_pdf.py (they run in background threads, hence committed data)"""
+
+    def setUp(self):
+        self.election = ElectionSettings.objects.create(election_name="Test")
+        self.enterContext(self.settings(RESULTS_PDF_DIR=tempfile.mkdtemp()))
+
+    def test_concurrent_downloads_share_one_build(self):
+        builds = []
+
+        def slow_build(out, election):
+            builds.append(election.id)
+            time.sleep(0.2)  # long enough for every download to ask for it
+            out.write(b'%PDF-1.4\n')
+
+        start = threading.Barrier(8)
+        paths = []
+
+        def download():
+            start.wait()
+            paths.append(results_pdf.get(self.election.id, '1.0', wait=5))
+
+        with mock.patch.object(results_pdf, 'build', slow_build):
+            threads = [threading.Thread(target=download) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(builds, [self.election.id])
+            self.assertEqual(paths, [results_pdf.pdf_path(self.election.id, '1.0')] * 8)
+
+            # The next tag's build replaces the file
+            results_pdf.get(self.election.id, '2.0', wait=5)
+        self.assertFalse(os.path.exists(paths[0]))
+
+    def test_a_file_replaced_before_it_is_opened_is_fetched_again(self):
+        path = results_pdf.pdf_path(self.election.id, '2.0')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'%PDF-1.4\n')
+        gone = results_pdf.pdf_path(self.election.id, '1.0')
+        with mock.patch.object(results_pdf, 'get', side_effect=[gone, path]):
+            with results_pdf.open_pdf(self.election.id) as pdf:
+                self.assertEqual(pdf.name, path)
+
+
+@override_settings(SHARED_STORE_PATH=tempfile.mktemp(suffix='.sqlite3'), STORAGES=PLAIN_STORAGES)
+class ProfilingTests(TestCase):
+    """Sampled request profiling from main/profiling.py"""
+
+    def setUp(self):
+        self.enterContext(self.settings(PROFILING_DIR=tempfile.mkdtemp()))
+        self.addCleanup(profiling.set_config, False)
+
+    def test_sampled_request_writes_a_profile(self):
+        profiling.set_config(True, rate=1)
+        self.assertEqual(self.client.get(reverse('login')).status_code, 200)
+        self.assertEqual([p['url_name'] for p in profiling.list_profiles()], ['login'])
+
+    def test_busy_profiler_runs_the_request_unprofiled(self):
+        # What Python 3.12+ raises while another thread is being profiled
+        with mock.patch('cProfile.Profile.enable', side_effect=ValueError):
+            self.assertEqual(profiling.run_profiled('login', lambda: 'response'), 'response')
+        self.assertEqual(profiling.list_profiles(), [])
+
+    def test_switched_off_costs_no_shared_store_reads(self):
+        profiling.set_config(False)
+        self.client.get(reverse('login'))  # caches the switch
+        with mock.patch.object(profiling.shared_store, 'get', wraps=profiling.shared_store.get) as get:
+            for _ in range(3):
+                self.client.get(reverse('login'))
+        self.assertEqual([c for c in get.call_args_list if str(c.args[0]).startswith('profiling:')], [])
+        self.assertEqual(profiling.list_profiles(), [])
+
+
+@override_settings(SHARED_STORE_PATH=tempfile.mktemp(suffix='.sqlite3'), STORAGES=PLAIN_STORAGES)
+class PublishedResultsTests(TestCase):
+    """vote_results serving the final results from main/publish.py"""
+
+    def setUp(self):
+        self.enterContext(self.settings(PUBLISHED_RESULTS_DIR=tempfile.mkdtemp()))
+        self.client.force_login(User.objects.create_user('viewer'))
+
+    def close(self, name):
+        election = ElectionSettings.objects.create(election_name=name, is_manual_override=True, is_active=True)
+        election.stop_manually()
+        return election
+
+    def test_without_election_the_last_published_results_are_shown(self):
+        first = self.close("Spring Election")
+        publish.publish(first)
+        second = self.close("Autumn Election")
+        publish.publish(second)
+        # The next election is created, and is now the default
+        upcoming = ElectionSettings.objects.create(election_name="Next Election")
+
+        response = self.client.get(reverse('vote_results'))
+        self.assertEqual(response['ETag'], f'"{publish.current(second.id)["version"]}"')
+        self.assertIn(b"Autumn Election", b''.join(response.streaming_content))
+
+        response = self.client.get(reverse('vote_results') + f'?election={first.id}')
+        self.assertEqual(response['ETag'], f'"{publish.current(first.id)["version"]}"')
+
+        # An explicit election that isn't published gets the live page
+        response = self.client.get(reverse('vote_results') + f'?election={upcoming.id}')
+        self.assertContains(response, f'data-stream-url="{reverse("live_stream")}?election={upcoming.id}"')
+    def test_published_files_skip_the_request_middleware(self):
+        manifest = publish.publish(self.close("Spring Election"))
+        with mock.patch.object(profiling, 'get_config') as get_config, \
+                mock.patch.object(metrics, 'observe_request') as observe_request:
+            response = self.client.get(manifest['urls']['json'])
+        self.assertEqual(response.status_code, 200)
+        get_config.assert_not_called()
+        observe_request.assert_not_called()
+
+
+@override_settings(SHARED_STORE_PATH=tempfile.mktemp(suffix='.sqlite3'), REPLICA_MAX_STALENESS=30)
+class ReplicaTests(TestCase):
+    """Routing and the staleness fallback of main/replica.py"""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.enterContext(self.settings(REPLICA_SNAPSHOT_PATH=os.path.join(directory, 'replica.sqlite3')))
+        # The copy itself is not under test; just record that one was asked for
+        self.refresh = self.enterContext(mock.patch.object(replica, 'refresh_in_background'))
+
+    def test_router_sends_only_main_reads_to_the_replica(self):
+        router = replica.ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Vote))
+        token = replica._use_replica.set(True)
+        try:
+            self.assertEqual(router.db_for_read(Vote), replica.REPLICA_DB_ALIAS)
+            self.assertEqual(router.db_for_read(Candidate), replica.REPLICA_DB_ALIAS)
+            # Auth and election state always come from the primary
+            self.assertIsNone(router.db_for_read(User))
+            self.assertIsNone(router.db_for_read(ElectionSettings))
+            self.assertEqual(router.db_for_write(Vote), 'default')
+        finally:
+            replica._use_replica.reset(token)
+
+    def snapshot(self, age):
+        with open(replica.snapshot_path(), 'wb'):
+            pass
+        shared_store.set('replica:refreshed_at', time.time() - age)
+
+    def test_missing_snapshot_reads_the_primary(self):
+        self.assertFalse(replica._prepare())
+        self.refresh.assert_called_once()
+
+    def test_fresh_snapshot_is_used(self):
+        self.snapshot(age=1)
+        self.assertTrue(replica._prepare())
+        self.refresh.assert_not_called()
+
+    def test_ageing_snapshot_is_used_while_a_new_one_is_copied(self):
+        self.snapshot(age=20)
+        self.assertTrue(replica._prepare())
+        self.refresh.assert_called_once()
+
+    def test_stale_snapshot_falls_back_to_the_primary(self):
+        self.snapshot(age=31)
+        self.assertFalse(replica._prepare())
+        self.refresh.assert_called_once()
+
+        seen = []
+        view = replica.read_from_replica(lambda request: seen.append(replica._use_replica.get()))
+        with mock.patch.object(replica, 'is_enabled', return_value=True):
+            view(None)
+        self.assertEqual(seen, [False])
+
+
+@override_settings(VOTE_ADMISSION_ENABLED=True, VOTE_ADMISSION_CAPACITY=2, VOTE_ADMISSION_SLOT_TTL=600,
+                   VOTE_ADMISSION_TICKET_TTL=30, VOTE_ADMISSION_DEFAULT_HOLD=90, STORAGES=PLAIN_STORAGES)
+class AdmissionTests(TestCase):
+    """The waiting room in front of the ballot (main/admission.py)"""
+
+    def setUp(self):
+        # Slots and tickets live in the shared store: a fresh one per test
+        self.enterContext(self.settings(SHARED_STORE_PATH=tempfile.mktemp(suffix='.sqlite3')))
+        self.now = 1000.0
+        self.enterContext(mock.patch.object(admission, 'time', mock.Mock(time=lambda: self.now)))
+
+    def test_capacity_and_queue_order(self):
+        self.assertEqual(admission.try_admit(1), (True, 0, 0))
+        self.assertEqual(admission.try_admit(2), (True, 0, 0))
+        # Full: later voters queue in arrival order, two served at a time for 90 s each
+        self.assertEqual(admission.try_admit(3), (False, 1, 45))
+        self.assertEqual(admission.try_admit(4), (False, 2, 90))
+        self.assertEqual(admission.try_admit(3), (False, 1, 45))
+        # A slot holder coming back keeps their slot
+        self.assertEqual(admission.try_admit(1), (True, 0, 0))
+
+        admission.release(1)
+        # The freed slot is for the head of the queue, not whoever polls first
+        self.assertFalse(admission.try_admit(4).admitted)
+        self.assertTrue(admission.try_admit(3).admitted)
+        self.assertEqual(admission.try_admit(4).position, 1)
+
+    def test_release_feeds_the_eta(self):
+        admission.try_admit(1)
+        admission.try_admit(2)
+        self.now += 10
+        admission.release(1)
+        admission.try_admit(3)
+        # avg hold: 90 + 0.2 * (10 - 90) = 74 s, so one voter ahead waits 74 / 2
+        self.assertEqual(admission.try_admit(4), (False, 1, 37))
+
+    def test_abandoned_slots_expire(self):
+        admission.try_admit(1)
+        admission.try_admit(2)
+        self.assertFalse(admission.try_admit(3).admitted)
+        self.now += 601
+        self.assertTrue(admission.try_admit(3).admitted)
+
+    def test_tickets_that_stop_polling_are_dropped(self):
+        admission.try_admit(1)
+        admission.try_admit(2)
+        admission.try_admit(3)
+        self.assertEqual(admission.try_admit(4).position, 2)
+        self.now += 20
+        admission.try_admit(4)  # 4 keeps polling, 3 has gone
+        self.now += 20
+        self.assertEqual(admission.try_admit(4).position, 1)
+
+    @override_settings(VOTE_ADMISSION_CAPACITY=1)
+    def test_redirect_from_the_ballot_releases_the_slot(self):
+        first, second = Client(), Client()
+        first.force_login(User.objects.create_user('first'))
+        second.force_login(User.objects.create_user('second'))
+        election = ElectionSettings.objects.create(election_name="Test", is_manual_override=True, is_active=True)
+
+        # An open ballot holds the only slot
+        self.assertEqual(first.get(reverse('vote')).status_code, 200)
+        self.assertRedirects(second.get(reverse('vote')), reverse('vote_waiting_room'),
+                             fetch_redirect_response=False)
+        self.assertEqual(second.get(reverse('vote_waiting_status')).json(),
+                         {'admitted': False, 'position': 1, 'eta_seconds': 90})
+
+        # Leaving the ballot through a redirect frees the slot for the next voter
+        election.stop_manually()
+        self.assertRedirects(first.get(reverse('vote')), reverse('user_homepage'), fetch_redirect_response=False)
+        self.assertTrue(second.get(reverse('vote_waiting_status')).json()['admitted'])
+
+
+@override_settings(SHARED_STORE_PATH=tempfile.mktemp(suffix='.sqlite3'), THUMBNAIL_SIZES=(100, 200))
+class ThumbnailTests(TestCase):
+    """Ballot-sized JPEG/WebP derivatives of candidate photos (main/thumbnails.py)"""
+
+    def setUp(self):
+        self.enterContext(self.settings(MEDIA_ROOT=tempfile.mkdtemp()))
+        election = ElectionSettings.objects.create(election_name="Test")
+        self.position = Position.objects.create(election=election, position_name="President", description="")
+        self.person = User.objects.create_user('candidate')
+
+    @staticmethod
+    def photo(color, size=(640, 480)):
+        out = io.BytesIO()
+        Image.new('RGBA', size, color).save(out, 'PNG')
+        return out.getvalue()
+
+    def thumbnail(self, candidate, size, ext):
+        return Image.open(os.path.join(settings.MEDIA_ROOT, thumbnails.thumbnail_name(candidate.photo_hash, size, ext)))
+
+    def test_upload_gets_square_thumbnails_in_each_size_and_format(self):
+        data = self.photo('red')
+        candidate = Candidate.objects.create(candidate_name=self.person, candidate_position=self.position,
+                                             photo=ContentFile(data, name='photo.png'))
+        self.assertEqual(candidate.photo_hash, thumbnails.content_hash(data))
+        self.assertEqual(Candidate.objects.get(pk=candidate.pk).photo_hash, candidate.photo_hash)
+        for size in (100, 200):
+            jpeg = self.thumbnail(candidate, size, 'jpg')
+            self.assertEqual((jpeg.format, jpeg.size, jpeg.mode), ('JPEG', (size, size), 'RGB'))
+            self.assertEqual(self.thumbnail(candidate, size, 'webp').format, 'WEBP')
+        self.assertEqual(candidate.photo_thumbnail_url, settings.MEDIA_URL + thumbnails.thumbnail_name(
+            candidate.photo_hash, 100, 'jpg'))
+        self.assertTrue(candidate.photo_versioned_url.endswith(f'?v={candidate.photo_hash}'))
+
+    def test_new_photo_gets_new_names_and_a_new_ballot_version(self):
+        candidate = Candidate.objects.create(candidate_name=self.person, candidate_position=self.position,
+                                             photo=ContentFile(self.photo('red'), name='photo.png'))
+        old_hash, version = candidate.photo_hash, ballot_version()
+        candidate.photo = ContentFile(self.photo('blue'), name='photo.png')
+        candidate.save()
+        self.assertNotEqual(candidate.photo_hash, old_hash)
+        self.assertGreater(ballot_version(), version)
+        self.assertEqual(self.thumbnail(candidate, 100, 'jpg').size, (100, 100))
+
+    def test_unreadable_photo_falls_back_to_the_original(self):
+        with self.assertLogs('main.thumbnails', 'WARNING'):
+            candidate = Candidate.objects.create(candidate_name=self.person, candidate_position=self.position,
+                                                 photo=ContentFile(b'not an image', name='photo.png'))
+        self.assertEqual(candidate.photo_hash, '')
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, thumbnails.THUMBNAIL_DIR)))
+
+    def test_command_backfills_missing_thumbnails(self):
+        candidate = Candidate.objects.create(candidate_name=self.person, candidate_position=self.position,
+                                             photo=ContentFile(self.photo('red'), name='photo.png'))
+        path = os.path.join(settings.MEDIA_ROOT, thumbnails.thumbnail_name(candidate.photo_hash, 200, 'webp'))
+        os.remove(path)
+        out = io.StringIO()
+        call_command('generate_thumbnails', stdout=out)
+        self.assertTrue(os.path.exists(path))
+        self.assertIn("Thumbnails ready for 1 candidate(s), 0 failed.", out.getvalue())
+
+
+@override_settings(SHARED_STORE_PATH=tempfile.mktemp(suffix='.sqlite3'), VOTE_ADMISSION_ENABLED=False,
+                   STORAGES=PLAIN_STORAGES,
+                   CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                       'LOCATION': 'ballot-tests'}})
+class BallotCacheTests(TestCase):
+    """The ballot markup is cached per ballot version; the CSRF token is per request"""
+
+    def setUp(self):
+        election = ElectionSettings.objects.create(election_name="Test", is_manual_override=True, is_active=True)
+        self.position = Position.objects.create(election=election, position_name="President", description="")
+        self.person = User.objects.create_user('candidate', first_name="Ada", last_name="Lovelace")
+        self.candidate = Candidate.objects.create(candidate_name=self.person, candidate_position=self.position,
+                                                  photo='')
+        self.client.force_login(User.objects.create_user('voter'))
+
+    def ballot(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('vote'))
+        self.assertEqual(response.status_code, 200)
+        ballot_queries = [q['sql'] for q in queries
+                          if Position._meta.db_table in q['sql'] or Candidate._meta.db_table in q['sql']]
+        return response, ballot_queries
+
+    def test_cached_ballot_skips_the_position_queries(self):
+        response, queries = self.ballot()
+        self.assertContains(response, "Ada Lovelace")
+        self.assertTrue(queries)
+
+        response, queries = self.ballot()
+        self.assertContains(response, "Ada Lovelace")
+        self.assertContains(response, 'name="csrfmiddlewaretoken"')
+        self.assertEqual(queries, [])
+
+    def test_ballot_changes_render_afresh(self):
+        self.ballot()
+        self.position.position_name = "Chair"
+        self.position.save()
+        self.assertContains(self.ballot()[0], "Chair")
+
+        self.person.first_name = "Grace"
+        self.person.save()
+        self.assertContains(self.ballot()[0], "Grace Lovelace")
+
+    def test_logins_do_not_invalidate_the_ballot(self):
+        version = ballot_version()
+        self.person.last_login = timezone.now()
+        self.person.save(update_fields=['last_login'])
+        self.assertEqual(ballot_version(), version)
+
+
+@override_settings(SHARED_STORE_PATH=tempfile.mktemp(suffix='.sqlite3'), STORAGES=PLAIN_STORAGES,
+                   METRICS_ENABLED=True, METRICS_FLUSH_INTERVAL=3600)
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        # Start from an empty store, with nothing left over from other tests
+        metrics.render_prometheus()
+        shared_store.get_connection().execute('DELETE FROM metric')
+
+    def test_histogram_buckets_are_cumulative(self):
+        metrics.observe_request('vote', 0.03, queries=4, query_seconds=0.01, response_bytes=512)
+        metrics.observe_request('vote', 0.3, queries=2, query_seconds=0.02, response_bytes=256)
+        text = metrics.render_prometheus()
+
+        self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+        self.assertIn('http_request_duration_seconds_bucket{view="vote",le="0.025"} 0', text)
+        self.assertIn('http_request_duration_seconds_bucket{view="vote",le="0.05"} 1', text)
+        self.assertIn('http_request_duration_seconds_bucket{view="vote",le="0.5"} 2', text)
+        self.assertIn('http_request_duration_seconds_bucket{view="vote",le="+Inf"} 2', text)
+        self.assertIn('http_request_duration_seconds_count{view="vote"} 2', text)
+        self.assertIn('db_queries_total{view="vote"} 6', text)
+        self.assertIn('http_response_bytes_total{view="vote"} 768', text)
+
+    def test_requests_and_logins_are_recorded(self):
+        self.client.post(reverse('login'), {'username': 'nobody', 'password': 'wrong'})
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        response = self.client.get(reverse('metrics'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertContains(response, 'logins_total{outcome="failure"} 1')
+        self.assertContains(response, 'http_request_duration_seconds_count{view="login"} 1')
+
+    def test_staff_only(self):
+        self.client.force_login(User.objects.create_user('voter'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 302)
+
+
+@override_settings(SHARED_STORE_PATH=tempfile.mktemp(suffix='.sqlite3'), STORAGES=PLAIN_STORAGES,
+                   SLOW_QUERY_LOG_ENABLED=True, SLOW_QUERY_STATEMENT_SECONDS=0, SLOW_QUERY_LOG_SIZE=500)
+class SlowQueryTests(TestCase):
+
+    def setUp(self):
+        slow_queries.clear()
+
+    def test_slow_statements_are_logged_with_plan_and_no_values(self):
+        self.client.post(reverse('login'), {'username': 'secret-name', 'password': 'wrong'})
+
+        entries = [e for e in slow_queries.entries() if 'auth_user' in e['statement']]
+        self.assertTrue(entries)
+        entry = entries[0]
+        self.assertEqual(entry['view'], 'login')
+        self.assertEqual(entry['path'], reverse('login'))
+        self.assertEqual(entry['params_shape'], ['str(11)'])
+        self.assertRegex(entry['plan'], r'SEARCH|SCAN')
+        self.assertNotIn('secret-name', json.dumps(entry, default=str))
+
+    def test_only_slow_statements_are_picked(self):
+        statements = [('default', 'SELECT 1', (), False, 0.01), ('default', 'SELECT 2', (), False, 0.2)]
+        with self.settings(SLOW_QUERY_STATEMENT_SECONDS=0.1, SLOW_QUERY_REQUEST_SECONDS=1, SLOW_QUERY_DB_SECONDS=1):
+            picked, query_seconds = slow_queries.pick_slow_statements(statements, request_seconds=0.3)
+            self.assertEqual([s[1] for s in picked], ['SELECT 2'])
+            self.assertAlmostEqual(query_seconds, 0.21)
+
+            # A slow request logs its slowest statements, whatever their own time
+            picked, _ = slow_queries.pick_slow_statements(statements, request_seconds=2)
+            self.assertEqual([s[1] for s in picked], ['SELECT 2', 'SELECT 1'])
+
+    def test_log_is_bounded(self):
+        statements = [('default', f'INSERT INTO t VALUES ({i})', (), False, 1) for i in range(5)]
+        with self.settings(SLOW_QUERY_LOG_SIZE=3):
+            slow_queries.record('vote', '/main/vote/', 1, statements)
+        self.assertEqual([e['statement'] for e in slow_queries.entries()],
+                         [f'INSERT INTO t VALUES ({i})' for i in (4, 3, 2)])
+
+    def test_dump_command(self):
+        slow_queries.record('vote', '/main/vote/', 1, [('default', 'SELECT 1', ('x',), False, 1)])
+        out = io.StringIO()
+        call_command('dump_slow_queries', '--clear', stdout=out)
+
+        entries = json.loads(out.getvalue())['entries']
+        self.assertEqual([(e['statement'], e['params_shape']) for e in entries], [('SELECT 1', ['str(1)'])])
+        self.assertEqual(slow_queries.entries(), [])
+
+
+@override_settings(BALLOT_SHARDS=0)
+class VoteIndexTests(TestCase):
+    """The hot ballot queries audited by `manage.py audit_indexes` use the Vote indexes"""
+
+    def test_hot_queries_use_an_index(self):
+        election = ElectionSettings.objects.create(election_name="Test")
+        position = Position.objects.create(election=election, position_name="President", description="")
+        candidate = Candidate.objects.create(candidate_name=User.objects.create_user('candidate'),
+                                             candidate_position=position, photo='')
+        voters = User.objects.bulk_create(User(username=f'voter{i}') for i in range(20))
+        Vote.objects.bulk_create(
+            Vote(election=election, voter=voter, position=position, candidate=candidate,
+                 vote_type=Vote.SINGLE_CANDIDATE, choice='yes')
+            for voter in voters
+        )
+
+        verdicts = []
+        for label, run in audit_indexes.hot_queries(election, candidate, voters[0]):
+            recorder = slow_queries.StatementRecorder(connection.alias)
+            with connection.execute_wrapper(recorder):
+                run()
+            for alias, sql, params, many, duration in recorder.statements:
+                verdict = audit_indexes.classify(slow_queries.explain(alias, sql, params), Vote._meta.db_table)
+                verdicts.append(verdict)
+                if label not in audit_indexes.EXPECTED_SCANS:
+                    self.assertNotEqual(verdict, 'scan', f"{label}: {sql}")
+        self.assertIn('index', verdicts)
+
+    def test_classify(self):
+        self.assertEqual(audit_indexes.classify("SCAN main_vote", 'main_vote'), 'scan')
+        self.assertEqual(audit_indexes.classify("SCAN main_vote USING COVERING INDEX vote_tally_idx", 'main_vote'),
+                         'index')
+        self.assertEqual(audit_indexes.classify("SEARCH main_vote USING INDEX vote_election_voter_idx (election_id=?)",
+                                                'main_vote'), 'index')
+        self.assertEqual(audit_indexes.classify("Seq Scan on main_vote  (cost=0.00..1.00)", 'main_vote'), 'scan')
+        self.assertEqual(audit_indexes.classify("SCAN auth_user", 'main_vote'), '-')
+
+
+@override_settings(BALLOT_SHARDS=0)
+class RecountTests(TestCase):
+
+    def setUp(self):
+        election = ElectionSettings.objects.create(election_name="Test")
+        contested = Position.objects.create(election=election, position_name="President", description="")
+        yes_no = Position.objects.create(election=election, position_name="Treasurer", description="")
+        first, second = (Candidate.objects.create(candidate_name=User.objects.create_user(name),
+                                                  candidate_position=contested, photo='') for name in ('ada', 'grace'))
+        treasurer = Candidate.objects.create(candidate_name=User.objects.create_user('alan'),
+                                             candidate_position=yes_no, photo='')
+        for i in range(10):
+            voter = User.objects.create_user(f'voter{i}')
+            Vote.objects.create(election=election, voter=voter, position=contested,
+                                candidate=first if i % 3 else second,
+                                vote_type=Vote.MULTIPLE_CANDIDATES, choice='selected')
+            Vote.objects.create(election=election, voter=voter, position=yes_no, candidate=treasurer,
+                                vote_type=Vote.SINGLE_CANDIDATE, choice='yes' if i % 2 else 'no')
+
+    def recount(self, *args):
+        out = io.StringIO()
+        call_command('recount', *args, stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def test_recount_matches_the_live_tally(self):
+        for by in ('voter', 'position'):
+            with self.subTest(by=by):
+                out = self.recount('--by', by, '--workers', '1', '--partitions', '3')
+                self.assertIn("20 votes in", out)
+                self.assertIn("Recount matches the live tally.", out)
+
+    def test_counts_in_worker_processes(self):
+        out = self.recount('--workers', '2', '--partitions', '4')
+        self.assertIn("2 worker(s)", out)
+        self.assertIn("Recount matches the live tally.", out)
+
+    def test_discrepancies_are_reported(self):
+        live = tallies.vote_counts()
+        key = next(iter(live))
+        live[key] += 1
+        with mock.patch.object(tallies, 'vote_counts', return_value=live), \
+                self.assertRaisesMessage(CommandError, "1 discrepancy(ies)"):
+            self.recount('--workers', '1')
+
+    def test_rejects_zero_workers(self):
+        with self.assertRaisesMessage(CommandError, "--workers and --partitions must be 1 or more"):
+            self.recount('--workers', '0')
+
+
+@override_settings(BALLOT_SHARDS=0)
+class AnalyticsTests(TestCase):
+
+    def setUp(self):
+        self.election = ElectionSettings.objects.create(election_name="Test")
+        self.contested = Position.objects.create(election=self.election, position_name="President", description="")
+        self.yes_no = Position.objects.create(election=self.election, position_name="Treasurer", description="")
+        self.ada, self.grace = (Candidate.objects.create(candidate_name=User.objects.create_user(name),
+                                                         candidate_position=self.contested, photo='')
+                                for name in ('ada', 'grace'))
+        self.alan = Candidate.objects.create(candidate_name=User.objects.create_user('alan'),
+                                             candidate_position=self.yes_no, photo='')
+        start = timezone.now().replace(hour=8, minute=0, second=0, microsecond=0)
+        # voter0-3 pick ada, voter4-5 grace; voter0-3 answer on the yes/no position, voter5 skips it
+        for i in range(6):
+            voter = User.objects.create_user(f'voter{i}')
+            Vote.objects.create(election=self.election, voter=voter, position=self.contested,
+                                candidate=self.ada if i < 4 else self.grace,
+                                vote_type=Vote.MULTIPLE_CANDIDATES, choice='selected')
+            if i < 5:
+                Vote.objects.create(election=self.election, voter=voter, position=self.yes_no, candidate=self.alan,
+                                    vote_type=Vote.SINGLE_CANDIDATE, choice='yes' if i < 3 else 'no')
+            Vote.objects.filter(voter=voter).update(timestamp=start + timedelta(minutes=2 * i))
+
+        # Another election's ballot stays out of this one's analytics
+        other = ElectionSettings.objects.create(election_name="Other")
+        position = Position.objects.create(election=other, position_name="Chair", description="")
+        Vote.objects.create(election=other, voter=User.objects.get(username='voter0'), position=position,
+                            candidate=Candidate.objects.create(candidate_name=User.objects.create_user('bob'),
+                                                               candidate_position=position, photo=''),
+                            vote_type=Vote.SINGLE_CANDIDATE, choice='yes')
+        self.columns = analytics.load_votes(election=self.election)
+
+    def test_tally_matches_the_orm(self):
+        self.assertEqual(len(self.columns), 11)
+        self.assertEqual(analytics.tally(self.columns), tallies.vote_counts(self.election))
+        self.assertEqual(len(analytics.load_votes()), 12)
+
+    def test_abstention(self):
+        self.assertEqual(analytics.abstention(self.columns), {
+            self.contested.id: {'voted': 6, 'skipped': 0, 'rate': 0.0},
+            self.yes_no.id: {'voted': 5, 'skipped': 1, 'rate': 1 / 6},
+        })
+        self.assertEqual(analytics.abstention(self.columns, electorate=10)[self.yes_no.id]['skipped'], 5)
+
+    def test_turnout_curve(self):
+        starts, cumulative = analytics.turnout_curve(self.columns, bucket_seconds=300)
+        self.assertEqual(cumulative.tolist(), [3, 5, 6])
+        self.assertEqual(len(starts), 3)
+        self.assertEqual((starts[1:] - starts[:-1]).astype('int64').tolist(), [300, 300])
+
+    def test_co_selection(self):
+        rows, columns, matrix = analytics.co_selection(self.columns, self.contested.id, self.yes_no.id)
+        self.assertEqual(rows, [(self.ada.id, 'selected'), (self.grace.id, 'selected')])
+        self.assertEqual(columns, [(self.alan.id, 'yes'), (self.alan.id, 'no')])
+        self.assertEqual(matrix.tolist(), [[3, 1], [0, 1]])
+
+    def test_bench_tally_methods_agree(self):
+        out = io.StringIO()
+        # The command adds its throwaway database alias itself
+        with mock.patch.object(type(self), 'databases', self.databases | {bench_tally.BENCH_ALIAS}):
+            call_command('bench_tally', votes=120, positions=4, candidates=3, repeat=1, stdout=out)
+        self.assertIn("NumPy tally (loaded)", out.getvalue())
+        self.assertIn("co-selection, all pairs", out.getvalue())
+
+
+@override_settings(BALLOT_SHARDS=0)
+class TurnoutTests(TestCase):
+
+    def setUp(self):
+        self.election = ElectionSettings.objects.create(election_name="Test")
+        self.other = ElectionSettings.objects.create(election_name="Other")
+        self.start = timezone.now().replace(second=0, microsecond=0) - timedelta(minutes=10)
+
+    def test_series_returns_buckets_from_the_cursor_on(self):
+        for seconds in (5, 50, 70):
+            turnout.record(self.election.id, self.start + timedelta(seconds=seconds))
+        turnout.record(self.other.id, self.start)
+        first, second = int(self.start.timestamp()), int(self.start.timestamp()) + 60
+
+        data = turnout.series(self.election)
+        self.assertEqual(data, {'step': 60, 'cursor': second, 'total': 3, 'buckets': [[first, 2], [second, 1]]})
+
+        # The last bucket comes back, it may still be filling up
+        turnout.record(self.election.id, self.start + timedelta(seconds=80))
+        data = turnout.series(self.election, since=data['cursor'])
+        self.assertEqual(data, {'step': 60, 'cursor': second, 'total': 4, 'buckets': [[second, 2]]})
+
+        self.assertEqual(turnout.series(self.election, since=second + 60)['cursor'], second + 60)
+
+    def test_rebuild_from_the_ballots(self):
+        position = Position.objects.create(election=self.election, position_name="President", description="")
+        candidate = Candidate.objects.create(candidate_name=User.objects.create_user('candidate'),
+                                             candidate_position=position, photo='')
+        for i in range(3):
+            Vote.objects.create(election=self.election, voter=User.objects.create_user(f'voter{i}'),
+                                position=position, candidate=candidate,
+                                vote_type=Vote.SINGLE_CANDIDATE, choice='yes')
+        Vote.objects.filter(voter__username='voter2').update(timestamp=self.start + timedelta(minutes=3))
+        Vote.objects.exclude(voter__username='voter2').update(timestamp=self.start)
+        turnout.record(self.election.id, self.start + timedelta(minutes=5))  # a stale bucket
+
+        out = io.StringIO()
+        call_command('rebuild_turnout', election=self.election.id, stdout=out)
+        self.assertIn("Rebuilt 2 turnout bucket(s) for Test.", out.getvalue())
+        minute = int(self.start.timestamp())
+        self.assertEqual(turnout.series(self.election)['buckets'], [[minute, 2], [minute + 180, 1]])
+
+    def test_view_rejects_a_bad_cursor(self):
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        url = reverse('turnout_series')
+        turnout.record(self.election.id, self.start)
+
+        response = self.client.get(url, {'election': self.election.id})
+        self.assertEqual(response.json()['total'], 1)
+        self.assertEqual(self.client.get(url, {'election': self.election.id, 'since': 'soon'}).status_code, 400)
+
+
+@override_settings(SHARED_STORE_PATH=tempfile.mktemp(suffix='.sqlite3'), BALLOT_SHARDS=0)
+class RollTests(TestCase):
+
+    def setUp(self):
+        self.election = ElectionSettings.objects.create(election_name="Test")
+        position = Position.objects.create(election=self.election, position_name="Treasurer", description="")
+        self.candidate = Candidate.objects.create(
+            candidate_name=User.objects.create_user('alan', first_name="Alan", last_name="Turing"),
+            candidate_position=position, photo='')
+        self.ada = User.objects.create_user('ada', first_name="Ada", last_name="Lovelace")
+        self.grace = User.objects.create_user('grace', first_name="Grace", last_name="Hopper")
+        Vote.objects.create(election=self.election, voter=self.ada, position=position, candidate=self.candidate,
+                            vote_type=Vote.SINGLE_CANDIDATE, choice='no')
+
+    def test_roll_rows(self):
+        self.assertEqual(list(rolls.roll_rows('all', self.election)), [
+            ('ada', "Ada", "Lovelace", 'Yes'),
+            ('alan', "Alan", "Turing", 'No'),
+            ('grace', "Grace", "Hopper", 'No'),
+        ])
+        self.assertEqual([row[0] for row in rolls.roll_rows('voted', self.election)], ['ada'])
+        self.assertEqual([row[0] for row in rolls.roll_rows('not-voted', self.election)], ['alan', 'grace'])
+        self.assertEqual(list(rolls.candidate_rows(self.candidate)), [('ada', "Ada", "Lovelace", 'no')])
+
+    def test_long_rolls_are_paginated(self):
+        out = io.BytesIO()
+        rows = ((f'voter{i}', "First", "Last", None) for i in range(rolls.ROWS_PER_PAGE + 1))
+        self.assertEqual(rolls.build(out, "Voter Roll", rows), rolls.ROWS_PER_PAGE + 1)
+        self.assertEqual(len(re.findall(rb'/Type /Page\b(?!s)', out.getvalue())), 2)
+
+    def test_views(self):
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        response = self.client.get(reverse('roll_pdf', args=['voted']), {'election': self.election.id})
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertIn(f'roll-voted-{self.election.id}.pdf', response['Content-Disposition'])
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+        response = self.client.get(reverse('candidate_roll_pdf', args=[self.candidate.id]))
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(self.client.get(reverse('roll_pdf', args=['absent'])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('candidate_roll_pdf', args=[0])).status_code, 404)
+
+
+@override_settings(SHARED_STORE_PATH=tempfile.mktemp(suffix='.sqlite3'), BALLOT_SHARDS=0, LEDGER_ENABLED=False)
+class ElectionScopingTests(TestCase):
+
+    def setUp(self):
+        self.voter = User.objects.create_user('voter')
+        self.elections, self.positions = [], []
+        for name in ("Engineering", "Finance"):
+            election = ElectionSettings.objects.create(election_name=name, is_manual_override=True, is_active=True)
+            position = Position.objects.create(election=election, position_name=f"{name} rep", description="")
+            Candidate.objects.create(candidate_name=User.objects.create_user(name.lower()),
+                                     candidate_position=position, photo='')
+            self.elections.append(election)
+            self.positions.append(position)
+
+    def vote(self, election, position):
+        positions = Position.objects.filter(election=election).prefetch_related('candidate_position')
+        record_ballot(self.voter, positions, {f'candidate_{position.id}': 'yes'}, election)
+
+    def test_vote_takes_the_election_of_its_position(self):
+        engineering, finance = self.positions
+        vote = Vote.objects.create(voter=self.voter, position=finance, candidate=finance.candidate_position.get(),
+                                   choice='yes')
+        self.assertEqual(vote.election_id, self.elections[1].id)
+
+    def test_tallies_count_one_election(self):
+        engineering, finance = self.elections
+        with tempfile.TemporaryDirectory() as directory:
+            for shards in (0, 2):
+                with self.subTest(shards=shards), override_settings(BALLOT_SHARDS=shards, BALLOT_SHARD_DIR=directory):
+                    store = ballot_shards.get_store()
+                    try:
+                        self.vote(engineering, self.positions[0])
+                        self.assertTrue(tallies.has_voted(self.voter.id, engineering))
+                        self.assertFalse(tallies.has_voted(self.voter.id, finance))
+                        self.assertEqual(tallies.voted_count(finance), 0)
+                        self.assertEqual(list(tallies.vote_counts(engineering)),
+                                         [(self.positions[0].id, self.positions[0].candidate_position.get().id,
+                                           Vote.SINGLE_CANDIDATE, 'yes')])
+                        self.assertEqual(tallies.vote_counts(finance), {})
+
+                        self.vote(finance, self.positions[1])
+                        self.assertEqual(tallies.voted_voter_ids(finance), {self.voter.id})
+                        self.assertEqual(tallies.position_turnout(finance), {self.positions[1].id: 1})
+                        self.assertEqual(sum(tallies.vote_counts().values()), 2)
+                    finally:
+                        if store is not None:
+                            store.close()
+                        Vote.objects.all().delete()
+
+    def test_request_election_is_remembered(self):
+        engineering, finance = self.elections
+        self.assertEqual(elections.default(), finance)  # the newest open election
+
+        request = RequestFactory().get('/', {'election': engineering.id})
+        request.session = {}
+        self.assertEqual(elections.current(request), engineering)
+
+        request = RequestFactory().get('/')
+        request.session = {elections.SESSION_KEY: engineering.id}
+        self.assertEqual(elections.current(request), engineering)
+
+        # A closed election can still be viewed, but not voted in
+        engineering.stop_manually()
+        request = RequestFactory().get('/', {'election': engineering.id})
+        request.session = {}
+        self.assertEqual(elections.current(request), engineering)
+        self.assertIsNone(elections.open_for_voting(request))
+        request = RequestFactory().get('/')
+        request.session = {elections.SESSION_KEY: engineering.id}
+        self.assertEqual(elections.open_for_voting(request), finance)
+
+
+@override_settings(SHARED_STORE_PATH=tempfile.mktemp(suffix='.sqlite3'), BALLOT_SHARDS=0)
+class BallotExportTests(TestCase):
+
+    def setUp(self):
+        self.election = ElectionSettings.objects.create(election_name="Test")
+        contested = Position.objects.create(election=self.election, position_name="President", description="")
+        yes_no = Position.objects.create(election=self.election, position_name="Treasurer", description="")
+        ada, grace = (Candidate.objects.create(candidate_name=User.objects.create_user(name, first_name=name.title()),
+                                               candidate_position=contested, photo='') for name in ('ada', 'grace'))
+        alan = Candidate.objects.create(candidate_name=User.objects.create_user('alan', first_name="Alan"),
+                                        candidate_position=yes_no, photo='')
+        for i in range(5):
+            voter = User.objects.create_user(f'voter{i}')
+            Vote.objects.create(election=self.election, voter=voter, position=contested,
+                                candidate=ada if i % 2 else grace, vote_type=Vote.MULTIPLE_CANDIDATES,
+                                choice='selected')
+            Vote.objects.create(election=self.election, voter=voter, position=yes_no, candidate=alan,
+                                vote_type=Vote.SINGLE_CANDIDATE, choice='yes' if i % 2 else 'no')
+
+        other = ElectionSettings.objects.create(election_name="Other")
+        position = Position.objects.create(election=other, position_name="Chair", description="")
+        Vote.objects.create(election=other, voter=User.objects.get(username='voter0'), position=position,
+                            candidate=Candidate.objects.create(candidate_name=User.objects.create_user('bob'),
+                                                               candidate_position=position, photo=''),
+                            vote_type=Vote.SINGLE_CANDIDATE, choice='yes')
+
+    def test_export_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'ballots.npz')
+            out = io.StringIO()
+            # Several chunks, so the spooled columns are appended to
+            with mock.patch.object(ballot_export, 'CHUNK_SIZE', 3):
+                call_command('export_ballots', election=self.election.id, output=path, stdout=out)
+            self.assertIn("Exported 10 votes of Test", out.getvalue())
+            self.assertEqual(os.listdir(directory), ['ballots.npz'])
+
+            arrays, meta = ballot_export.load(path)
+            self.assertEqual((meta['votes'], meta['election']['id']), (10, self.election.id))
+            self.assertIsInstance(arrays['voter'], np.memmap)
+            self.assertEqual(arrays['position_name'].tolist(), ["President", "Treasurer"])
+            self.assertEqual(analytics.tally(ballot_export.vote_columns(arrays)), tallies.vote_counts(self.election))
+
+            plain, _ = ballot_export.load(path, mmap=False)
+            for name, _ in ballot_export.COLUMNS:
+                self.assertEqual(plain[name].tolist(), arrays[name].tolist())
+            del arrays  # close the memory maps before the directory goes
+
+    def test_unknown_election(self):
+        with self.assertRaisesMessage(CommandError, "No election with id 0"):
+            call_command('export_ballots', election=0, stdout=io.StringIO())
+
+    def test_view(self):
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        response = self.client.get(reverse('export_ballots'), {'election': self.election.id})
+        self.assertIn(f'ballots-{self.election.id}.npz', response['Content-Disposition'])
+        with np.load(io.BytesIO(b''.join(response.streaming_content)), allow_pickle=False) as data:
+            self.assertEqual(len(data['voter']), 10)
+            self.assertEqual(data['answers'].tolist(), ['multiple:selected', 'single:yes', 'single:no'])
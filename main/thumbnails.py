@@ -0,0 +1,96 @@
+# main/thumbnails.py
+"""
+Ballot-sized derivatives of candidate photos.
+
+Uploaded photos are often multi-megabyte phone pictures, but the ballot
+shows them at 70-100px. For every photo we keep square thumbnails in each
+size of THUMBNAIL_SIZES, as JPEG and WebP. File names carry a hash of the
+original's content, so a new upload gets new URLs and old ones can be
+cached forever.
+"""
+import hashlib
+import logging
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_DIR = 'candidate_photos/thumbs'
+
+# Pillow format name and save options for each file extension we produce
+THUMBNAIL_FORMATS = {
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', {'quality': 80, 'method': 6}),
+}
+
+
+def thumbnail_sizes():
+    return getattr(settings, 'THUMBNAIL_SIZES', (100, 200))
+
+
+def thumbnail_name(photo_hash, size, ext):
+    return f"{THUMBNAIL_DIR}/{photo_hash}_{size}.{ext}"
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def _render(image, size, ext):
+    fmt, options = THUMBNAIL_FORMATS[ext]
+    thumb = ImageOps.fit(image, (size, size), Image.LANCZOS)
+    if fmt == 'JPEG' and thumb.mode != 'RGB':
+        thumb = thumb.convert('RGB')
+    out = BytesIO()
+    thumb.save(out, fmt, **options)
+    return out.getvalue()
+
+
+def generate_thumbnails(photo, force=False):
+    """
+    Make sure every derivative of `photo` (an ImageField file) exists.
+
+    Returns the content hash used in the derivative names, or '' if the
+    photo could not be read, in which case templates fall back to the
+    original upload.
+    """
+    try:
+        photo.open('rb')
+        try:
+            data = photo.read()
+        finally:
+            photo.close()
+    except (FileNotFoundError, ValueError) as e:
+        logger.warning("Cannot read candidate photo %s: %s", photo.name, e)
+        return ''
+
+    photo_hash = content_hash(data)
+    wanted = [
+        (size, ext)
+        for size in thumbnail_sizes()
+        for ext in THUMBNAIL_FORMATS
+        if force or not default_storage.exists(thumbnail_name(photo_hash, size, ext))
+    ]
+    if not wanted:
+        return photo_hash
+
+    try:
+        image = Image.open(BytesIO(data))
+        # Phone cameras store rotation in EXIF rather than in the pixels
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    except (OSError, Image.DecompressionBombError) as e:
+        logger.warning("Cannot decode candidate photo %s: %s", photo.name, e)
+        return ''
+
+    for size, ext in wanted:
+        name = thumbnail_name(photo_hash, size, ext)
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        default_storage.save(name, ContentFile(_render(image, size, ext)))
+
+    return photo_hash
@@ -0,0 +1,77 @@
+# main/turnout.py
+"""
+Per-minute turnout buckets for the dashboard's live turnout chart, one
+set per election.
+
+record() adds one to the current minute's TurnoutBucket inside the
+ballot's transaction (with BALLOT_SHARDS, just after the shard
+commits), so the buckets agree with the committed ballots and the
+chart never has to group main_vote by timestamp. The dashboard polls
+series() with the cursor from its previous poll and gets back only the
+buckets from that minute on.
+
+`manage.py rebuild_turnout` recomputes the buckets from the stored
+ballots, e.g. for votes cast before the buckets existed.
+"""
+import datetime
+
+import numpy as np
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from . import analytics
+from .models import TurnoutBucket
+
+BUCKET_SECONDS = 60
+
+
+def bucket_start(when):
+    return when.replace(second=0, microsecond=0)
+
+
+def record(election_id, when=None):
+    """Count one ballot in its minute; call inside the ballot's transaction"""
+    minute = bucket_start(when or timezone.now())
+    if not TurnoutBucket.objects.filter(election_id=election_id, minute=minute).update(ballots=F('ballots') + 1):
+        # Ballot writers are serialized by the write transaction, so no
+        # other one can create this row in between
+        TurnoutBucket.objects.create(election_id=election_id, minute=minute, ballots=1)
+
+
+def _epoch(when):
+    return int(when.timestamp())
+
+
+def series(election, since=None):
+    """
+    The buckets of `election` (an instance or id) from `since` (epoch
+    seconds) on, as a JSON-ready dict. `cursor` is the minute of the last
+    bucket; pass it back as `since`. That bucket comes back again because
+    it may still be filling up.
+    """
+    election_buckets = TurnoutBucket.objects.filter(election=election)
+    buckets = election_buckets.order_by('minute')
+    if since is not None:
+        buckets = buckets.filter(minute__gte=datetime.datetime.fromtimestamp(since, tz=datetime.timezone.utc))
+    rows = [[_epoch(minute), n] for minute, n in buckets.values_list('minute', 'ballots')]
+    return {
+        'step': BUCKET_SECONDS,
+        'cursor': rows[-1][0] if rows else since,
+        'total': election_buckets.aggregate(total=Sum('ballots'))['total'] or 0,
+        'buckets': rows,
+    }
+
+
+def rebuild(election):
+    """Recompute the election's buckets from its stored ballots; returns the number of buckets"""
+    times = analytics.ballot_times(analytics.load_votes(election=election))
+    minutes, counts = np.unique(times - times % BUCKET_SECONDS, return_counts=True)
+    buckets = [
+        TurnoutBucket(election=election, minute=datetime.datetime.fromtimestamp(int(minute), tz=datetime.timezone.utc), ballots=int(n))
+        for minute, n in zip(minutes, counts)
+    ]
+    with transaction.atomic():
+        TurnoutBucket.objects.filter(election=election).delete()
+        TurnoutBucket.objects.bulk_create(buckets, batch_size=1000)
+    return len(buckets)
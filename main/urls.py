@@ -12,6 +12,8 @@ urlpatterns = [
     path('manage_candidates/', main_views.manage_candidates, name='manage_candidates'),
     path('register_candidate/', main_views.register_candidate, name='register_candidate'),
     path('vote/', main_views.vote_view, name='vote'),
+    path('vote/waiting/', main_views.vote_waiting_room, name='vote_waiting_room'),
+    path('vote/waiting/status/', main_views.vote_waiting_status, name='vote_waiting_status'),
     path('manage_vote/', main_views.manage_vote_dashboard, name='manage_vote_dashboard'),
     path('voters/', main_views.voter_list, name='voter_list'),
     path('voted/', main_views.voted_list, name='voted_list'),
@@ -19,9 +21,22 @@ urlpatterns = [
     path('not-voted/', main_views.not_voted_list, name='not_voted_list'),
     path('candidate-voters/<int:candidate_id>/', main_views.candidate_voters, name='candidate_voters'),
     path('vote_results/pdf/', main_views.export_vote_results_pdf, name='vote_results_pdf'),
+    path('rolls/<str:roll>/pdf/', main_views.roll_pdf, name='roll_pdf'),
+    path('candidate-voters/<int:candidate_id>/pdf/', main_views.candidate_roll_pdf, name='candidate_roll_pdf'),
+    path('ballots/export/', main_views.export_ballots, name='export_ballots'),
     path('manage_election/', main_views.manage_election, name='manage_election'),
     path('start_election/', main_views.start_election_manual, name='start_election'),
     path('stop_election/', main_views.stop_election_manual, name='stop_election'),
+    path('elections/new/', main_views.create_election, name='create_election'),
     path('send-credentials/', main_views.send_credentials_view, name='send_credentials'),
     path('test-email/', main_views.test_email_view, name='test_email'),
+    path('audit/root/', main_views.audit_root, name='audit_root'),
+    path('audit/proof/<int:index>/', main_views.audit_proof, name='audit_proof'),
+    path('audit/receipt/', main_views.audit_receipt, name='audit_receipt'),
+    path('turnout/', main_views.turnout_series, name='turnout_series'),
+    path('live/', main_views.live_stream, name='live_stream'),
+    path('metrics/', main_views.metrics_view, name='metrics'),
+    path('slow_queries/', main_views.slow_query_log, name='slow_query_log'),
+    path('profiles/', main_views.profiles_view, name='profiles'),
+    path('profiles/<str:name>/', main_views.download_profile, name='download_profile'),
 ]
\ No newline at end of file
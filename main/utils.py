@@ -6,6 +6,7 @@ from django.conf import settings
 from django.contrib.auth.models import User
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
+from . import metrics
 
 def extract_names_from_full_name(full_name):
     """
@@ -69,8 +70,10 @@ def send_user_credentials(user, password):
             html_message=html_message,
             fail_silently=False,
         )
+        metrics.inc('credential_emails_total', outcome='sent')
         return True, "Email sent successfully"
     except Exception as e:
+        metrics.inc('credential_emails_total', outcome='failed')
         return False, str(e)
 
 def send_credentials_to_all_users(request):
@@ -0,0 +1,45 @@
+# main/versions.py
+"""
+Version counters for things we cache.
+
+The ballot version changes whenever anything shown on the ballot changes
+(positions, candidates, candidate names/photos). Cached ballot markup is
+keyed on it, so a bump is all it takes to invalidate every worker's copy.
+The counter lives in the shared store so all workers see the same value.
+
+The results version changes whenever a ballot is committed or the voter
+roll changes. Live result streams (main/live.py) compare it instead of
+re-running the tallies. Together with the ballot version it tags every
+cached results page (main/results_cache.py).
+"""
+from . import shared_store
+
+BALLOT_VERSION_KEY = 'version:ballot'
+RESULTS_VERSION_KEY = 'version:results'
+
+
+def ballot_version():
+    return shared_store.get(BALLOT_VERSION_KEY, 0)
+
+
+def bump_ballot_version():
+    return shared_store.incr(BALLOT_VERSION_KEY)
+
+
+def results_version():
+    return shared_store.get(RESULTS_VERSION_KEY, 0)
+
+
+def bump_results_version():
+    return shared_store.incr(RESULTS_VERSION_KEY)
+
+
+def results_tag():
+    """Identifies everything the results pages show: '<results version>.<ballot version>'"""
+    return f"{results_version()}.{ballot_version()}"
+
+
+def results_changed_at():
+    """UNIX time of the last change to either version, or None"""
+    times = [t for t in (shared_store.updated(RESULTS_VERSION_KEY), shared_store.updated(BALLOT_VERSION_KEY)) if t]
+    return max(times) if times else None
@@ -3,7 +3,7 @@ from django.contrib.auth.models import User
 from django.contrib.auth import logout, authenticate, login
 from django.contrib.auth.views import LoginView
 from django.urls import reverse_lazy
-from .models import Position, Candidate, Vote, ElectionSettings
+from .models import Position, Candidate, Vote, ElectionSettings, AuditLeaf
 from .forms import PositionForm, CandidateForm, VotingForm, CustomLoginForm, ElectionSettingsForm
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
@@ -12,42 +12,51 @@ from django.conf import settings
 from django.db.models import Count, Q
 from django.utils import timezone
 import datetime
-from io import BytesIO
-from django.http import HttpResponse
-from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet
+import logging
+from django.http import HttpResponse, JsonResponse, FileResponse, Http404, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 from django.contrib.admin.views.decorators import staff_member_required
 from .utils import send_credentials_to_all_users
+import tempfile
 import time
 from django.views.decorators.csrf import csrf_protect
 from django.middleware.csrf import get_token
+from . import admission, ballot_export, elections, live, merkle, metrics, profiling, publish, results_cache, results_pdf, rolls, slow_queries, tallies, turnout
+from .versions import ballot_version
+from .ballots import VotingClosed, record_ballot
+from .replica import read_from_replica
 
+logger = logging.getLogger(__name__)
 
 
 # Create your views here.
 def user_homepage(request):
-    return render(request, 'main/user_home.html')
+    receipts = []
+    if request.user.is_authenticated:
+        receipts = AuditLeaf.objects.filter(voter=request.user).select_related('election').order_by('index')
+    return render(request, 'main/user_home.html', {
+        'open_elections': [e for e in elections.all_elections() if e.get_voting_status()],
+        'receipts': receipts,
+    })
 
 # In views.py - update admin_homepage function
 # In views.py
+@read_from_replica
 def admin_homepage(request):
     from django.utils import timezone  # IMPORT HERE
     
-    # Get or create election settings
-    election_settings = ElectionSettings.objects.first()
-    if not election_settings:
-        election_settings = ElectionSettings.objects.create(election_name="General Election")
+    election_settings = elections.current(request)
     
     # Get statistics
     total_voters = User.objects.count()
-    voted_count = Vote.objects.values('voter').distinct().count()
+    voted_count = tallies.voted_count(election_settings)
     not_voted_count = total_voters - voted_count
-    positions_count = Position.objects.count()
-    candidates_count = Candidate.objects.count()
+    positions_count = Position.objects.filter(election=election_settings).count()
+    candidates_count = Candidate.objects.filter(candidate_position__election=election_settings).count()
     
     return render(request, 'main/admin_home.html', {
+        'election': election_settings,
+        'elections': elections.all_elections(),
         'election_settings': election_settings,
         'total_voters': total_voters,
         'voted_count': voted_count,
@@ -62,12 +71,14 @@ def logout_view(request):
     return redirect('login')
 
 def manage_positions(request):
-    positions = Position.objects.all()
-    return render(request, 'main/manage_positions.html', {'positions': positions})
+    election = elections.current(request)
+    positions = Position.objects.filter(election=election)
+    return render(request, 'main/manage_positions.html', {'positions': positions, 'election': election})
 
 def register_position(request):
+    election = elections.current(request)
     if request.method == 'POST':
-        form = PositionForm(request.POST)
+        form = PositionForm(request.POST, instance=Position(election=election))
         if form.is_valid():
             position_name = form.cleaned_data.get('position_name')
             messages.success(request, f"Position ({position_name}) created successfully!")
@@ -75,15 +86,19 @@ def register_position(request):
             return redirect('manage_positions')
     else:
         form = PositionForm()
-    return render(request, 'main/register_position.html', {'form': form})
+    return render(request, 'main/register_position.html', {'form': form, 'election': election})
 
 def manage_candidates(request):
-    positions = Position.objects.prefetch_related('candidate_position').all()
-    return render(request, 'main/manage_candidates.html', {'positions': positions})
+    election = elections.current(request)
+    positions = Position.objects.filter(election=election).prefetch_related('candidate_position')
+    return render(request, 'main/manage_candidates.html', {'positions': positions, 'election': election})
 
 def register_candidate(request):
+    election = elections.current(request)
     if request.method == 'POST':
         form = CandidateForm(request.POST, request.FILES)
+        # Candidates stand for a position of the election being managed
+        form.fields['candidate_position'].queryset = Position.objects.filter(election=election)
         if form.is_valid():
             candidate_name = form.cleaned_data.get('candidate_name')
             candidate_position = form.cleaned_data.get('candidate_position')
@@ -95,67 +110,50 @@ def register_candidate(request):
                 return redirect('manage_candidates')
     else:
         form = CandidateForm()
-    return render(request, 'main/register_candidate.html', {'form': form})
+        form.fields['candidate_position'].queryset = Position.objects.filter(election=election)
+    return render(request, 'main/register_candidate.html', {'form': form, 'election': election})
 
 @login_required
+@admission.admission_required
 def vote_view(request):
     try:
-        # For now, allow voting regardless of election settings
-        # We'll fix this after we get voting working
-        is_election_active = True  # TEMPORARY: Always allow voting
+        # Only an open election, whatever ?election= asks for
+        election_settings = elections.open_for_voting(request)
+        is_election_active = election_settings is not None
         
         if not is_election_active:
             messages.error(request, "Voting is not currently active.")
             return redirect('user_homepage')
         
-        positions = Position.objects.prefetch_related('candidate_position').all()
+        positions = (Position.objects.filter(election=election_settings)
+                     .prefetch_related('candidate_position__candidate_name'))
 
         # Check if user has already voted
-        has_voted = Vote.objects.filter(voter=request.user).exists()
+        has_voted = tallies.has_voted(request.user.id, election_settings)
         if has_voted:
             messages.error(request, "You have already voted. Voting is allowed only once.")
             return redirect('user_homepage')
         
-        # ADD THIS LINE: Get election settings for template
-        election_settings = ElectionSettings.objects.first()
-        
         if request.method == 'POST':
             form = VotingForm(request.POST, positions=positions)
             if form.is_valid():
-                for position in positions:
-                    candidates = position.candidate_position.all()
-                    
-                    if candidates.count() > 1:
-                        # Multiple candidates - get selected candidate ID
-                        selected_candidate_id = form.cleaned_data.get(f'position_{position.id}')
-                        if selected_candidate_id:
-                            selected_candidate = Candidate.objects.get(id=int(selected_candidate_id))
-                            Vote.objects.create(
-                                voter=request.user,
-                                position=position,
-                                candidate=selected_candidate,
-                                vote_type=Vote.MULTIPLE_CANDIDATES,
-                                choice='selected'
-                            )
-                    else:
-                        # Single candidate - create yes/no vote
-                        for candidate in candidates:
-                            choice = form.cleaned_data.get(f'candidate_{candidate.id}')
-                            if choice:
-                                Vote.objects.create(
-                                    voter=request.user,
-                                    position=position,
-                                    candidate=candidate,
-                                    vote_type=Vote.SINGLE_CANDIDATE,
-                                    choice=choice
-                                )
+                try:
+                    record_ballot(request.user, positions, form.cleaned_data, election_settings)
+                except VotingClosed:
+                    # Closed while the voter was filling in the ballot
+                    messages.error(request, "Voting has closed; your ballot was not recorded.")
+                    return redirect('user_homepage')
                 
+                metrics.inc('ballots_committed_total')
                 messages.success(request, "Your votes have been submitted!")
                 return redirect('user_homepage')
             else:
                 messages.error(request, "There was an error with your vote submission. Please complete all required fields.")
         else:
-            form = VotingForm(positions=positions)
+            # The ballot markup comes from the fragment cache, so a GET needs
+            # no form; positions stay a lazy queryset and only hit the
+            # database when the cached fragment has to be re-rendered.
+            form = None
         
         # UPDATED: Add election_settings to context
         return render(request, 'main/vote.html', {
@@ -163,13 +161,41 @@ def vote_view(request):
             'positions': positions,
             'voting_closed': False,
             'is_election_active': is_election_active,
-            'election_settings': election_settings  # ADDED THIS LINE
+            'election_settings': election_settings,  # ADDED THIS LINE
+            'ballot_version': ballot_version(),
+            'ballot_cache_timeout': getattr(settings, 'BALLOT_CACHE_TIMEOUT', 86400),
         })
         
     except Exception as e:
         messages.error(request, f"Error: {str(e)}")
         return redirect('user_homepage')
     
+@login_required
+def vote_waiting_room(request):
+    """
+    Holding page shown while the ballot is at capacity.
+    The page polls vote_waiting_status and moves on once a slot is free.
+    """
+    state = admission.try_admit(request.user.id)
+    if state.admitted:
+        return redirect('vote')
+
+    return render(request, 'main/vote_waiting.html', {
+        'position': state.position,
+        'eta_seconds': state.eta_seconds,
+        'poll_interval': getattr(settings, 'VOTE_ADMISSION_POLL_INTERVAL', 5),
+    })
+
+@login_required
+def vote_waiting_status(request):
+    """Cheap JSON poll for the waiting room - no ORM queries beyond the session user"""
+    state = admission.try_admit(request.user.id)
+    return JsonResponse({
+        'admitted': state.admitted,
+        'position': state.position,
+        'eta_seconds': state.eta_seconds,
+    })
+
 @login_required
 def manage_election(request):
     """
@@ -179,10 +205,7 @@ def manage_election(request):
         messages.error(request, "Access denied. Admin only.")
         return redirect('user_homepage')
     
-    # Get or create election settings
-    election_settings = ElectionSettings.objects.first()
-    if not election_settings:
-        election_settings = ElectionSettings.objects.create(election_name="General Election")
+    election_settings = elections.current(request)
     
     if request.method == 'POST':
         form = ElectionSettingsForm(request.POST, instance=election_settings)
@@ -197,6 +220,8 @@ def manage_election(request):
     
     return render(request, 'main/manage_election.html', {
         'form': form,
+        'election': election_settings,
+        'elections': elections.all_elections(),
         'election_settings': election_settings,
         'now': timezone.now(),
     })
@@ -210,9 +235,7 @@ def start_election_manual(request):
         messages.error(request, "Access denied.")
         return redirect('user_homepage')
     
-    election_settings = ElectionSettings.objects.first()
-    if not election_settings:
-        election_settings = ElectionSettings.objects.create(election_name="General Election")
+    election_settings = elections.current(request)
     
     # Use the model method
     election_settings.start_manually()
@@ -229,47 +252,87 @@ def stop_election_manual(request):
         messages.error(request, "Access denied.")
         return redirect('user_homepage')
     
-    election_settings = ElectionSettings.objects.first()
-    if not election_settings:
-        election_settings = ElectionSettings.objects.create(election_name="General Election")
+    election_settings = elections.current(request)
     
     # Use the model method
     election_settings.stop_manually()
     
     messages.success(request, "⛔ Election stopped manually! Manual override is now ACTIVE.")
+    try:
+        published = publish.publish(election_settings, force=True)
+        messages.success(request, f"Final results published (version {published['version']}).")
+    except Exception:
+        logger.exception("publishing the final results failed")
+        messages.warning(request, "Final results could not be published; run manage.py publish_results.")
+    return redirect('manage_election')
+
+@login_required
+def create_election(request):
+    """
+    Start configuring another election (e.g. a departmental one) to run
+    alongside the others; it becomes the one being managed
+    """
+    if not (request.user.is_superuser or request.user.is_staff):
+        messages.error(request, "Access denied.")
+        return redirect('user_homepage')
+    if request.method != 'POST':
+        return redirect('manage_election')
+
+    name = request.POST.get('election_name', '').strip() or "General Election"
+    election = ElectionSettings.objects.create(election_name=name[:200])
+    request.session[elections.SESSION_KEY] = election.id
+    messages.success(request, f"Election ({election.election_name}) created. Add its positions and candidates.")
     return redirect('manage_election')
 
 # ... ALL YOUR OTHER EXISTING VIEW FUNCTIONS STAY THE SAME ...
 # (user_homepage, admin_homepage, logout_view, manage_positions, etc.)
 
-def manage_vote_dashboard(request):
+def _vote_dashboard_context(election):
     total_voters = User.objects.count()
-    voted_count = Vote.objects.values('voter').distinct().count()
-    not_voted_count = total_voters - voted_count
-    return render(request, 'main/manage_vote_dashboard.html', {
+    voted_count = tallies.voted_count(election)
+    return {
         'total_voters': total_voters,
         'voted_count': voted_count,
-        'not_voted_count': not_voted_count
-    })
+        'not_voted_count': total_voters - voted_count,
+    }
+
+def _election_results_context(request, name, compute, keys):
+    """results_cache.lazy_context() for the request's election, with `election` in the context"""
+    election = elections.current(request)
+    context = results_cache.lazy_context(f"{name}:{election.id}", lambda: compute(election), keys)
+    context['election'] = election
+    return context
+
+@results_cache.conditional
+def manage_vote_dashboard(request):
+    return render(request, 'main/manage_vote_dashboard.html', _election_results_context(
+        request, 'manage_vote_dashboard', _vote_dashboard_context, ['total_voters', 'voted_count', 'not_voted_count'],
+    ))
 
 def voter_list(request):
     voters = User.objects.all()
     return render(request, 'main/voter_list.html', {'voters': voters})
 
-def voted_list(request):
-    voted_user_ids = Vote.objects.values_list('voter', flat=True).distinct()
-    voted_users = User.objects.filter(id__in=voted_user_ids)
-    votes = Vote.objects.select_related('voter', 'candidate', 'position')
-    user_votes = {}
-    for user in voted_users:
-        user_votes[user.id] = list(votes.filter(voter=user))
-    return render(request, 'main/voted_list.html', {
+def _voted_list_context(election):
+    # One pass over the ballots instead of a query per voter
+    user_votes = tallies.votes_by_voter(election)
+    voted_users = list(User.objects.filter(id__in=list(user_votes)))
+    return {
         'voted_users': voted_users,
         'user_votes': user_votes,
-    })
+    }
 
-def vote_results(request):
-    positions = Position.objects.prefetch_related('candidate_position')
+@results_cache.conditional
+def voted_list(request):
+    return render(request, 'main/voted_list.html', _election_results_context(
+        request, 'voted_list', _voted_list_context, ['voted_users', 'user_votes'],
+    ))
+
+def _vote_results_context(election):
+    positions = Position.objects.filter(election=election).prefetch_related('candidate_position__candidate_name')
+    # All counts in two grouped queries rather than several per candidate
+    counts = tallies.vote_counts(election)
+    turnout = tallies.position_turnout(election)
     results = []
     
     for position in positions:
@@ -279,14 +342,10 @@ def vote_results(request):
         for candidate in candidates:
             if position.has_multiple_candidates():
                 # For multiple candidates, count "selected" votes
-                selected_count = Vote.objects.filter(
-                    position=position, 
-                    candidate=candidate, 
-                    vote_type=Vote.MULTIPLE_CANDIDATES
-                ).count()
+                selected_count = counts[(position.id, candidate.id, Vote.MULTIPLE_CANDIDATES, 'selected')]
                 
                 # Total votes for this position (each voter votes once)
-                total_votes_position = Vote.objects.filter(position=position).values('voter').distinct().count()
+                total_votes_position = turnout[position.id]
                 
                 candidate_data.append({
                     'candidate': candidate,
@@ -296,19 +355,8 @@ def vote_results(request):
                 })
             else:
                 # For single candidate, count yes/no votes
-                yes_count = Vote.objects.filter(
-                    position=position, 
-                    candidate=candidate, 
-                    choice='yes',
-                    vote_type=Vote.SINGLE_CANDIDATE
-                ).count()
-                
-                no_count = Vote.objects.filter(
-                    position=position, 
-                    candidate=candidate, 
-                    choice='no',
-                    vote_type=Vote.SINGLE_CANDIDATE
-                ).count()
+                yes_count = counts[(position.id, candidate.id, Vote.SINGLE_CANDIDATE, 'yes')]
+                no_count = counts[(position.id, candidate.id, Vote.SINGLE_CANDIDATE, 'no')]
                 
                 total = yes_count + no_count
                 yes_pct = int((yes_count / total) * 100) if total > 0 else 0
@@ -330,16 +378,47 @@ def vote_results(request):
             'has_multiple': position.has_multiple_candidates(),
         })
     
-    return render(request, 'main/vote_results.html', {'results': results})
+    audit_size, audit_root = merkle.root()
+    return {
+        'results': results,
+        'audit_size': audit_size,
+        'audit_root': audit_root,
+    }
 
+def vote_results(request):
+    election_id = elections.explicit_id(request)
+    # Without ?election=, the results that were published last, not whatever election is newest
+    published = publish.latest() if election_id is None else publish.current(election_id)
+    if published is not None:
+        # Final results: a file on disk, no database work
+        return publish.serve_page(request, published)
+    election = elections.current(request)
+    if publish.election_closed(election):
+        # First look after a scheduled end: publish off the request; the
+        # live page below already shows the final counts meanwhile
+        publish.publish_in_background(election)
+    return _live_vote_results(request)
+
+@results_cache.conditional
+def _live_vote_results(request):
+    return render(request, 'main/vote_results.html', _election_results_context(
+        request, 'vote_results', _vote_results_context, ['results', 'audit_size', 'audit_root'],
+    ))
+
+def _not_voted_list_context(election):
+    voted_user_ids = tallies.voted_voter_ids(election)
+    return {'not_voted_users': list(User.objects.exclude(id__in=list(voted_user_ids)))}
+
+@results_cache.conditional
 def not_voted_list(request):
-    voted_user_ids = Vote.objects.values_list('voter', flat=True).distinct()
-    not_voted_users = User.objects.exclude(id__in=voted_user_ids)
-    return render(request, 'main/not_voted_list.html', {'not_voted_users': not_voted_users})
+    return render(request, 'main/not_voted_list.html', _election_results_context(
+        request, 'not_voted_list', _not_voted_list_context, ['not_voted_users'],
+    ))
 
+@read_from_replica
 def candidate_voters(request, candidate_id):
     candidate = Candidate.objects.get(id=candidate_id)
-    votes = Vote.objects.filter(candidate=candidate).select_related('voter', 'position')
+    votes = tallies.votes_for_candidate(candidate.id)
     voters = [vote.voter for vote in votes]
     return render(request, 'main/candidate_voters.html', {
         'candidate': candidate,
@@ -350,140 +429,190 @@ def candidate_voters(request, candidate_id):
 class CustomLoginView(LoginView):
     template_name = 'main/login.html'
 
+    def form_valid(self, form):
+        metrics.inc('logins_total', outcome='success')
+        return super().form_valid(form)
+
+    def form_invalid(self, form):
+        metrics.inc('logins_total', outcome='failure')
+        return super().form_invalid(form)
+
     def get_success_url(self):
         if self.request.user.is_superuser or self.request.user.is_staff:
             return reverse_lazy('admin_homepage')
         else:
             return reverse_lazy('user_homepage')
 
+@results_cache.conditional
 def export_vote_results_pdf(request):
-    """
-    Generate a PDF summarising:
-    - total voters
-    - number who voted
-    - number not voted
-    - per-position candidate counts
-    """
-    # basic counts
-    total_voters = User.objects.count()
-    voted_count = Vote.objects.values('voter').distinct().count()
-    not_voted_count = total_voters - voted_count
+    """The results PDF for the current results version; see main/results_pdf.py"""
+    election_id = elections.current(request).id
+    published = publish.current(election_id)
+    if published is not None:
+        return redirect(published['urls']['pdf'])
+    pdf = results_pdf.open_pdf(election_id)
+    if pdf is None:
+        # Still being built (it keeps going in the background); try again shortly
+        response = HttpResponse("The results PDF is being generated. Please try again in a few seconds.",
+                                status=503, content_type='text/plain')
+        response['Retry-After'] = '5'
+        return response
+    return FileResponse(pdf, as_attachment=True, filename='vote_results.pdf',
+                        content_type='application/pdf')
+
+def _roll_response(filename, title, rows, extra_heading=None):
+    # Spooled to a temporary file so a long roll is never held in memory as one string
+    out = tempfile.TemporaryFile()
+    rolls.build(out, title, rows, extra_heading)
+    out.seek(0)
+    return FileResponse(out, as_attachment=True, filename=filename, content_type='application/pdf')
 
-    # build results same as vote_results view
-    positions = Position.objects.prefetch_related('candidate_position').all()
-    results = []
-    
-    for position in positions:
-        candidates = position.candidate_position.all()
-        candidate_rows = []
-        
-        for candidate in candidates:
-            if position.has_multiple_candidates():
-                selected_count = Vote.objects.filter(
-                    position=position, 
-                    candidate=candidate, 
-                    vote_type=Vote.MULTIPLE_CANDIDATES
-                ).count()
-                
-                total_votes_position = Vote.objects.filter(position=position).values('voter').distinct().count()
-                percentage = (selected_count / total_votes_position * 100) if total_votes_position > 0 else 0
-                
-                candidate_rows.append({
-                    'name': f"{candidate.candidate_name.first_name} {candidate.candidate_name.last_name}",
-                    'selected': selected_count,
-                    'total_votes': total_votes_position,
-                    'percentage': f"{percentage:.1f}%",
-                    'is_multiple': True,
-                })
-            else:
-                yes_count = Vote.objects.filter(
-                    position=position, 
-                    candidate=candidate, 
-                    choice='yes',
-                    vote_type=Vote.SINGLE_CANDIDATE
-                ).count()
-                
-                no_count = Vote.objects.filter(
-                    position=position, 
-                    candidate=candidate, 
-                    choice='no',
-                    vote_type=Vote.SINGLE_CANDIDATE
-                ).count()
-                
-                total = yes_count + no_count
-                yes_percentage = (yes_count / total * 100) if total > 0 else 0
-                
-                candidate_rows.append({
-                    'name': f"{candidate.candidate_name.first_name} {candidate.candidate_name.last_name}",
-                    'yes': yes_count,
-                    'no': no_count,
-                    'total': total,
-                    'yes_percentage': f"{yes_percentage:.1f}%",
-                    'is_multiple': False,
-                })
-        
-        results.append({
-            'position': position.position_name,
-            'has_multiple': position.has_multiple_candidates(),
-            'candidates': candidate_rows
-        })
+@staff_member_required
+@results_cache.conditional
+def roll_pdf(request, roll):
+    """Printable roll: everyone ('all'), 'voted' or 'not-voted'; see main/rolls.py"""
+    if roll not in rolls.ROLLS:
+        raise Http404("No such roll")
+    election = elections.current(request)
+    return _roll_response(f"roll-{roll}-{election.id}.pdf", rolls.ROLLS[roll], rolls.roll_rows(roll, election),
+                          'Voted?' if roll == 'all' else None)
 
-    # build PDF
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=36, leftMargin=36, topMargin=36, bottomMargin=36)
-    styles = getSampleStyleSheet()
-    story = []
-
-    story.append(Paragraph("Vote Results", styles['Title']))
-    story.append(Spacer(1, 12))
-
-    # summary counts
-    story.append(Paragraph(f"Total registered voters: <b>{total_voters}</b>", styles['Normal']))
-    story.append(Paragraph(f"Voted: <b>{voted_count}</b>", styles['Normal']))
-    story.append(Paragraph(f"Yet to vote: <b>{not_voted_count}</b>", styles['Normal']))
-    story.append(Spacer(1, 12))
-
-    # per-position tables
-    for r in results:
-        story.append(Paragraph(r['position'], styles['Heading2']))
-        story.append(Spacer(1, 6))
-
-        if r['has_multiple']:
-            # Table for multiple candidates
-            data = [["Candidate", "Votes", "Total Votes", "Percentage"]]
-            for c in r['candidates']:
-                data.append([c['name'], str(c['selected']), str(c['total_votes']), c['percentage']])
-            
-            table = Table(data, colWidths=[200, 60, 80, 80])
-        else:
-            # Table for single candidate
-            data = [["Candidate", "Yes", "No", "Total", "Yes %"]]
-            for c in r['candidates']:
-                data.append([c['name'], str(c['yes']), str(c['no']), str(c['total']), c['yes_percentage']])
-            
-            table = Table(data, colWidths=[200, 60, 60, 60, 60])
-
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.HexColor("#3E2723")),
-            ('TEXTCOLOR', (0,0), (-1,0), colors.white),
-            ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-            ('ALIGN',(1,1),(-1,-1),'CENTER'),
-            ('GRID', (0,0), (-1,-1), 0.25, colors.grey),
-            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-            ('LEFTPADDING', (0,0), (-1,-1), 6),
-            ('RIGHTPADDING', (0,0), (-1,-1), 6),
-        ]))
-        story.append(table)
-        story.append(Spacer(1, 12))
-
-    doc.build(story)
-    pdf = buffer.getvalue()
-    buffer.close()
-
-    response = HttpResponse(pdf, content_type='application/pdf')
-    response['Content-Disposition'] = 'attachment; filename="vote_results.pdf"'
+@staff_member_required
+@results_cache.conditional
+def candidate_roll_pdf(request, candidate_id):
+    """Printable list of the voters for one candidate"""
+    try:
+        candidate = Candidate.objects.select_related('candidate_name', 'candidate_position').get(id=candidate_id)
+    except Candidate.DoesNotExist:
+        raise Http404("No such candidate")
+    # Yes/no positions have one candidate, and the choice is what matters
+    has_multiple = candidate.candidate_position.has_multiple_candidates()
+    return _roll_response(f"roll-candidate-{candidate.id}.pdf",
+                          f"Voters for {candidate} ({candidate.candidate_position})",
+                          rolls.candidate_rows(candidate), None if has_multiple else 'Choice')
+
+@staff_member_required
+@results_cache.conditional
+def export_ballots(request):
+    """The election's votes as integer-coded columns (.npz) for analysts; see main/ballot_export.py"""
+    election = elections.current(request)
+    # Spooled to a temporary file, like the rolls: the export is never held in memory
+    out = tempfile.TemporaryFile()
+    ballot_export.write(out, election)
+    out.seek(0)
+    return FileResponse(out, as_attachment=True, filename=f"ballots-{election.id}.npz",
+                        content_type='application/octet-stream')
+
+def audit_root(request):
+    """Current Merkle root over all committed ballots, for observers"""
+    size, root = merkle.root()
+    return JsonResponse({'tree_size': size, 'root': root, 'hash': 'sha256', 'tree': 'RFC 6962'})
+
+def audit_proof(request, index):
+    """Inclusion proof for one ballot; ?size=N proves it against an earlier published root"""
+    current = merkle.tree_size()
+    try:
+        size = int(request.GET.get('size') or current)
+        if size > current:
+            raise ValueError(size)
+        proof = merkle.inclusion_proof(index, size)
+    except ValueError:
+        raise Http404("No such ballot in the tree")
+    leaf = AuditLeaf.objects.get(index=index)
+    _, root = merkle.root(size)
+    return JsonResponse({
+        'leaf_index': index,
+        'leaf_hash': leaf.leaf_hash,
+        'tree_size': size,
+        'root': root,
+        'inclusion_proof': proof,
+    })
+
+@login_required
+def audit_receipt(request):
+    """The voter's own ballot receipt for the election, to check against published roots later"""
+    leaf = AuditLeaf.objects.filter(voter=request.user, election_id=elections.current_id(request)).first()
+    if leaf is None:
+        raise Http404("You have not voted")
+    response = JsonResponse(merkle.receipt(leaf))
+    response['Content-Disposition'] = f'attachment; filename="ballot-receipt-{leaf.index}.json"'
+    return response
+
+@staff_member_required
+def turnout_series(request):
+    """Per-minute ballots for the dashboard chart; ?since=<cursor> returns only newer buckets"""
+    since = request.GET.get('since')
+    try:
+        since = int(since) if since else None
+    except ValueError:
+        return JsonResponse({'error': "since must be a cursor from an earlier response"}, status=400)
+    return JsonResponse(turnout.series(elections.current(request), since))
+
+@staff_member_required
+async def live_stream(request):
+    """Server-sent events with tally and turnout deltas; see main/live.py"""
+    if not isinstance(request, ASGIRequest):
+        # A WSGI worker would be tied up for as long as the screen stays open
+        return HttpResponse("Live updates need the ASGI server.", status=503, content_type='text/plain')
+    # The pages pass ?election=; reading the session would need the database
+    response = StreamingHttpResponse(live.stream(elections.query_id(request)), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # don't let a proxy hold events back
     return response
 
+@staff_member_required
+def metrics_view(request):
+    """Prometheus scrape endpoint, aggregated over all workers"""
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@staff_member_required
+def slow_query_log(request):
+    """Recent slow SQL with query plans; ?format=json dumps the whole log"""
+    if request.method == 'POST' and 'clear' in request.POST:
+        slow_queries.clear()
+        messages.success(request, "Slow query log cleared.")
+        return redirect('slow_query_log')
+
+    if request.GET.get('format') == 'json':
+        response = JsonResponse({'entries': slow_queries.entries()})
+        response['Content-Disposition'] = 'attachment; filename="slow_queries.json"'
+        return response
+
+    return render(request, 'main/slow_queries.html', {
+        'entries': slow_queries.entries(limit=100),
+    })
+
+@staff_member_required
+def profiles_view(request):
+    """Switch request profiling on/off and list the saved profiles"""
+    if request.method == 'POST':
+        if 'clear' in request.POST:
+            profiling.delete_all()
+            messages.success(request, "Saved profiles deleted.")
+        else:
+            try:
+                rate = float(request.POST.get('rate') or 0)
+            except ValueError:
+                rate = 0.0
+            url_names = [n.strip() for n in request.POST.get('url_names', '').split(',') if n.strip()]
+            enabled = request.POST.get('enabled') == 'on'
+            profiling.set_config(enabled, rate, url_names)
+            messages.success(request, "Profiling is now %s." % ('ON' if enabled else 'OFF'))
+        return redirect('profiles')
+
+    return render(request, 'main/profiles.html', {
+        'config': profiling.get_config(),
+        'profiles': profiling.list_profiles(),
+    })
+
+@staff_member_required
+def download_profile(request, name):
+    path = profiling.profile_path(name)
+    if path is None:
+        raise Http404("No such profile")
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=name,
+                        content_type='application/octet-stream')
+
 @staff_member_required
 def send_credentials_view(request):
     """
@@ -61,7 +61,13 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    # WhiteNoise + published results, where WhiteNoise asks to be: static
+    # files skip the profiling, query and metrics middleware below
+    'main.middleware.PublishedResultsMiddleware',
+    'main.middleware.ProfilingMiddleware',
+    'main.middleware.SlowQueryMiddleware',
+    'main.middleware.MetricsMiddleware',
+    'main.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -94,14 +100,122 @@ WSGI_APPLICATION = 'voting_software.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Read-only snapshot of the primary, refreshed by main/replica.py
+REPLICA_SNAPSHOT_PATH = BASE_DIR / 'db_replica.sqlite3'
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        # Keep connections open between requests instead of reopening the file
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Seconds a writer waits for the lock before "database is locked"
+            'timeout': 20,
+            # Transactions stay DEFERRED; ballot writes take the write lock
+            # at BEGIN through main.db.write_transaction()
+        },
+        'TEST': {
+            # File-backed so tests can open several connections at once
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    },
+    # Results, lists and dashboards read here (see REPLICA_SNAPSHOT_PATH).
+    # Never migrated; in tests it is just another name for 'default'.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f"file:{REPLICA_SNAPSHOT_PATH}?mode=ro",
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            'timeout': 5,
+        },
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
+}
+
+DATABASE_ROUTERS = ['main.replica.ReplicaRouter']
+
+# Read replica (main/replica.py)
+REPLICA_ENABLED = True
+REPLICA_MAX_STALENESS = 30      # seconds a replica read may lag the primary
+REPLICA_REFRESH_TIMEOUT = 60    # seconds before a stuck refresh is retried
+
+# Sharded ballot store (main/ballot_shards.py). 0 keeps ballots in
+# main_vote; N > 0 spreads them over N SQLite files by voter. Pick this
+# before the election opens - existing ballots are not moved.
+BALLOT_SHARDS = 0
+BALLOT_SHARD_DIR = BASE_DIR / 'ballot_shards'
+BALLOT_SHARD_SYNCHRONOUS = 'NORMAL'  # 'FULL' fsyncs every shard commit
+
+# Append-only ballot ledger (main/ledger.py); replay with `manage.py replay_ledger`
+LEDGER_ENABLED = True
+LEDGER_PATH = BASE_DIR / 'ballots.ledger'
+LEDGER_FSYNC = 'always'         # 'always', 'interval' or 'never'
+LEDGER_FSYNC_INTERVAL = 1.0     # seconds, for 'interval'
+
+# Closed elections archived by `manage.py archive_election` (main/archive.py)
+ELECTION_ARCHIVE_DIR = BASE_DIR / 'archives'
+
+# Applied to every new SQLite connection by main/db.py. WAL is not here:
+# migration 0011 sets it once and the file keeps it.
+SQLITE_PRAGMAS = {
+    'synchronous': 'NORMAL',        # safe with WAL, far fewer fsyncs
+    'busy_timeout': 20000,          # ms to wait for a lock
+    'mmap_size': 268435456,         # 256 MB memory-mapped reads
+    'cache_size': -65536,           # 64 MB page cache (negative = KiB)
+    'temp_store': 'MEMORY',
+}
+
+# Applied instead to connections on the read-only replica
+SQLITE_REPLICA_PRAGMAS = {
+    'query_only': 'ON',
+    'mmap_size': 268435456,
+    'cache_size': -65536,
+    'temp_store': 'MEMORY',
 }
 
 
+# Cache
+# Per-process memory cache. Cached entries are keyed on versions kept in
+# the shared store, so workers never serve each other's stale copies.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'voting-software',
+    },
+    # Results pages and their computed contexts (main/results_cache.py);
+    # on disk so every worker shares one copy per results version
+    'results': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': str(BASE_DIR / 'results_cache'),
+        'OPTIONS': {'MAX_ENTRIES': 200},
+    },
+}
+
+# Rendered ballot markup lives this long (seconds) per ballot version
+BALLOT_CACHE_TIMEOUT = 86400
+# Cached results pages live this long per results version; a worker
+# waits at most RESULTS_CACHE_LOCK_TIMEOUT for another one to compute them
+RESULTS_CACHE_TIMEOUT = 3600
+RESULTS_CACHE_LOCK_TIMEOUT = 30
+
+# Results PDFs, one per results version (main/results_pdf.py); a download
+# waits up to RESULTS_PDF_WAIT seconds for a build before getting a 503
+RESULTS_PDF_DIR = BASE_DIR / 'results_pdf'
+RESULTS_PDF_WAIT = 20
+
+# Final results, rendered once when the election closes (main/publish.py)
+# and served by WhiteNoise as immutable files under PUBLISHED_RESULTS_URL.
+# vote_results serves the published page for PUBLISHED_RESULTS_MAX_AGE
+# seconds before a browser checks it again.
+PUBLISHED_RESULTS_DIR = BASE_DIR / 'published'
+PUBLISHED_RESULTS_URL = '/published/'
+PUBLISHED_RESULTS_MAX_AGE = 3600
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -147,11 +261,29 @@ import os  # Make sure this is at the top with other imports
 # Media files (User uploaded images, candidate photos, etc.)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Square thumbnail sizes (px) generated for candidate photos on the ballot
+THUMBNAIL_SIZES = (100, 200)
+# Browser cache lifetime for media that is not content-hashed
+MEDIA_CACHE_MAX_AGE = 3600
+# Set to 'X-Accel-Redirect' (nginx) or 'X-Sendfile' (Apache) to let the
+# front server stream media; the header value is MEDIA_SENDFILE_PREFIX + path
+MEDIA_SENDFILE_HEADER = None
+MEDIA_SENDFILE_PREFIX = '/protected-media/'
 
 # Static files (CSS, JavaScript)
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# Hashed file names and precompressed (.gz/.br) copies at collectstatic time
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage',
+    },
+}
+# Unhashed static URLs keep WhiteNoise's short default max-age; the
+# hashed names written by collectstatic are already served as immutable
 
 # Add this for local development
 if DEBUG:
@@ -160,7 +292,40 @@ if DEBUG:
     ]
 # ====================================================
 
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# ============== SHARED STATE / ADMISSION CONTROL ==============
+# Small SQLite file used for state every gunicorn worker must agree on
+SHARED_STORE_PATH = os.path.join(BASE_DIR, 'shared_store.sqlite3')
+
+# Virtual waiting room in front of the ballot
+VOTE_ADMISSION_ENABLED = True
+VOTE_ADMISSION_CAPACITY = 50         # ballots open at the same time
+VOTE_ADMISSION_SLOT_TTL = 600        # seconds before an abandoned ballot frees its slot
+VOTE_ADMISSION_TICKET_TTL = 30       # drop queued voters who stop polling
+VOTE_ADMISSION_POLL_INTERVAL = 5     # seconds between waiting room polls
+VOTE_ADMISSION_DEFAULT_HOLD = 90     # assumed seconds per ballot until we have real data
+
+# Per-view latency/SQL/size metrics, exported at /main/metrics/ (staff only)
+METRICS_ENABLED = True
+METRICS_FLUSH_INTERVAL = 5           # seconds between pushes to the shared store
+
+# Slow-query log with EXPLAIN plans, viewable at /main/slow_queries/ (staff only)
+SLOW_QUERY_LOG_ENABLED = True
+SLOW_QUERY_REQUEST_SECONDS = 0.5     # request latency that counts as slow
+SLOW_QUERY_DB_SECONDS = 0.2          # total SQL time per request that counts as slow
+SLOW_QUERY_STATEMENT_SECONDS = 0.05  # any single statement slower than this is logged
+SLOW_QUERY_TOP_N = 3                 # statements logged from a slow request
+SLOW_QUERY_LOG_SIZE = 500            # ring buffer size
+
+# Sampling profiler, switched on/off by staff at /main/profiles/
+PROFILING_DIR = os.path.join(BASE_DIR, 'profiles')
+PROFILING_CONFIG_TTL = 2             # seconds a worker trusts its copy of the on/off switch
+PROFILING_MAX_FILES = 200            # oldest .prof files are deleted beyond this
+
+# Live results/turnout stream (server-sent events) at /main/live/ (staff only, ASGI only)
+LIVE_POLL_INTERVAL = 1               # seconds between the producer's checks for new ballots
+LIVE_KEEPALIVE = 15                  # seconds between keep-alive comments on an idle stream
+LIVE_QUEUE_SIZE = 16                 # events buffered per screen before it is resent a snapshot
+# ====================================================
 
 # Email Configuration
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'